@@ -0,0 +1,25 @@
+"""Index invoice student and student class lookups
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Tables are created by Base.metadata.create_all; these migrations bring
+    # existing databases up to date, so every step tolerates a fresh schema.
+    op.create_index('ix_invoices_student_id', 'invoices', ['student_id'], if_not_exists=True)
+    op.create_index('ix_students_class_id', 'students', ['class_id'], if_not_exists=True)
+
+def downgrade() -> None:
+    op.drop_index('ix_students_class_id', table_name='students', if_exists=True)
+    op.drop_index('ix_invoices_student_id', table_name='invoices', if_exists=True)
@@ -0,0 +1,31 @@
+"""Unique invoice per student, category and term
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    duplicates = op.get_bind().execute(sa.text(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM invoices WHERE term IS NOT NULL "
+        "GROUP BY student_id, category, term HAVING COUNT(*) > 1) AS dup"
+    )).scalar()
+    if duplicates:
+        raise RuntimeError(
+            f"{duplicates} (student_id, category, term) groups have more than one invoice; "
+            "merge or cancel the duplicates before applying this migration"
+        )
+    op.create_index('uq_invoices_student_category_term', 'invoices',
+                    ['student_id', 'category', 'term'], unique=True, if_not_exists=True)
+
+def downgrade() -> None:
+    op.drop_index('uq_invoices_student_category_term', table_name='invoices', if_exists=True)
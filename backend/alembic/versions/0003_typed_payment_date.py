@@ -0,0 +1,44 @@
+"""Store payments.payment_date as an indexed DATE
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    columns = {c['name']: c for c in sa.inspect(bind).get_columns('payments')}
+    if not isinstance(columns['payment_date']['type'], sa.Date):
+        # Legacy values are ISO strings, sometimes with a time part or empty
+        if bind.dialect.name == 'postgresql':
+            op.alter_column('payments', 'payment_date', type_=sa.Date(),
+                            postgresql_using="NULLIF(substr(payment_date, 1, 10), '')::date")
+        else:
+            # A batch type change would copy through CAST(... AS DATE), which SQLite
+            # evaluates as NUMERIC and truncates to the year, so copy into a new column
+            with op.batch_alter_table('payments') as batch_op:
+                batch_op.add_column(sa.Column('payment_day', sa.Date(), nullable=True))
+            op.execute("UPDATE payments SET payment_day = NULLIF(substr(payment_date, 1, 10), '') "
+                       "WHERE payment_date IS NOT NULL")
+            with op.batch_alter_table('payments') as batch_op:
+                batch_op.drop_column('payment_date')
+                batch_op.alter_column('payment_day', new_column_name='payment_date')
+    op.create_index('ix_payments_payment_date', 'payments', ['payment_date'], if_not_exists=True)
+
+def downgrade() -> None:
+    op.drop_index('ix_payments_payment_date', table_name='payments', if_exists=True)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.alter_column('payments', 'payment_date', type_=sa.String(),
+                        postgresql_using="payment_date::text")
+    else:
+        with op.batch_alter_table('payments') as batch_op:
+            batch_op.alter_column('payment_date', type_=sa.String(), existing_nullable=True)
@@ -0,0 +1,55 @@
+"""Append-only student ledger with opening balances
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 13:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+ENTRY_TYPES = ('OPENING', 'INVOICE', 'PAYMENT', 'DISCOUNT', 'ADJUSTMENT', 'REVERSAL')
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if not sa.inspect(bind).has_table('ledger_entries'):
+        op.create_table(
+            'ledger_entries',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('student_id', sa.Integer(), sa.ForeignKey('students.id'), nullable=False),
+            sa.Column('sequence', sa.Integer(), nullable=False),
+            sa.Column('entry_type', sa.Enum(*ENTRY_TYPES, name='ledgerentrytype'), nullable=False),
+            sa.Column('invoice_id', sa.Integer()),
+            sa.Column('payment_id', sa.Integer()),
+            sa.Column('reference', sa.String()),
+            sa.Column('description', sa.String()),
+            sa.Column('debit', sa.Float(), nullable=False),
+            sa.Column('credit', sa.Float(), nullable=False),
+            sa.Column('balance', sa.Float(), nullable=False),
+            sa.Column('created_by', sa.Integer(), sa.ForeignKey('users.id')),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.UniqueConstraint('student_id', 'sequence', name='uq_ledger_entries_student_sequence'),
+        )
+    op.create_index('ix_ledger_entries_id', 'ledger_entries', ['id'], if_not_exists=True)
+    op.create_index('ix_ledger_entries_student_created', 'ledger_entries', ['student_id', 'created_at'],
+                    if_not_exists=True)
+
+    # Open every existing account at what its invoices say is owed today
+    bind.execute(sa.text(
+        "INSERT INTO ledger_entries (student_id, sequence, entry_type, description, debit, credit, balance) "
+        "SELECT student_id, 1, 'OPENING', 'Opening balance', "
+        "CASE WHEN owed > 0 THEN owed ELSE 0 END, CASE WHEN owed < 0 THEN -owed ELSE 0 END, owed "
+        "FROM (SELECT student_id, SUM(amount - COALESCE(amount_paid, 0)) AS owed FROM invoices "
+        "WHERE status IS NULL OR status <> 'CANCELLED' GROUP BY student_id) AS accounts "
+        "WHERE owed <> 0 AND student_id NOT IN (SELECT student_id FROM ledger_entries)"
+    ))
+
+def downgrade() -> None:
+    op.drop_table('ledger_entries')
+    sa.Enum(name='ledgerentrytype').drop(op.get_bind(), checkfirst=True)
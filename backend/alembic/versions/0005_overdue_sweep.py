@@ -0,0 +1,30 @@
+"""Late-fee link and status/due-date index for the overdue sweep
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 15:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('invoices')}
+    if 'late_fee_for_id' not in columns:
+        with op.batch_alter_table('invoices') as batch_op:
+            batch_op.add_column(sa.Column('late_fee_for_id', sa.Integer(), nullable=True))
+            batch_op.create_foreign_key('fk_invoices_late_fee_for_id', 'invoices', ['late_fee_for_id'], ['id'])
+    op.create_index('uq_invoices_late_fee_for_id', 'invoices', ['late_fee_for_id'], unique=True, if_not_exists=True)
+    op.create_index('ix_invoices_status_due_date', 'invoices', ['status', 'due_date'], if_not_exists=True)
+
+def downgrade() -> None:
+    op.drop_index('ix_invoices_status_due_date', table_name='invoices', if_exists=True)
+    op.drop_index('uq_invoices_late_fee_for_id', table_name='invoices', if_exists=True)
+    with op.batch_alter_table('invoices') as batch_op:
+        batch_op.drop_column('late_fee_for_id')
@@ -0,0 +1,26 @@
+"""Unique attendance mark per student and day
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 17:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Marking a class twice used to add a second row; the latest mark is the one that stands
+    op.get_bind().execute(sa.text(
+        "DELETE FROM attendance WHERE id NOT IN "
+        "(SELECT keep FROM (SELECT MAX(id) AS keep FROM attendance GROUP BY student_id, date) AS latest)"
+    ))
+    op.create_index('uq_attendance_student_date', 'attendance', ['student_id', 'date'], unique=True, if_not_exists=True)
+
+def downgrade() -> None:
+    op.drop_index('uq_attendance_student_date', table_name='attendance', if_exists=True)
@@ -0,0 +1,25 @@
+"""Attendance synced_at as the offline sync clock
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 19:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    # Marks written before every write stamped synced_at would never be pulled by a tablet
+    op.get_bind().execute(sa.text(
+        "UPDATE attendance SET synced_at = COALESCE(recorded_at, CURRENT_TIMESTAMP) WHERE synced_at IS NULL"
+    ))
+    op.create_index('ix_attendance_class_id_synced_at', 'attendance', ['class_id', 'synced_at'], if_not_exists=True)
+
+def downgrade() -> None:
+    op.drop_index('ix_attendance_class_id_synced_at', table_name='attendance', if_exists=True)
@@ -0,0 +1,28 @@
+"""Low-attendance threshold and window in the school settings
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 20:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('school_settings')}
+    with op.batch_alter_table('school_settings') as batch_op:
+        if 'low_attendance_threshold' not in columns:
+            batch_op.add_column(sa.Column('low_attendance_threshold', sa.Float(), nullable=True))
+        if 'low_attendance_window_days' not in columns:
+            batch_op.add_column(sa.Column('low_attendance_window_days', sa.Integer(), nullable=True))
+
+def downgrade() -> None:
+    with op.batch_alter_table('school_settings') as batch_op:
+        batch_op.drop_column('low_attendance_window_days')
+        batch_op.drop_column('low_attendance_threshold')
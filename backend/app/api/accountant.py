@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
-from app.core.database import get_db
+from sqlalchemy.exc import IntegrityError
+from app.core import dates
+from app.core.database import SessionLocal, get_db, dialect_insert
 from app.core.security import get_current_user
 from app.models import *
 from app.models.user import UserRole
-from app.models.fee import PaymentCategory, InvoiceStatus
-from datetime import datetime, date, timedelta
+from app.models.assessment import Term
+from app.models.fee import PaymentCategory, InvoiceStatus, LedgerEntryType
+from app.models.reconciliation import StatementLineStatus
+from app.services import aging, discounts, documents, exports, finance_summary, forecast, invoicing, ledger, mobile_money, overdue, payments, reconciliation, sequences
+from datetime import datetime, date
 from typing import Optional
 
 router = APIRouter(prefix="/accountant", tags=["accountant"])
@@ -20,30 +26,17 @@ def require_accountant(current_user: User = Depends(get_current_user)):
 @router.get("/dashboard")
 async def get_accountant_dashboard(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
     today = date.today()
-    this_month_start = date(today.year, today.month, 1)
     
-    # Financial overview
-    total_revenue = db.query(func.sum(Payment.amount)).scalar() or 0
-    monthly_revenue = db.query(func.sum(Payment.amount)).filter(Payment.payment_date >= this_month_start).scalar() or 0
-    total_outstanding = db.query(func.sum(Invoice.amount - Invoice.amount_paid)).filter(Invoice.status != InvoiceStatus.PAID).scalar() or 0
-    
-    # Invoice statistics
-    total_invoices = db.query(Invoice).count()
-    paid_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.PAID).count()
-    pending_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.PENDING).count()
-    partial_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.PARTIAL).count()
-    overdue_invoices = db.query(Invoice).filter(and_(Invoice.status != InvoiceStatus.PAID, Invoice.due_date < today)).count()
+    # Financial overview and invoice statistics come from the finance_summary rollup
+    summary = finance_summary.load_finance_summary(db, today)
+    overall = summary["overall"]
+    total_revenue = overall.total_collected
+    monthly_revenue = summary["month"].total_collected if summary["month"] else 0
+    total_outstanding = overall.total_outstanding
     
     # Recent payments
     recent_payments = db.query(Payment).order_by(Payment.id.desc()).limit(10).all()
     
-    # Payment methods breakdown
-    payment_methods = db.query(
-        Payment.payment_method,
-        func.count(Payment.id).label('count'),
-        func.sum(Payment.amount).label('total')
-    ).group_by(Payment.payment_method).all()
-    
     return {
         "overview": {
             "total_revenue": total_revenue,
@@ -52,11 +45,11 @@ async def get_accountant_dashboard(db: Session = Depends(get_db), user: User = D
             "collection_rate": round((total_revenue / (total_revenue + total_outstanding) * 100) if (total_revenue + total_outstanding) > 0 else 0, 1)
         },
         "invoices": {
-            "total": total_invoices,
-            "paid": paid_invoices,
-            "pending": pending_invoices,
-            "partial": partial_invoices,
-            "overdue": overdue_invoices
+            "total": overall.invoice_count,
+            "paid": overall.paid_count,
+            "pending": overall.pending_count,
+            "partial": overall.partial_count,
+            "overdue": overall.overdue_count
         },
         "recent_payments": [{
             "id": p.id,
@@ -65,7 +58,30 @@ async def get_accountant_dashboard(db: Session = Depends(get_db), user: User = D
             "method": p.payment_method,
             "date": p.payment_date
         } for p in recent_payments],
-        "payment_methods": [{"method": pm[0], "count": pm[1], "total": pm[2]} for pm in payment_methods]
+        "payment_methods": [{
+            "method": row.scope.split(":", 1)[1],
+            "count": row.payment_count,
+            "total": row.total_collected
+        } for row in summary["methods"]]
+    }
+
+@router.post("/finance-summary/rebuild")
+async def rebuild_finance_summary(background_tasks: BackgroundTasks, user: User = Depends(require_accountant)):
+    # Drift repair: recompute the rollup from invoices and payments off the request thread
+    background_tasks.add_task(finance_summary.rebuild_in_background)
+    return {"message": "Finance summary rebuild queued"}
+
+@router.post("/invoices/sweep-overdue")
+async def sweep_overdue_invoices(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    # On-demand run of the daily job; safe to repeat, late fees are raised once per invoice
+    run = overdue.sweep(db, user_id=user.id)
+    return {
+        "message": "Overdue sweep completed",
+        "date": str(run.run_date),
+        "marked_overdue": run.marked_overdue,
+        "reopened": run.reopened,
+        "late_fees": run.late_fee_count,
+        "late_fee_total": run.late_fee_total
     }
 
 # INVOICES
@@ -73,49 +89,68 @@ async def get_accountant_dashboard(db: Session = Depends(get_db), user: User = D
 async def get_all_invoices(
     status: Optional[str] = None,
     class_id: Optional[int] = None,
+    term: Optional[str] = None,
+    category: Optional[str] = None,
+    due_from: Optional[str] = None,
+    due_to: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
     db: Session = Depends(get_db),
     user: User = Depends(require_accountant)
 ):
-    query = db.query(Invoice)
-    
-    if status:
-        query = query.filter(Invoice.status == status)
-    if class_id:
-        query = query.filter(Invoice.student_id.in_(
-            db.query(Student.id).filter(Student.class_id == class_id)
+    # One joined query projecting only the listed columns, paginated on (id DESC):
+    # pass the returned next_cursor back to fetch the following page
+    query = db.query(
+        Invoice.id, Invoice.invoice_number, Invoice.student_id, Invoice.category, Invoice.term,
+        Invoice.amount, Invoice.amount_paid, Invoice.status, Invoice.due_date, Invoice.created_at,
+        Student.first_name, Student.last_name, Class.name.label("class_name")
+    ).join(Student, Student.id == Invoice.student_id).outerjoin(Class, Class.id == Student.class_id)
+    
+    try:
+        if status:
+            query = query.filter(Invoice.status == InvoiceStatus(status))
+        if category:
+            query = query.filter(Invoice.category == PaymentCategory(category))
+        query = query.filter(*dates.through(
+            Invoice.due_date,
+            datetime.strptime(due_from, "%Y-%m-%d").date() if due_from else None,
+            datetime.strptime(due_to, "%Y-%m-%d").date() if due_to else None
         ))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if class_id:
+        query = query.filter(Student.class_id == class_id)
+    if term:
+        query = query.filter(Invoice.term == term)
+    if cursor:
+        query = query.filter(Invoice.id < cursor)
     
-    invoices = query.order_by(Invoice.id.desc()).all()
-    
-    result = []
-    for i in invoices:
-        student = db.query(Student).filter(Student.id == i.student_id).first()
-        if student:
-            class_obj = db.query(Class).filter(Class.id == student.class_id).first()
-            result.append({
-                "id": i.id,
-                "invoice_number": i.invoice_number,
-                "student_id": i.student_id,
-                "student_name": f"{student.first_name} {student.last_name}",
-                "class": class_obj.name if class_obj else "N/A",
-                "category": i.category,
-                "term": i.term,
-                "amount": i.amount,
-                "amount_paid": i.amount_paid,
-                "balance": i.amount - i.amount_paid,
-                "status": i.status,
-                "due_date": str(i.due_date) if i.due_date else None,
-                "created_at": str(i.created_at) if i.created_at else None
-            })
+    rows = query.order_by(Invoice.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
-    return result
+    return {
+        "items": [{
+            "id": r.id,
+            "invoice_number": r.invoice_number,
+            "student_id": r.student_id,
+            "student_name": f"{r.first_name} {r.last_name}",
+            "class": r.class_name or "N/A",
+            "category": r.category,
+            "term": r.term,
+            "amount": r.amount,
+            "amount_paid": r.amount_paid,
+            "balance": r.amount - (r.amount_paid or 0),
+            "status": r.status,
+            "due_date": str(r.due_date) if r.due_date else None,
+            "created_at": str(r.created_at) if r.created_at else None
+        } for r in rows],
+        "next_cursor": rows[-1].id if has_more else None
+    }
 
 @router.post("/invoices")
 async def create_invoice(invoice_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    # Generate invoice number
-    last_invoice = db.query(Invoice).order_by(Invoice.id.desc()).first()
-    next_id = (last_invoice.id + 1) if last_invoice else 1
-    invoice_number = f"INV-2024-{next_id:05d}"
+    invoice_number = sequences.next_number(db, "invoice")
     
     invoice = Invoice(
         invoice_number=invoice_number,
@@ -129,7 +164,13 @@ async def create_invoice(invoice_data: dict, db: Session = Depends(get_db), user
         created_by=user.id
     )
     db.add(invoice)
-    db.commit()
+    try:
+        finance_summary.record_invoice_change(db, None, invoice)
+        ledger.record_invoice_change(db, invoice, 0.0, LedgerEntryType.INVOICE, created_by=user.id)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="An invoice for this student, category and term already exists")
     db.refresh(invoice)
     
     return {"message": "Invoice created successfully", "invoice_id": invoice.id, "invoice_number": invoice_number}
@@ -140,6 +181,8 @@ async def update_invoice(invoice_id: int, invoice_data: dict, db: Session = Depe
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    before = finance_summary.invoice_snapshot(invoice)
+    before_balance = ledger.invoice_balance(invoice)
     if "status" in invoice_data:
         new_status = invoice_data["status"]
         # Validate status change matches payment data
@@ -157,6 +200,8 @@ async def update_invoice(invoice_id: int, invoice_data: dict, db: Session = Depe
         else:
             invoice.status = InvoiceStatus.PENDING
     
+    finance_summary.record_invoice_change(db, before, invoice)
+    ledger.record_invoice_change(db, invoice, before_balance, LedgerEntryType.ADJUSTMENT, "Invoice updated", user.id)
     db.commit()
     return {"message": "Invoice updated successfully"}
 
@@ -166,7 +211,11 @@ async def delete_invoice(invoice_id: int, db: Session = Depends(get_db), user: U
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    before = finance_summary.invoice_snapshot(invoice)
+    before_balance = ledger.invoice_balance(invoice)
     db.delete(invoice)
+    finance_summary.record_invoice_change(db, before, None)
+    ledger.record_invoice_change(db, invoice, before_balance, LedgerEntryType.REVERSAL, "Invoice deleted", user.id, removed=True)
     db.commit()
     return {"message": "Invoice deleted successfully"}
 
@@ -179,45 +228,67 @@ async def send_invoice_notification(invoice_id: int, notification_data: dict, db
     # In production, integrate with email/SMS service
     return {"message": "Notification sent successfully", "recipient": notification_data.get("recipient")}
 
+@router.get("/invoices/{invoice_id}/pdf")
+async def get_invoice_pdf(invoice_id: int, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    docs = documents.invoice_documents(db, [invoice_id])
+    if not docs:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    path = await documents.render("invoice", docs)
+    return FileResponse(path, media_type="application/pdf", filename=f"{docs[0]['number']}.pdf")
+
+@router.post("/invoices/print")
+async def print_invoices(print_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    # Every unpaid, uncancelled invoice of a class and/or term as one merged PDF (one page each) or a zip of single PDFs
+    output = print_data.get("format", "pdf")
+    if output not in ("pdf", "zip"):
+        raise HTTPException(status_code=400, detail="format must be pdf or zip")
+    if not print_data.get("class_id") and not print_data.get("term"):
+        raise HTTPException(status_code=400, detail="class_id or term is required")
+    docs = documents.invoice_documents(db, class_id=print_data.get("class_id"), term=print_data.get("term"))
+    if not docs:
+        raise HTTPException(status_code=404, detail="No invoices to print")
+    db.close()  # rendering can take a while and needs nothing more from the database
+    
+    filename = f"invoices-{print_data.get('term') or 'all-terms'}" + (f"-class-{print_data['class_id']}" if print_data.get("class_id") else "")
+    if output == "zip":
+        path = await documents.render_zip("invoice", docs, [doc["number"] for doc in docs])
+        return FileResponse(path, media_type="application/zip", filename=f"{filename}.zip")
+    path = await documents.render("invoice", docs)
+    return FileResponse(path, media_type="application/pdf", filename=f"{filename}.pdf")
+
 @router.post("/invoices/bulk")
 async def create_bulk_invoices(bulk_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    # Create invoices for multiple students
+    # Create invoices for every student (or every student in a class) that has none for this category and term
     class_id = bulk_data.get("class_id")
-    category = bulk_data["category"]
+    try:
+        category = PaymentCategory(bulk_data["category"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     term = bulk_data["term"]
     amount = bulk_data["amount"]
     due_date = datetime.strptime(bulk_data["due_date"], "%Y-%m-%d").date()
     
-    students = db.query(Student).filter(Student.class_id == class_id).all() if class_id else db.query(Student).all()
-    
-    last_invoice = db.query(Invoice).order_by(Invoice.id.desc()).first()
-    next_id = (last_invoice.id + 1) if last_invoice else 1
-    
-    created_count = 0
-    for student in students:
-        # Check if invoice already exists
-        existing = db.query(Invoice).filter(
-            and_(Invoice.student_id == student.id, Invoice.category == category, Invoice.term == term)
-        ).first()
-        
-        if not existing:
-            invoice = Invoice(
-                invoice_number=f"INV-2024-{next_id:05d}",
-                student_id=student.id,
-                category=category,
-                term=term,
-                amount=amount,
-                amount_paid=0,
-                status=InvoiceStatus.PENDING,
-                due_date=due_date,
-                created_by=user.id
-            )
-            db.add(invoice)
-            next_id += 1
-            created_count += 1
+    # Single existence probe: each targeted student with a flag for an existing invoice
+    has_invoice = db.query(Invoice.id).filter(
+        and_(Invoice.student_id == Student.id, Invoice.category == category, Invoice.term == term)
+    ).exists()
+    query = db.query(Student.id, has_invoice.label("has_invoice"))
+    if class_id:
+        query = query.filter(Student.class_id == class_id)
+    targets = query.order_by(Student.id).all()
+    student_ids = [t.id for t in targets if not t.has_invoice]
+    
+    # One multi-row INSERT; the unique (student_id, category, term) index makes reruns no-ops
+    created_count = invoicing.create_invoices(db, [{
+        "student_id": student_id, "category": category, "term": term, "amount": amount, "due_date": due_date
+    } for student_id in student_ids], user.id)
     
     db.commit()
-    return {"message": f"Created {created_count} invoices successfully"}
+    return {
+        "message": f"Created {created_count} invoices successfully",
+        "created": created_count,
+        "skipped": len(targets) - created_count
+    }
 
 # PAYMENTS
 @router.get("/payments")
@@ -233,178 +304,452 @@ async def get_all_payments(db: Session = Depends(get_db), user: User = Depends(r
         "payment_date": p.payment_date
     } for p in payments]
 
+def _payment_date(payment_data: dict) -> date:
+    try:
+        return datetime.strptime(payment_data["payment_date"], "%Y-%m-%d").date() if payment_data.get("payment_date") else date.today()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="payment_date must be YYYY-MM-DD")
+
 @router.post("/payments")
 async def record_payment(payment_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
     invoice = db.query(Invoice).filter(Invoice.id == payment_data["invoice_id"]).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Generate receipt number
-    last_payment = db.query(Payment).order_by(Payment.id.desc()).first()
-    next_id = (last_payment.id + 1) if last_payment else 1
-    receipt_number = f"RCP-2024-{next_id:05d}"
-    
-    payment_amount = float(payment_data["amount"])
-    remaining_balance = invoice.amount - invoice.amount_paid
-    
-    if payment_amount > remaining_balance:
-        raise HTTPException(status_code=400, detail="Payment amount exceeds remaining balance")
-    
-    # Create payment record
-    payment = Payment(
-        receipt_number=receipt_number,
-        invoice_id=invoice.id,
-        amount=payment_amount,
-        payment_method=payment_data["payment_method"],
-        payment_date=payment_data.get("payment_date", date.today().isoformat()),
-        recorded_by=user.id
-    )
-    db.add(payment)
+    # A one-invoice allocation: the invoice is credited in the database, not read-modified-written
+    try:
+        result = payments.allocate(db, payment_data["amount"], payment_data["payment_method"], invoice_ids=[invoice.id],
+                                   payment_date=_payment_date(payment_data), user_id=user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Update invoice
-    invoice.amount_paid += payment_amount
-    if invoice.amount_paid >= invoice.amount:
-        invoice.status = InvoiceStatus.PAID
-    elif invoice.amount_paid > 0:
-        invoice.status = InvoiceStatus.PARTIAL
+    return {
+        "message": "Payment recorded successfully",
+        "receipt_number": result["receipt_number"],
+        "remaining_balance": result["allocations"][0]["remaining_balance"]
+    }
+
+@router.post("/payments/allocate")
+async def allocate_payment(payment_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    """Spread one payment over a student's or a guardian's open invoices, oldest due date first."""
+    if payment_data.get("guardian_id"):
+        if not db.query(Guardian).filter(Guardian.id == payment_data["guardian_id"]).first():
+            raise HTTPException(status_code=404, detail="Guardian not found")
+        student_ids = payments.guardian_student_ids(db, payment_data["guardian_id"])
+    elif payment_data.get("student_id"):
+        if not db.query(Student).filter(Student.id == payment_data["student_id"]).first():
+            raise HTTPException(status_code=404, detail="Student not found")
+        student_ids = [payment_data["student_id"]]
+    else:
+        raise HTTPException(status_code=400, detail="student_id or guardian_id is required")
+    
+    try:
+        result = payments.allocate(db, payment_data["amount"], payment_data["payment_method"], student_ids=student_ids,
+                                   payment_date=_payment_date(payment_data), user_id=user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"message": "Payment allocated successfully", **result}
+
+@router.get("/payments/{payment_id}/receipt")
+async def get_payment_receipt(payment_id: int, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    doc = documents.receipt_document(db, payment_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    path = await documents.render("receipt", [doc])
+    return FileResponse(path, media_type="application/pdf", filename=f"{doc['number']}.pdf")
+
+# STATEMENT RECONCILIATION
+@router.post("/reconciliation/import")
+async def import_statement(source: str = Form(...), file: UploadFile = File(...), db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    if source not in reconciliation.SOURCES:
+        raise HTTPException(status_code=400, detail=f"source must be one of: {', '.join(reconciliation.SOURCES)}")
+    try:
+        statement = reconciliation.import_statement(db, file.file, file.filename or "statement.csv", source, user.id)
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
     
-    db.commit()
-    db.refresh(payment)
+    return {
+        "import_id": statement.id,
+        "lines": statement.line_count,
+        "matched": statement.matched_count,
+        "matched_amount": statement.matched_amount,
+        "review": statement.review_count,
+        "ignored": statement.ignored_count,
+        "duplicates": statement.duplicate_count
+    }
+
+@router.get("/reconciliation/imports")
+async def get_statement_imports(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    imports = db.query(StatementImport).order_by(StatementImport.id.desc()).limit(50).all()
+    return [{
+        "id": i.id,
+        "source": i.source,
+        "filename": i.filename,
+        "lines": i.line_count,
+        "matched": i.matched_count,
+        "matched_amount": i.matched_amount,
+        "review": i.review_count,
+        "created_at": str(i.created_at) if i.created_at else None
+    } for i in imports]
+
+@router.get("/reconciliation/review")
+async def get_review_queue(
+    import_id: Optional[int] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    user: User = Depends(require_accountant)
+):
+    query = db.query(StatementLine, Invoice.invoice_number).outerjoin(
+        Invoice, StatementLine.invoice_id == Invoice.id
+    ).filter(StatementLine.status == StatementLineStatus.REVIEW)
+    if import_id:
+        query = query.filter(StatementLine.import_id == import_id)
+    if cursor:
+        query = query.filter(StatementLine.id > cursor)
+    rows = query.order_by(StatementLine.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
     return {
-        "message": "Payment recorded successfully",
-        "receipt_number": receipt_number,
-        "remaining_balance": invoice.amount - invoice.amount_paid
+        "items": [{
+            "id": line.id,
+            "import_id": line.import_id,
+            "line_number": line.line_number,
+            "source": line.source,
+            "transaction_id": line.transaction_id,
+            "date": str(line.transaction_date) if line.transaction_date else None,
+            "amount": line.amount,
+            "reference": line.reference,
+            "phone": line.phone,
+            "payer_name": line.payer_name,
+            "note": line.note,
+            "suggested_invoice": invoice_number
+        } for line, invoice_number in rows],
+        "next_cursor": rows[-1][0].id if has_more else None
     }
 
+@router.post("/reconciliation/lines/{line_id}/resolve")
+async def resolve_statement_line(line_id: int, resolve_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    line = db.query(StatementLine).filter(StatementLine.id == line_id).first()
+    if not line:
+        raise HTTPException(status_code=404, detail="Statement line not found")
+    invoice = db.query(Invoice).filter(Invoice.id == resolve_data.get("invoice_id")).first()
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    try:
+        payment = reconciliation.resolve_line(db, line, invoice, user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"message": "Statement line posted", "receipt_number": payment.receipt_number}
+
+@router.post("/reconciliation/lines/{line_id}/ignore")
+async def ignore_statement_line(line_id: int, ignore_data: Optional[dict] = None, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    line = db.query(StatementLine).filter(StatementLine.id == line_id).first()
+    if not line:
+        raise HTTPException(status_code=404, detail="Statement line not found")
+    
+    try:
+        reconciliation.ignore_line(db, line, (ignore_data or {}).get("note"), user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {"message": "Statement line ignored"}
+
 # FEE STRUCTURES
 @router.get("/fee-structures")
 async def get_fee_structures(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    fee_structures = db.query(FeeStructure).all()
+    rows = db.query(FeeStructure, Class.name).outerjoin(Class, Class.id == FeeStructure.class_id).order_by(
+        FeeStructure.term, Class.name, FeeStructure.category
+    ).all()
     return [{
         "id": fs.id,
-        "name": fs.name,
+        "class_id": fs.class_id,
+        "class_name": class_name or "All classes",
         "category": fs.category,
+        "term": fs.term,
         "amount": fs.amount,
-        "frequency": fs.frequency,
+        "description": fs.description,
+        "is_recurring": fs.is_recurring,
         "is_active": fs.is_active
-    } for fs in fee_structures]
+    } for fs, class_name in rows]
+
+def _fee_structure_fields(db: Session, fee_data: dict) -> dict:
+    """Validated values for the fee-structure fields present in ``fee_data``."""
+    fields = {}
+    try:
+        if "category" in fee_data:
+            fields["category"] = PaymentCategory(fee_data["category"])
+        if fee_data.get("term"):
+            fields["term"] = Term(fee_data["term"]).value
+        elif "term" in fee_data:
+            fields["term"] = None  # none for fees charged every term
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "amount" in fee_data:
+        amount = fee_data["amount"]
+        if isinstance(amount, bool) or not isinstance(amount, (int, float, str)):
+            raise HTTPException(status_code=400, detail="Amount must be a number")
+        try:
+            fields["amount"] = float(amount)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Amount must be a number")
+        if not fields["amount"] > 0:  # also rejects nan
+            raise HTTPException(status_code=400, detail="Amount must be positive")
+    if "class_id" in fee_data:
+        class_id = fee_data["class_id"]  # none applies to every class
+        if class_id and not db.query(Class.id).filter(Class.id == class_id).first():
+            raise HTTPException(status_code=404, detail="Class not found")
+        fields["class_id"] = class_id or None
+    for field in ("is_active", "is_recurring"):
+        if field in fee_data:
+            if not isinstance(fee_data[field], bool):
+                raise HTTPException(status_code=400, detail=f"{field} must be true or false")
+            fields[field] = fee_data[field]
+    if "description" in fee_data:
+        fields["description"] = fee_data["description"]
+    return fields
 
 @router.post("/fee-structures")
 async def create_fee_structure(fee_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    fee_structure = FeeStructure(
-        name=fee_data["name"],
-        category=fee_data["category"],
-        amount=fee_data["amount"],
-        frequency=fee_data.get("frequency", "termly"),
-        is_active=True
-    )
+    for field in ("category", "amount"):
+        if field not in fee_data:
+            raise HTTPException(status_code=400, detail=f"{field} is required")
+    fields = _fee_structure_fields(db, fee_data)
+    fields.setdefault("is_recurring", not fields.get("term"))
+    fields.setdefault("is_active", True)
+    
+    fee_structure = FeeStructure(**fields)
     db.add(fee_structure)
     db.commit()
-    return {"message": "Fee structure created successfully"}
+    return {"message": "Fee structure created successfully", "id": fee_structure.id}
+
+@router.put("/fee-structures/{fee_structure_id}")
+async def update_fee_structure(fee_structure_id: int, fee_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    fee_structure = db.query(FeeStructure).filter(FeeStructure.id == fee_structure_id).first()
+    if not fee_structure:
+        raise HTTPException(status_code=404, detail="Fee structure not found")
+    
+    # Same checks as creating one; term invoicing bills whatever is stored here
+    for field, value in _fee_structure_fields(db, fee_data).items():
+        setattr(fee_structure, field, value)
+    db.commit()
+    return {"message": "Fee structure updated successfully"}
+
+@router.post("/invoices/generate-term")
+async def generate_term_invoices(term_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    # Every invoice the term needs from the active fee structures; dry_run previews totals per class and category
+    due_date = datetime.strptime(term_data["due_date"], "%Y-%m-%d").date() if term_data.get("due_date") else None
+    dry_run = bool(term_data.get("dry_run", False))
+    result = invoicing.generate_term(db, term_data["term"], due_date, term_data.get("class_id"), user.id, dry_run)
+    if term_data.get("apply_discounts") and not dry_run:
+        try:
+            result["discounts"] = discounts.apply_term(db, term_data["term"], user.id)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=f"Invoices were created but discounts were not applied: {e}")
+    return result
 
 # REPORTS
 @router.get("/reports/revenue")
 async def get_revenue_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    interval: str = Query("day", pattern="^(day|week|month)$"),
     db: Session = Depends(get_db),
     user: User = Depends(require_accountant)
 ):
-    query = db.query(Payment)
-    
-    if start_date:
-        query = query.filter(Payment.payment_date >= datetime.strptime(start_date, "%Y-%m-%d").date())
-    if end_date:
-        query = query.filter(Payment.payment_date <= datetime.strptime(end_date, "%Y-%m-%d").date())
-    
-    payments = query.all()
-    total_revenue = sum(p.amount for p in payments)
-    
-    # Group by payment method
-    by_method = {}
-    for p in payments:
-        if p.payment_method not in by_method:
-            by_method[p.payment_method] = 0
-        by_method[p.payment_method] += p.amount
-    
-    # Group by date
-    by_date = {}
-    for p in payments:
-        date_key = str(p.payment_date)
-        if date_key not in by_date:
-            by_date[date_key] = 0
-        by_date[date_key] += p.amount
+    # Totals, method and day/week/month rollups are all computed by the database
+    try:
+        filters = dates.through(
+            Payment.payment_date,
+            datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None,
+            datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    total_revenue, payment_count = db.query(
+        func.coalesce(func.sum(Payment.amount), 0), func.count(Payment.id)
+    ).filter(*filters).one()
+    
+    by_method = db.query(Payment.payment_method, func.sum(Payment.amount)).filter(*filters).group_by(Payment.payment_method).all()
+    period = dates.bucket(db.get_bind(), Payment.payment_date, interval)
+    by_date = db.query(period, func.sum(Payment.amount)).filter(*filters, Payment.payment_date.isnot(None)).group_by(period).order_by(period).all()
     
     return {
         "total_revenue": total_revenue,
-        "payment_count": len(payments),
-        "by_method": by_method,
-        "by_date": by_date
+        "payment_count": payment_count,
+        "by_method": {method: total for method, total in by_method},
+        "by_date": {str(day): total for day, total in by_date}
     }
 
+def _outstanding_details_query(db: Session):
+    # Column projection over a join; the class comes from Student.class_id, not a lazy relationship
+    return db.query(
+        Student.first_name, Student.last_name, Class.name.label("class_name"), Invoice.invoice_number,
+        Invoice.category, Invoice.amount, Invoice.amount_paid, Invoice.due_date
+    ).join(Student, Student.id == Invoice.student_id).outerjoin(Class, Class.id == Student.class_id).filter(
+        Invoice.status != InvoiceStatus.PAID
+    ).order_by(Invoice.id)
+
+def _outstanding_detail(r):
+    return {
+        "student": f"{r.first_name} {r.last_name}",
+        "class": r.class_name or "N/A",
+        "invoice_number": r.invoice_number,
+        "category": r.category.value if hasattr(r.category, 'value') else r.category,
+        "amount": r.amount,
+        "paid": r.amount_paid or 0,
+        "balance": r.amount - (r.amount_paid or 0),
+        "due_date": r.due_date
+    }
+
+OUTSTANDING_EXPORT_COLUMNS = [
+    ("Student", "student"), ("Class", "class"), ("Invoice", "invoice_number"), ("Category", "category"),
+    ("Amount", "amount"), ("Paid", "paid"), ("Balance", "balance"), ("Due Date", "due_date")
+]
+
+def _outstanding_export_rows():
+    # Streaming outlives the request's dependency scope, so the generator owns its session
+    db = SessionLocal()
+    try:
+        for r in _outstanding_details_query(db).yield_per(500):
+            detail = _outstanding_detail(r)
+            detail["due_date"] = detail["due_date"].date() if detail["due_date"] else None
+            yield [detail[key] for _, key in OUTSTANDING_EXPORT_COLUMNS]
+    finally:
+        db.close()
+
 @router.get("/reports/outstanding")
 async def get_outstanding_report(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    invoices = db.query(Invoice).filter(Invoice.status != InvoiceStatus.PAID).join(Student).join(Class).all()
+    balance = Invoice.amount - func.coalesce(Invoice.amount_paid, 0)
+    unpaid = Invoice.status != InvoiceStatus.PAID
     
-    total_outstanding = sum(i.amount - i.amount_paid for i in invoices)
+    total_outstanding, invoice_count = db.query(func.coalesce(func.sum(balance), 0), func.count(Invoice.id)).filter(unpaid).one()
     
     # Group by class
-    by_class = {}
-    for i in invoices:
-        class_name = i.student.class_obj.name
-        if class_name not in by_class:
-            by_class[class_name] = 0
-        by_class[class_name] += (i.amount - i.amount_paid)
+    by_class = db.query(func.coalesce(Class.name, "N/A"), func.sum(balance)).select_from(Invoice).join(
+        Student, Student.id == Invoice.student_id
+    ).outerjoin(Class, Class.id == Student.class_id).filter(unpaid).group_by(Class.name).all()
     
     # Group by category
-    by_category = {}
-    for i in invoices:
-        if i.category not in by_category:
-            by_category[i.category] = 0
-        by_category[i.category] += (i.amount - i.amount_paid)
+    by_category = db.query(Invoice.category, func.sum(balance)).filter(unpaid).group_by(Invoice.category).all()
     
     return {
         "total_outstanding": total_outstanding,
-        "invoice_count": len(invoices),
-        "by_class": by_class,
-        "by_category": by_category,
-        "details": [{
-            "student": f"{i.student.first_name} {i.student.last_name}",
-            "class": i.student.class_obj.name,
-            "invoice_number": i.invoice_number,
-            "category": i.category,
-            "amount": i.amount,
-            "paid": i.amount_paid,
-            "balance": i.amount - i.amount_paid,
-            "due_date": i.due_date
-        } for i in invoices]
+        "invoice_count": invoice_count,
+        "by_class": {name: total for name, total in by_class},
+        "by_category": {(c.value if hasattr(c, 'value') else c): total for c, total in by_category},
+        "details": [_outstanding_detail(r) for r in _outstanding_details_query(db)]
     }
 
+@router.get("/reports/outstanding/export")
+async def export_outstanding_report(
+    format: str = Query("csv", pattern="^(csv|xlsx)$"),
+    user: User = Depends(require_accountant)
+):
+    filename = f"outstanding-fees-{date.today().isoformat()}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    header = [title for title, _ in OUTSTANDING_EXPORT_COLUMNS]
+    if format == "xlsx":
+        return StreamingResponse(
+            exports.stream_xlsx("Outstanding Fees", header, _outstanding_export_rows()),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=headers
+        )
+    return StreamingResponse(exports.stream_csv(header, _outstanding_export_rows()), media_type="text/csv", headers=headers)
+
+@router.get("/reports/aging")
+async def get_aging_report(
+    class_id: Optional[int] = None,
+    category: Optional[str] = None,
+    snapshot: bool = False,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_accountant)
+):
+    # Open balances by days past due; snapshot=true reads the copy saved by the last overdue sweep
+    try:
+        if snapshot:
+            saved = aging.load_snapshot(db, class_id, category)
+            if saved:
+                return saved
+        return aging.report(db, date.today(), class_id, category)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/reports/aging/students")
+async def get_aging_students(
+    class_id: Optional[int] = None,
+    category: Optional[str] = None,
+    bucket: Optional[str] = Query(None, pattern="^(current|0_30|31_60|61_90|90_plus)$"),
+    limit: int = Query(100, ge=1, le=500),
+    db: Session = Depends(get_db),
+    user: User = Depends(require_accountant)
+):
+    try:
+        return aging.students(db, date.today(), class_id, category, bucket, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/reports/cash-flow-forecast")
+async def get_cash_flow_forecast(
+    weeks: Optional[int] = Query(None, ge=1, le=52),
+    db: Session = Depends(get_db),
+    user: User = Depends(require_accountant)
+):
+    # Expected collections per week to the end of the active term (or the next `weeks` weeks)
+    return forecast.cached_projection(db, date.today(), weeks)
+
 @router.get("/reports/collection-rate")
-async def get_collection_rate(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    # Calculate collection rate by class
-    classes = db.query(Class).all()
-    
-    results = []
-    for cls in classes:
-        students = db.query(Student).filter(Student.class_id == cls.id).all()
-        student_ids = [s.id for s in students]
-        
-        total_invoiced = db.query(func.sum(Invoice.amount)).filter(Invoice.student_id.in_(student_ids)).scalar() or 0
-        total_collected = db.query(func.sum(Invoice.amount_paid)).filter(Invoice.student_id.in_(student_ids)).scalar() or 0
-        
+async def get_collection_rate(
+    term: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_db),
+    user: User = Depends(require_accountant)
+):
+    # One grouped join over classes, students and invoices. Invoice filters sit in the
+    # join condition so classes without matching invoices still get a row.
+    invoice_join = [Invoice.student_id == Student.id]
+    if term:
+        invoice_join.append(Invoice.term == term)
+    if category:
+        try:
+            invoice_join.append(Invoice.category == PaymentCategory(category))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
+    rows = db.query(
+        Class.name,
+        Class.grade_level,
+        func.coalesce(func.sum(Invoice.amount), 0).label("total_invoiced"),
+        func.coalesce(func.sum(Invoice.amount_paid), 0).label("total_collected")
+    ).outerjoin(Student, Student.class_id == Class.id).outerjoin(Invoice, and_(*invoice_join)).group_by(
+        Class.id, Class.name, Class.grade_level
+    ).order_by(Class.grade_level, Class.name).all()
+    
+    def collection_row(total_invoiced, total_collected):
         collection_rate = (total_collected / total_invoiced * 100) if total_invoiced > 0 else 0
-        
-        results.append({
-            "class": cls.name,
+        return {
             "total_invoiced": total_invoiced,
             "total_collected": total_collected,
             "outstanding": total_invoiced - total_collected,
             "collection_rate": round(collection_rate, 1)
-        })
+        }
+    
+    # Grade-level rollup folds the (at most a few dozen) class rows from the same query
+    by_grade = {}
+    for r in rows:
+        invoiced, collected = by_grade.get(r.grade_level, (0, 0))
+        by_grade[r.grade_level] = (invoiced + r.total_invoiced, collected + r.total_collected)
     
-    return results
+    return {
+        "classes": [{"class": r.name, "grade_level": r.grade_level, **collection_row(r.total_invoiced, r.total_collected)} for r in rows],
+        "by_grade": [{"grade_level": grade, **collection_row(*totals)} for grade, totals in by_grade.items()]
+    }
 
 # STUDENT ACCOUNT
 @router.get("/student-account/{student_id}")
@@ -417,12 +762,13 @@ async def get_student_account(student_id: int, db: Session = Depends(get_db), us
     class_obj = db.query(Class).filter(Class.id == student.class_id).first() if student.class_id else None
     
     invoices = db.query(Invoice).filter(Invoice.student_id == student_id).all()
-    invoices_ids = [i.id for i in invoices]
-    payments = db.query(Payment).filter(Payment.invoice_id.in_(invoices_ids)).all() if invoices_ids else []
+    payments = db.query(Payment).join(Invoice, Payment.invoice_id == Invoice.id).filter(
+        Invoice.student_id == student_id
+    ).all()
     
     total_invoiced = sum(i.amount for i in invoices)
     total_paid = sum(i.amount_paid for i in invoices)
-    total_outstanding = total_invoiced - total_paid
+    total_outstanding = ledger.balance(db, student_id)
     
     return {
         "student": {
@@ -455,23 +801,64 @@ async def get_student_account(student_id: int, db: Session = Depends(get_db), us
         } for p in payments]
     }
 
+@router.get("/student-account/{student_id}/statement")
+async def get_student_statement(student_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None,
+                                db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    student = db.query(Student).filter(Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    
+    return {
+        "student": {"id": student.id, "name": f"{student.first_name} {student.last_name}"},
+        **ledger.statement(db, student_id, start_date, end_date)
+    }
+
 # MOBILE MONEY INTEGRATION
 @router.post("/mobile-money/initiate")
 async def initiate_mobile_money_payment(payment_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
-    # Simulate mobile money payment initiation
-    invoice_id = payment_data["invoice_id"]
+    invoice = db.query(Invoice).filter(Invoice.id == payment_data["invoice_id"]).first()
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    provider = mobile_money.provider_code(payment_data["provider"])  # MTN MoMo, Airtel Money
+    if not provider:
+        raise HTTPException(status_code=400, detail="Unsupported mobile money provider")
+    amount = float(payment_data["amount"])
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
     phone_number = payment_data["phone_number"]
-    amount = payment_data["amount"]
-    provider = payment_data["provider"]  # MTN MoMo, Airtel Money
     
-    # In production, integrate with actual mobile money API
-    transaction_id = f"MM-{datetime.now().strftime('%Y%m%d%H%M%S')}"
+    # The provider confirms asynchronously through /api/mobile-money/callback/{provider}
+    transaction = mobile_money.create_transaction(db, invoice, provider, phone_number, amount, user.id)
     
     return {
         "message": "Mobile money payment initiated",
-        "transaction_id": transaction_id,
+        "transaction_id": transaction.external_id,
         "status": "pending",
-        "instructions": f"Please confirm payment on your {provider} phone {phone_number}"
+        "instructions": f"Please confirm payment on your {payment_data['provider']} phone {phone_number}"
+    }
+
+@router.get("/mobile-money/transactions/{transaction_id}")
+async def get_mobile_money_transaction(transaction_id: str, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    transaction = db.query(MobileMoneyTransaction).filter(MobileMoneyTransaction.external_id == transaction_id).first()
+    if not transaction:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    
+    receipt_number = None
+    if transaction.payment_id:
+        receipt_number = db.query(Payment.receipt_number).filter(Payment.id == transaction.payment_id).scalar()
+    
+    return {
+        "transaction_id": transaction.external_id,
+        "provider": transaction.provider,
+        "provider_transaction_id": transaction.provider_transaction_id,
+        "invoice_id": transaction.invoice_id,
+        "phone_number": transaction.phone,
+        "amount": transaction.amount,
+        "status": transaction.status.value,
+        "failure_reason": transaction.failure_reason,
+        "receipt_number": receipt_number,
+        "created_at": str(transaction.created_at) if transaction.created_at else None,
+        "completed_at": str(transaction.completed_at) if transaction.completed_at else None
     }
 
 # DISCOUNTS
@@ -485,10 +872,52 @@ async def apply_discount(discount_data: dict, db: Session = Depends(get_db), use
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
+    before = finance_summary.invoice_snapshot(invoice)
+    before_balance = ledger.invoice_balance(invoice)
     invoice.amount -= discount_amount
     if invoice.amount_paid >= invoice.amount:
         invoice.status = InvoiceStatus.PAID
     
+    finance_summary.record_invoice_change(db, before, invoice)
+    ledger.record_invoice_change(db, invoice, before_balance, LedgerEntryType.DISCOUNT, reason, user.id)
     db.commit()
     
-    return {"message": "Discount applied successfully", "new_amount": invoice.amount}
\ No newline at end of file
+    return {"message": "Discount applied successfully", "new_amount": invoice.amount}
+
+@router.get("/discounts")
+async def get_discounts(db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    rules = db.query(Discount).order_by(Discount.id).all()
+    return [{
+        "id": d.id,
+        "name": d.name,
+        "discount_type": d.discount_type,
+        "percentage": d.percentage,
+        "conditions": d.conditions,
+        "is_active": d.is_active
+    } for d in rules]
+
+@router.post("/discounts")
+async def create_discount(discount_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    discount = Discount(
+        name=discount_data["name"],
+        discount_type=discount_data.get("discount_type"),  # sibling, scholarship, staff_child
+        percentage=discount_data["percentage"],
+        conditions=discount_data.get("conditions") or {},
+        is_active=discount_data.get("is_active", True)
+    )
+    try:
+        discounts.Rule(discount)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db.add(discount)
+    db.commit()
+    db.refresh(discount)
+    return {"message": "Discount created successfully", "id": discount.id}
+
+@router.post("/discounts/apply-term")
+async def apply_term_discounts(discount_data: dict, db: Session = Depends(get_db), user: User = Depends(require_accountant)):
+    # Evaluate every active rule against the term's invoices in one pass; dry_run previews
+    try:
+        return discounts.apply_term(db, discount_data["term"], user.id, bool(discount_data.get("dry_run", False)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
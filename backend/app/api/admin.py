@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
+from app.core import dates
 from app.core.database import get_db
 from app.core.security import get_current_user, get_password_hash
 from app.models import *
 from app.models.user import UserRole
 from app.models.student import EnrollmentStatus
-from app.models.attendance import AttendanceStatus
 from app.models.fee import InvoiceStatus
+from app.services import attendance_summary, periods, sequences
 from datetime import datetime, date, timedelta
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -33,12 +34,10 @@ async def get_admin_dashboard(db: Session = Depends(get_db), admin: User = Depen
     outstanding_fees = db.query(func.sum(Invoice.amount - Invoice.amount_paid)).filter(Invoice.status != InvoiceStatus.PAID).scalar() or 0
     
     # Today's attendance
-    today_attendance = db.query(Attendance).filter(Attendance.date == today).count()
-    today_present = db.query(Attendance).filter(and_(Attendance.date == today, Attendance.status == AttendanceStatus.PRESENT)).count()
-    attendance_rate = (today_present / today_attendance * 100) if today_attendance > 0 else 0
+    attendance_rate = attendance_summary.totals(db, today, today + timedelta(days=1))["rate"]
     
     # Recent activities
-    recent_payments = db.query(Payment).order_by(Payment.payment_date.desc()).limit(5).all()
+    recent_payments = db.query(Payment).order_by(Payment.payment_date.desc(), Payment.id.desc()).limit(5).all()
     recent_enrollments = db.query(Student).order_by(Student.enrollment_date.desc()).limit(5).all()
     
     return {
@@ -58,10 +57,7 @@ async def get_admin_dashboard(db: Session = Depends(get_db), admin: User = Depen
 # STUDENT MANAGEMENT
 @router.post("/students")
 async def create_student(student_data: dict, db: Session = Depends(get_db), admin: User = Depends(require_admin)):
-    # Generate admission number
-    last_student = db.query(Student).order_by(Student.id.desc()).first()
-    next_id = (last_student.id + 1) if last_student else 1
-    admission_number = f"FBS2024{next_id:04d}"
+    admission_number = sequences.next_number(db, "admission")
     
     student = Student(
         admission_number=admission_number,
@@ -234,58 +230,59 @@ async def toggle_user_status(user_id: int, db: Session = Depends(get_db), admin:
 # FINANCIAL OVERVIEW
 @router.get("/finances")
 async def get_financial_overview(db: Session = Depends(get_db), admin: User = Depends(require_admin)):
-    # Revenue by month
-    monthly_revenue = db.query(
-        func.strftime('%Y-%m', Payment.payment_date).label('month'),
-        func.sum(Payment.amount).label('total')
-    ).group_by(func.strftime('%Y-%m', Payment.payment_date)).all()
+    # Closed months come from the period snapshots; months not closed yet are totalled from payments
+    history = periods.history(db, date.today())
     
     # Outstanding fees by class
     outstanding_by_class = db.query(
         Class.name,
         func.sum(Invoice.amount - Invoice.amount_paid).label('outstanding')
-    ).join(Student).join(Invoice).filter(Invoice.status != InvoiceStatus.PAID).group_by(Class.name).all()
-    
-    # Payment methods distribution
-    payment_methods = db.query(
-        Payment.payment_method,
-        func.count(Payment.id).label('count'),
-        func.sum(Payment.amount).label('total')
-    ).group_by(Payment.payment_method).all()
+    ).join(Student, Student.class_id == Class.id).join(Invoice, Invoice.student_id == Student.id).filter(
+        Invoice.status != InvoiceStatus.PAID
+    ).group_by(Class.name).all()
     
     return {
-        "monthly_revenue": [{"month": m[0], "total": m[1]} for m in monthly_revenue],
+        "monthly_revenue": [{"month": m["period"], "total": m["total"], "count": m["count"], "closed": m["closed"]} for m in history["months"]],
         "outstanding_by_class": [{"class": c[0], "outstanding": c[1]} for c in outstanding_by_class],
-        "payment_methods": [{"method": p[0], "count": p[1], "total": p[2]} for p in payment_methods]
+        "payment_methods": [{"method": p["key"], "count": p["count"], "total": p["total"]} for p in history["method"]],
+        "revenue_by_category": [{"category": c["key"], "count": c["count"], "total": c["total"]} for c in history["category"]],
+        "revenue_by_class": [{"class": c["label"], "count": c["count"], "total": c["total"]} for c in history["class"]]
     }
 
+@router.get("/financial-periods")
+async def get_financial_periods(db: Session = Depends(get_db), admin: User = Depends(require_admin)):
+    rows = db.query(FinancialPeriod).order_by(FinancialPeriod.start_date.desc()).all()
+    return [{
+        "period": p.period,
+        "total_collected": p.total_collected,
+        "payment_count": p.payment_count,
+        "total_invoiced": p.total_invoiced,
+        "invoice_count": p.invoice_count,
+        "closed_at": p.closed_at
+    } for p in rows]
+
+@router.post("/financial-periods/{period}/close")
+async def close_financial_period(period: str, db: Session = Depends(get_db), admin: User = Depends(require_admin)):
+    # Closing an already closed month recomputes it, e.g. after a backdated payment
+    try:
+        row = periods.close_period(db, period, admin.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": f"Period {row.period} closed", "total_collected": row.total_collected, "payment_count": row.payment_count}
+
 # ATTENDANCE ANALYTICS
 @router.get("/attendance/analytics")
 async def get_attendance_analytics(db: Session = Depends(get_db), admin: User = Depends(require_admin)):
-    # Overall attendance rate
-    total_records = db.query(Attendance).count()
-    present_records = db.query(Attendance).filter(Attendance.status == AttendanceStatus.PRESENT).count()
-    overall_rate = (present_records / total_records * 100) if total_records > 0 else 0
-    
-    # Attendance by class
-    class_attendance = db.query(
-        Class.name,
-        func.count(Attendance.id).label('total'),
-        func.sum(func.case([(Attendance.status == AttendanceStatus.PRESENT, 1)], else_=0)).label('present')
-    ).join(Student).join(Attendance).group_by(Class.name).all()
-    
-    # Daily attendance for last 30 days
-    thirty_days_ago = date.today() - timedelta(days=30)
-    daily_attendance = db.query(
-        Attendance.date,
-        func.count(Attendance.id).label('total'),
-        func.sum(func.case([(Attendance.status == AttendanceStatus.PRESENT, 1)], else_=0)).label('present')
-    ).filter(Attendance.date >= thirty_days_ago).group_by(Attendance.date).all()
+    # All three come from the per-class daily rollup, over the same recent window
+    since = date.today() - timedelta(days=attendance_summary.RECENT_DAYS)
+    overall = attendance_summary.totals(db, since)
+    class_attendance = attendance_summary.by_class(db, since)
+    daily_attendance = attendance_summary.by_day(db, since)
     
     return {
-        "overall_rate": round(overall_rate, 1),
-        "class_attendance": [{"class": c[0], "rate": round((c[2]/c[1]*100) if c[1] > 0 else 0, 1)} for c in class_attendance],
-        "daily_attendance": [{"date": str(d[0]), "rate": round((d[2]/d[1]*100) if d[1] > 0 else 0, 1)} for d in daily_attendance]
+        "overall_rate": round(overall["rate"], 1),
+        "class_attendance": [{"class": c["class"], "rate": round(c["rate"], 1)} for c in class_attendance],
+        "daily_attendance": [{"date": d["date"], "rate": round(d["rate"], 1)} for d in daily_attendance]
     }
 
 # ANNOUNCEMENTS
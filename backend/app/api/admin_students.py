@@ -4,6 +4,7 @@ from app.core.database import get_db
 from app.core.security import get_current_user, get_password_hash
 from app.models import *
 from app.models.user import UserRole
+from app.services import sequences
 from datetime import datetime, date
 
 router = APIRouter(prefix="/admin/students", tags=["admin-students"])
@@ -15,9 +16,7 @@ def require_admin(current_user: User = Depends(get_current_user)):
 
 @router.post("")
 async def create_student(student_data: dict, db: Session = Depends(get_db), admin: User = Depends(require_admin)):
-    last_student = db.query(Student).order_by(Student.id.desc()).first()
-    next_id = (last_student.id + 1) if last_student else 1
-    admission_number = f"FBS2024{next_id:04d}"
+    admission_number = sequences.next_number(db, "admission")
     
     student = Student(
         admission_number=admission_number,
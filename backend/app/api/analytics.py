@@ -6,13 +6,13 @@ from ..core.security import get_current_user
 from ..models.student import Student, EnrollmentStatus
 from ..models.class_model import Class
 from ..models.fee import Invoice, Payment, InvoiceStatus
+from ..services import attendance_summary
 
 router = APIRouter()
 
 @router.get("/dashboard")
 async def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depends(get_current_user)):
     try:
-        from ..models.attendance import Attendance, AttendanceStatus
         # Student stats
         total_students = db.query(Student).filter(Student.enrollment_status == EnrollmentStatus.ACTIVE).count()
         total_classes = db.query(Class).count()
@@ -27,6 +27,10 @@ async def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depe
         pending_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.PENDING).count()
         paid_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.PAID).count()
         partial_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.PARTIAL).count()
+        overdue_invoices = db.query(Invoice).filter(Invoice.status == InvoiceStatus.OVERDUE).count()
+        
+        # Attendance over the last 30 days
+        attendance = attendance_summary.recent(db)
         
         # Recent payments
         recent_payments = db.query(Payment).limit(5).all()
@@ -50,13 +54,14 @@ async def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depe
                 "invoices": {
                     "pending": pending_invoices,
                     "paid": paid_invoices,
-                    "partial": partial_invoices
+                    "partial": partial_invoices,
+                    "overdue": overdue_invoices
                 }
             },
             "attendance": {
-                "rate": 85.0,
-                "total_records": 300,
-                "present": 255
+                "rate": round(attendance["rate"], 2),
+                "total_records": attendance["total"],
+                "present": attendance["present"]
             },
             "recent_payments": [
                 {
@@ -76,7 +81,7 @@ async def get_dashboard_stats(db: Session = Depends(get_db), current_user = Depe
                 "total_collected": 0,
                 "pending": 0,
                 "collection_rate": 0,
-                "invoices": {"pending": 0, "paid": 0, "partial": 0}
+                "invoices": {"pending": 0, "paid": 0, "partial": 0, "overdue": 0}
             },
             "attendance": {"rate": 0, "total_records": 0, "present": 0},
             "recent_payments": []
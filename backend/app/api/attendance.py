@@ -3,12 +3,14 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 from typing import List
 from datetime import date, datetime
+from ..core import dates
 from ..core.database import get_db
 from ..core.security import get_current_user, require_role
 from ..models.user import User, UserRole
 from ..models.attendance import Attendance, AttendanceStatus
 from ..models.student import Student
 from ..models.class_model import Class
+from ..services import attendance as attendance_service
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -73,24 +75,14 @@ def submit_attendance(data: AttendanceSubmit, db: Session = Depends(get_db), cur
     """Submit attendance for a class"""
     attendance_date = datetime.strptime(data.date, "%Y-%m-%d").date()
     
-    # Delete existing attendance for this class and date
-    db.query(Attendance).filter(
-        Attendance.class_id == data.class_id,
-        Attendance.date == attendance_date
-    ).delete()
-    
-    # Create new attendance records
-    for record in data.records:
-        attendance = Attendance(
-            student_id=record.student_id,
-            class_id=data.class_id,
-            date=attendance_date,
-            status=AttendanceStatus(record.status),
-            notes=record.notes,
-            recorded_by=current_user.id,
-            recorded_at=datetime.now()
-        )
-        db.add(attendance)
+    # Re-submitting the register replaces the day's marks in place
+    try:
+        attendance_service.upsert(db, [{
+            "student_id": record.student_id, "class_id": data.class_id, "date": attendance_date,
+            "status": record.status, "notes": record.notes
+        } for record in data.records], current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     db.commit()
     return {"message": f"Attendance recorded for {len(data.records)} students"}
@@ -129,10 +121,11 @@ def attendance_report(class_id: int, start_date: str = None, end_date: str = Non
         func.sum(func.case((Attendance.status == AttendanceStatus.LATE, 1), else_=0)).label("late")
     ).outerjoin(Attendance, Student.id == Attendance.student_id).filter(Student.class_id == class_id)
     
-    if start_date:
-        query = query.filter(Attendance.date >= datetime.strptime(start_date, "%Y-%m-%d").date())
-    if end_date:
-        query = query.filter(Attendance.date <= datetime.strptime(end_date, "%Y-%m-%d").date())
+    query = query.filter(*dates.through(
+        Attendance.date,
+        datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None,
+        datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+    ))
     
     results = query.group_by(Student.id).all()
     
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from typing import List
 from ..core.database import get_db
 from ..core.security import get_current_user, require_role
-from ..models.fee import Invoice, Payment, InvoiceStatus, PaymentCategory, PaymentMethod
+from ..models.fee import Invoice, Payment, InvoiceStatus, PaymentCategory, PaymentMethod, LedgerEntryType
+from ..services import finance_summary, ledger, payments, sequences
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, date
 
 router = APIRouter()
 
@@ -41,7 +43,7 @@ class PaymentResponse(BaseModel):
     invoice_id: int
     amount: float
     payment_method: str
-    payment_date: datetime
+    payment_date: date | None
     
     class Config:
         from_attributes = True
@@ -62,9 +64,7 @@ async def create_invoice(
     db: Session = Depends(get_db),
     current_user = Depends(require_role("admin", "accountant"))
 ):
-    last_invoice = db.query(Invoice).order_by(Invoice.id.desc()).first()
-    next_num = (last_invoice.id + 1) if last_invoice else 1
-    invoice_number = f"INV-2024-{next_num:05d}"
+    invoice_number = sequences.next_number(db, "invoice")
     
     invoice = Invoice(
         invoice_number=invoice_number,
@@ -78,7 +78,13 @@ async def create_invoice(
         created_by=current_user.id
     )
     db.add(invoice)
-    db.commit()
+    try:
+        finance_summary.record_invoice_change(db, None, invoice)
+        ledger.record_invoice_change(db, invoice, 0.0, LedgerEntryType.INVOICE, created_by=current_user.id)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="An invoice for this student, category and term already exists")
     db.refresh(invoice)
     return invoice
 
@@ -91,7 +97,12 @@ async def delete_invoice(
     invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    before = finance_summary.invoice_snapshot(invoice)
+    before_balance = ledger.invoice_balance(invoice)
     db.delete(invoice)
+    finance_summary.record_invoice_change(db, before, None)
+    ledger.record_invoice_change(db, invoice, before_balance, LedgerEntryType.REVERSAL, "Invoice deleted",
+                                 current_user.id, removed=True)
     db.commit()
     return {"message": "Invoice deleted"}
 
@@ -105,30 +116,13 @@ async def record_payment(
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    last_payment = db.query(Payment).order_by(Payment.id.desc()).first()
-    next_num = (last_payment.id + 1) if last_payment else 1
-    receipt_number = f"RCP-2024-{next_num:05d}"
-    
-    payment = Payment(
-        receipt_number=receipt_number,
-        invoice_id=payment_data.invoice_id,
-        student_id=invoice.student_id,
-        amount=payment_data.amount,
-        method=payment_data.method,
-        reference=payment_data.reference,
-        received_by=current_user.id
-    )
-    db.add(payment)
-    
-    invoice.amount_paid += payment_data.amount
-    if invoice.amount_paid >= invoice.amount:
-        invoice.status = InvoiceStatus.PAID
-    elif invoice.amount_paid > 0:
-        invoice.status = InvoiceStatus.PARTIAL
-    
-    db.commit()
-    db.refresh(payment)
-    return payment
+    # Same guarded, in-database credit as the accountant payment form; overpayments are refused
+    try:
+        result = payments.allocate(db, payment_data.amount, payment_data.method, invoice_ids=[invoice.id],
+                                   user_id=current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return db.get(Payment, result["allocations"][0]["payment_id"])
 
 @router.get("/payments")
 async def list_payments(
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from typing import List
 from datetime import datetime, timedelta
+from ..core import dates
 from ..core.database import get_db
 from ..core.security import get_current_user, require_role
 from ..models.user import User, UserRole
@@ -14,6 +15,7 @@ from ..models.fee import Invoice, Payment, InvoiceStatus
 from ..models.academic_calendar import AcademicTerm, Holiday, SchoolEvent
 from ..models.school_settings import SchoolSettings, PromotionRule, Discount
 from ..models.audit_log import AuditLog
+from ..services import attendance_bitmaps, attendance_summary
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -40,19 +42,16 @@ async def get_dashboard(
     total_classes = db.query(Class).count()
     
     # Attendance rate (last 30 days)
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    attendance_records = db.query(Attendance).filter(Attendance.date >= thirty_days_ago).all()
-    present_count = sum(1 for a in attendance_records if a.status == "present")
-    attendance_rate = (present_count / len(attendance_records) * 100) if attendance_records else 0
+    attendance_rate = attendance_summary.recent(db)["rate"]
     
     # Revenue this month
-    first_day = datetime.now().replace(day=1)
-    payments = db.query(Payment).filter(Payment.payment_date >= first_day).all()
-    revenue_this_month = sum(p.amount for p in payments)
+    first_day = datetime.now().date().replace(day=1)
+    revenue_this_month = db.query(func.coalesce(func.sum(Payment.amount), 0)).filter(Payment.payment_date >= first_day).scalar()
     
     # Outstanding fees
-    invoices = db.query(Invoice).filter(Invoice.status.in_([InvoiceStatus.PENDING, InvoiceStatus.PARTIAL])).all()
-    outstanding_fees = sum(i.amount - i.amount_paid for i in invoices)
+    outstanding_fees = db.query(func.coalesce(func.sum(Invoice.amount - Invoice.amount_paid), 0)).filter(
+        Invoice.status.in_([InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE])
+    ).scalar()
     
     # Recent activities
     recent_logs = db.query(AuditLog).order_by(AuditLog.created_at.desc()).limit(10).all()
@@ -306,26 +305,34 @@ async def attendance_report(
     db: Session = Depends(get_db),
     current_user = Depends(require_role("head_teacher", "admin"))
 ):
-    start = datetime.fromisoformat(start_date)
-    end = datetime.fromisoformat(end_date)
+    start = datetime.fromisoformat(start_date).date()
+    end = datetime.fromisoformat(end_date).date()
     
-    records = db.query(Attendance).filter(
-        and_(Attendance.date >= start, Attendance.date <= end)
-    ).all()
-    
-    total = len(records)
-    present = sum(1 for r in records if r.status == "present")
-    absent = sum(1 for r in records if r.status == "absent")
-    late = sum(1 for r in records if r.status == "late")
+    counts = attendance_summary.totals(db, start, end + timedelta(days=1))
     
     return {
-        "total_records": total,
-        "present": present,
-        "absent": absent,
-        "late": late,
-        "attendance_rate": round((present / total * 100) if total > 0 else 0, 2)
+        "total_records": counts["total"],
+        "present": counts["present"],
+        "absent": counts["absent"],
+        "late": counts["late"],
+        "excused": counts["excused"],
+        "attendance_rate": round(counts["rate"], 2)
     }
 
+@router.get("/head-teacher/reports/attendance/term")
+async def term_attendance_report(
+    term_id: int = None,
+    class_id: int = None,
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role("head_teacher", "admin"))
+):
+    """Per-student term attendance (rate and absence streaks), lowest rate first; defaults to the active term."""
+    term = attendance_bitmaps.term_for(db, term_id)
+    if not term:
+        raise HTTPException(status_code=404, detail="Term not found")
+    
+    return attendance_bitmaps.term_summary(db, term, class_id)
+
 @router.get("/head-teacher/reports/financial")
 async def financial_report(
     start_date: str,
@@ -333,21 +340,20 @@ async def financial_report(
     db: Session = Depends(get_db),
     current_user = Depends(require_role("head_teacher", "admin"))
 ):
-    start = datetime.fromisoformat(start_date)
-    end = datetime.fromisoformat(end_date)
-    
-    payments = db.query(Payment).filter(
-        and_(Payment.payment_date >= start, Payment.payment_date <= end)
-    ).all()
+    start = datetime.fromisoformat(start_date).date()
+    end = datetime.fromisoformat(end_date).date()
     
-    total_revenue = sum(p.amount for p in payments)
+    total_revenue, payment_count = db.query(
+        func.coalesce(func.sum(Payment.amount), 0), func.count(Payment.id)
+    ).filter(*dates.through(Payment.payment_date, start, end)).one()
     
-    invoices = db.query(Invoice).filter(Invoice.status != InvoiceStatus.PAID).all()
-    outstanding = sum(i.amount - i.amount_paid for i in invoices)
+    outstanding = db.query(func.coalesce(func.sum(Invoice.amount - Invoice.amount_paid), 0)).filter(
+        Invoice.status != InvoiceStatus.PAID
+    ).scalar()
     
     return {
         "total_revenue": total_revenue,
         "outstanding_fees": outstanding,
-        "payment_count": len(payments),
+        "payment_count": payment_count,
         "period": f"{start_date} to {end_date}"
     }
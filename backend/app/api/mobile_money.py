@@ -0,0 +1,30 @@
+import hmac
+from fastapi import APIRouter, BackgroundTasks, Body, Depends, Header, HTTPException
+from sqlalchemy.orm import Session
+from typing import Optional
+from ..core.config import settings
+from ..core.database import get_db
+from ..services import mobile_money
+
+router = APIRouter(prefix="/mobile-money", tags=["mobile-money"])
+
+# PROVIDER CALLBACKS
+@router.post("/callback/{provider}")
+async def receive_callback(
+    provider: str,
+    background_tasks: BackgroundTasks,
+    payload: dict = Body(...),
+    x_callback_token: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Store the callback and acknowledge it; payments are posted by the inbox drain."""
+    if provider not in mobile_money.PROVIDERS:
+        raise HTTPException(status_code=404, detail="Unknown provider")
+    if not settings.MOBILE_MONEY_CALLBACK_TOKEN:
+        raise HTTPException(status_code=503, detail="Mobile money callbacks are not configured")
+    if not hmac.compare_digest((x_callback_token or "").encode(), settings.MOBILE_MONEY_CALLBACK_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid callback token")
+
+    mobile_money.enqueue_callback(db, provider, payload)
+    background_tasks.add_task(mobile_money.drain_in_background)
+    return {"status": "accepted"}
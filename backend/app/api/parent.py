@@ -9,6 +9,7 @@ from ..models.student import Student
 from ..models.guardian import Guardian, student_guardians
 from ..models.attendance import Attendance, AttendanceStatus
 from ..models.fee import Invoice, Payment
+from ..services import ledger
 
 router = APIRouter()
 
@@ -22,6 +23,7 @@ def get_my_children(db: Session = Depends(get_db), current_user: User = Depends(
     children = db.query(Student).join(
         student_guardians, Student.id == student_guardians.c.student_id
     ).filter(student_guardians.c.guardian_id == guardian.id).all()
+    fee_balances = ledger.balances(db, [child.id for child in children])
     
     result = []
     for child in children:
@@ -35,11 +37,6 @@ def get_my_children(db: Session = Depends(get_db), current_user: User = Depends(
             Attendance.status == AttendanceStatus.PRESENT
         ).count()
         
-        # Get fee balance
-        invoices = db.query(Invoice).filter(Invoice.student_id == child.id).all()
-        total_due = sum(inv.amount for inv in invoices)
-        total_paid = sum(inv.amount_paid for inv in invoices)
-        
         result.append({
             "id": child.id,
             "admission_number": child.admission_number,
@@ -50,7 +47,7 @@ def get_my_children(db: Session = Depends(get_db), current_user: User = Depends(
             "attendance_rate": round((present_days / total_days * 100) if total_days > 0 else 0, 1),
             "total_days": total_days,
             "present_days": present_days,
-            "fee_balance": total_due - total_paid
+            "fee_balance": fee_balances[child.id]
         })
     
     return result
@@ -101,10 +98,13 @@ def get_child_fees(student_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=403, detail="Not authorized to view this student")
     
     invoices = db.query(Invoice).filter(Invoice.student_id == student_id).all()
+    payments_by_invoice = {}
+    for p in db.query(Payment).join(Invoice, Payment.invoice_id == Invoice.id).filter(Invoice.student_id == student_id):
+        payments_by_invoice.setdefault(p.invoice_id, []).append(p)
     
     result = []
     for invoice in invoices:
-        payments = db.query(Payment).filter(Payment.invoice_id == invoice.id).all()
+        payments = payments_by_invoice.get(invoice.id, [])
         result.append({
             "invoice_number": invoice.invoice_number,
             "category": invoice.category.value,
@@ -3,12 +3,14 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func, and_, or_
 from typing import List
 from datetime import datetime, timedelta
+from ..core import dates
 from ..core.database import get_db
 from ..core.security import get_current_user, require_role
 from ..models.guardian import Guardian
 from ..models.student import Student
-from ..models.attendance import Attendance
+from ..models.attendance import Attendance, AttendanceStatus
 from ..models.fee import Invoice, Payment, InvoiceStatus
+from ..services import attendance as attendance_service, ledger
 from ..models.announcement import Announcement
 from ..models.communication import Message, ParentTeacherMeeting
 from ..models.assessment import Assessment
@@ -46,6 +48,7 @@ async def get_parent_dashboard(
     # Get all children
     children_summaries = []
     total_outstanding = 0
+    fee_balances = ledger.balances(db, [student.id for student in guardian.students])
     
     for student in guardian.students:
         # Attendance rate (last 30 days)
@@ -58,13 +61,7 @@ async def get_parent_dashboard(
         attendance_rate = (present / len(records) * 100) if records else 0
         
         # Outstanding fees
-        invoices = db.query(Invoice).filter(
-            and_(
-                Invoice.student_id == student.id,
-                Invoice.status.in_([InvoiceStatus.PENDING, InvoiceStatus.PARTIAL])
-            )
-        ).all()
-        outstanding = sum(i.amount - i.amount_paid for i in invoices)
+        outstanding = fee_balances[student.id]
         total_outstanding += outstanding
         
         # Recent status
@@ -186,8 +183,7 @@ async def get_child_attendance(
     records = db.query(Attendance).filter(
         and_(
             Attendance.student_id == student_id,
-            Attendance.date >= start,
-            Attendance.date <= end
+            *dates.through(Attendance.date, start, end)
         )
     ).order_by(Attendance.date.desc()).all()
     
@@ -250,12 +246,12 @@ async def get_child_fees(
             "description": invoice.description
         }
         
-        if invoice.status in [InvoiceStatus.PENDING, InvoiceStatus.PARTIAL]:
+        if invoice.status in [InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE]:
             pending_invoices.append(invoice_data)
         else:
             paid_invoices.append(invoice_data)
     
-    total_outstanding = sum(i["balance"] for i in pending_invoices)
+    total_outstanding = ledger.balance(db, student_id)
     
     return {
         "student_name": f"{student.first_name} {student.last_name}",
@@ -277,12 +273,9 @@ async def get_payment_history(
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Get all payments for this student's invoices
-    invoices = db.query(Invoice).filter(Invoice.student_id == student_id).all()
-    invoice_ids = [i.id for i in invoices]
-    
-    payments = db.query(Payment).filter(Payment.invoice_id.in_(invoice_ids)).order_by(
-        Payment.payment_date.desc()
-    ).all()
+    payments = db.query(Payment).join(Invoice, Payment.invoice_id == Invoice.id).filter(
+        Invoice.student_id == student_id
+    ).order_by(Payment.payment_date.desc()).all()
     
     return {
         "student_name": f"{student.first_name} {student.last_name}",
@@ -463,24 +456,11 @@ async def report_absence(
     if not student or student not in guardian.students:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    # Create or update attendance record
-    date = datetime.fromisoformat(absence_data.date)
-    attendance = db.query(Attendance).filter(
-        and_(Attendance.student_id == absence_data.student_id, func.date(Attendance.date) == date.date())
-    ).first()
-    
-    if attendance:
-        attendance.status = "sick"
-        attendance.notes = absence_data.reason
-    else:
-        attendance = Attendance(
-            student_id=absence_data.student_id,
-            class_id=student.class_id,
-            date=date,
-            status="sick",
-            notes=absence_data.reason
-        )
-        db.add(attendance)
+    # Create or update the day's mark; a reported absence is an excused one
+    attendance_service.upsert(db, [{
+        "student_id": student.id, "class_id": student.class_id, "date": absence_data.date,
+        "status": AttendanceStatus.EXCUSED, "notes": absence_data.reason
+    }], current_user.id)
     
     db.commit()
     
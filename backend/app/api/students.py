@@ -6,6 +6,7 @@ from ..core.security import get_current_user, require_role
 from ..models.student import Student, EnrollmentStatus
 from ..models.user import User, UserRole
 from ..core.security import get_password_hash
+from ..services import sequences
 from pydantic import BaseModel
 from datetime import date
 
@@ -100,10 +101,7 @@ async def create_student(
     db.add(user)
     db.flush()
     
-    # Generate admission number
-    last_student = db.query(Student).order_by(Student.id.desc()).first()
-    next_num = (last_student.id + 1) if last_student else 1
-    admission_number = f"FBS2024{next_num:04d}"
+    admission_number = sequences.next_number(db, "admission")
     
     # Create student
     student = Student(
@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func, and_
-from typing import List
+from typing import List, Union
 from datetime import datetime, timedelta
 from ..core.database import get_db
 from ..core.security import get_current_user, require_role
@@ -10,6 +10,7 @@ from ..models.student import Student
 from ..models.class_model import Class
 from ..models.teacher import Teacher
 from ..models.user import User
+from ..services import attendance, attendance_bitmaps, attendance_summary
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -25,6 +26,8 @@ class TeacherDashboard(BaseModel):
 
 @router.get("/teacher/dashboard", response_model=TeacherDashboard)
 async def get_teacher_dashboard(
+    threshold: float = Query(None, ge=0, le=100),
+    window_days: int = Query(None, ge=1, le=366),
     db: Session = Depends(get_db),
     current_user = Depends(require_role("teacher"))
 ):
@@ -48,39 +51,25 @@ async def get_teacher_dashboard(
     # Total students
     total_students = sum(len(c.students) for c in classes)
     
-    # Today's attendance
+    # Today's and this week's attendance in the teacher's classes
+    class_ids = [c.id for c in classes]
     today = datetime.now().date()
-    today_records = db.query(Attendance).filter(func.date(Attendance.date) == today).all()
-    today_present = sum(1 for r in today_records if r.status == "present")
-    today_attendance_rate = (today_present / len(today_records) * 100) if today_records else 0
+    today_counts = attendance_summary.totals(db, today, today + timedelta(days=1), class_ids)
+    today_attendance_rate = today_counts["rate"]
+    week_start = today - timedelta(days=7)
+    week_attendance_rate = attendance_summary.totals(db, week_start, class_ids=class_ids)["rate"]
     
-    # This week's attendance
-    week_start = datetime.now() - timedelta(days=7)
-    week_records = db.query(Attendance).filter(Attendance.date >= week_start).all()
-    week_present = sum(1 for r in week_records if r.status == "present")
-    week_attendance_rate = (week_present / len(week_records) * 100) if week_records else 0
-    
-    # Students with low attendance (< 75%)
-    low_attendance_students = []
-    for class_ in classes:
-        for student in class_.students:
-            student_records = db.query(Attendance).filter(
-                and_(Attendance.student_id == student.id, Attendance.date >= week_start)
-            ).all()
-            if student_records:
-                present_count = sum(1 for r in student_records if r.status == "present")
-                rate = (present_count / len(student_records) * 100)
-                if rate < 75:
-                    low_attendance_students.append({
-                        "name": f"{student.first_name} {student.last_name}",
-                        "class": class_.name,
-                        "rate": round(rate, 1)
-                    })
+    # Students under the school's threshold over the window, in one grouped query
+    default_threshold, default_window = attendance_summary.low_attendance_settings(db)
+    low_attendance_students = attendance_summary.low_attendance(
+        db, class_ids, threshold if threshold is not None else default_threshold,
+        window_days if window_days is not None else default_window, today
+    )
     
     quick_stats = {
         "classes": len(classes),
         "students": total_students,
-        "marked_today": len(today_records),
+        "marked_today": today_counts["total"],
         "alerts": len(low_attendance_students)
     }
     
@@ -105,33 +94,16 @@ async def mark_bulk_attendance(
     db: Session = Depends(get_db),
     current_user = Depends(require_role("teacher", "head_teacher", "admin"))
 ):
-    date = datetime.fromisoformat(attendance_data.date)
-    
-    created_count = 0
-    for record in attendance_data.attendance_records:
-        # Check if already exists
-        existing = db.query(Attendance).filter(
-            and_(
-                Attendance.student_id == record["student_id"],
-                func.date(Attendance.date) == date.date()
-            )
-        ).first()
-        
-        if existing:
-            existing.status = record["status"]
-        else:
-            attendance = Attendance(
-                student_id=record["student_id"],
-                class_id=attendance_data.class_id,
-                date=date,
-                status=record["status"],
-                marked_by=current_user.id
-            )
-            db.add(attendance)
-            created_count += 1
+    try:
+        written = attendance.upsert(db, [{
+            "student_id": record["student_id"], "class_id": attendance_data.class_id,
+            "date": attendance_data.date, "status": record["status"], "notes": record.get("notes")
+        } for record in attendance_data.attendance_records], current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     db.commit()
-    return {"message": f"Attendance marked for {created_count} students"}
+    return {"message": f"Attendance marked for {written} students"}
 
 # ============ MARK ALL PRESENT ============
 @router.post("/teacher/attendance/mark-all-present")
@@ -145,25 +117,10 @@ async def mark_all_present(
     if not class_:
         raise HTTPException(status_code=404, detail="Class not found")
     
-    attendance_date = datetime.fromisoformat(date)
-    
-    for student in class_.students:
-        existing = db.query(Attendance).filter(
-            and_(
-                Attendance.student_id == student.id,
-                func.date(Attendance.date) == attendance_date.date()
-            )
-        ).first()
-        
-        if not existing:
-            attendance = Attendance(
-                student_id=student.id,
-                class_id=class_id,
-                date=attendance_date,
-                status="present",
-                marked_by=current_user.id
-            )
-            db.add(attendance)
+    # Students already marked for the day keep their mark
+    attendance.upsert(db, [{
+        "student_id": student_id, "class_id": class_id, "date": date, "status": "present"
+    } for student_id, in db.query(Student.id).filter(Student.class_id == class_id)], current_user.id, overwrite=False)
     
     db.commit()
     return {"message": f"All students marked present for {class_.name}"}
@@ -236,6 +193,22 @@ async def get_student_attendance_profile(
         ]
     }
 
+@router.get("/teacher/students/{student_id}/attendance/calendar")
+async def get_student_attendance_calendar(
+    student_id: int,
+    term_id: int = None,
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role("teacher", "head_teacher", "admin"))
+):
+    """Every marked day of the term with its status, plus counts and absence streaks."""
+    if not db.query(Student.id).filter(Student.id == student_id).first():
+        raise HTTPException(status_code=404, detail="Student not found")
+    term = attendance_bitmaps.term_for(db, term_id)
+    if not term:
+        raise HTTPException(status_code=404, detail="Term not found")
+    
+    return attendance_bitmaps.calendar(db, term, student_id)
+
 # ============ CLASS ROSTER ============
 @router.get("/teacher/classes/{class_id}/roster")
 async def get_class_roster(
@@ -328,31 +301,38 @@ async def get_attendance_summary(
 # ============ OFFLINE SYNC ============
 @router.post("/teacher/attendance/sync")
 async def sync_offline_attendance(
-    sync_data: List[dict],
+    sync_data: Union[dict, List[dict]] = Body(...),
     db: Session = Depends(get_db),
     current_user = Depends(require_role("teacher", "head_teacher", "admin"))
 ):
-    """Sync attendance records marked offline"""
-    synced_count = 0
+    """Sync attendance marked offline.
     
-    for record in sync_data:
-        existing = db.query(Attendance).filter(
-            and_(
-                Attendance.student_id == record["student_id"],
-                func.date(Attendance.date) == datetime.fromisoformat(record["date"]).date()
-            )
-        ).first()
-        
-        if not existing:
-            attendance = Attendance(
-                student_id=record["student_id"],
-                class_id=record["class_id"],
-                date=datetime.fromisoformat(record["date"]),
-                status=record["status"],
-                marked_by=current_user.id
-            )
-            db.add(attendance)
-            synced_count += 1
+    Send ``{"watermark", "class_ids", "changes"}`` to get back the server's
+    changes since the watermark (see ``services.attendance.sync``). A bare
+    list of records is still accepted from older tablets: it only fills in
+    days that have no mark yet.
+    """
+    # Teachers only sync the classes they teach; head teachers and admins see every class
+    allowed_class_ids = None
+    if (current_user.role.value if hasattr(current_user.role, "value") else current_user.role) == "teacher":
+        teacher = db.query(Teacher).filter(Teacher.user_id == current_user.id).first()
+        allowed_class_ids = [class_id for class_id, in db.query(Class.id).filter(Class.class_teacher_id == teacher.id)] \
+            if teacher else []
     
-    db.commit()
-    return {"message": f"Synced {synced_count} attendance records"}
+    if isinstance(sync_data, list):
+        if len(sync_data) > attendance.SYNC_BATCH_LIMIT:
+            raise HTTPException(status_code=400, detail=f"At most {attendance.SYNC_BATCH_LIMIT} records per sync")
+        try:
+            if allowed_class_ids is not None and attendance.outside_classes(db, sync_data, allowed_class_ids):
+                raise HTTPException(status_code=403, detail="You can only sync attendance for your own classes")
+            synced_count = attendance.upsert(db, sync_data, current_user.id, overwrite=False)
+        except (KeyError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid attendance record: {e}")
+        db.commit()
+        return {"message": f"Synced {synced_count} attendance records"}
+    
+    try:
+        return attendance.sync(db, sync_data.get("changes") or [], sync_data.get("watermark"), sync_data.get("class_ids"),
+                               current_user.id, allowed_class_ids=allowed_class_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
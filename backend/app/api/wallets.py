@@ -0,0 +1,86 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+from ..core.database import get_db
+from ..core.security import require_role
+from ..models.fee import PaymentCategory, ServiceItem
+from ..models.student import Student
+from ..services import wallets
+
+router = APIRouter(prefix="/wallets", tags=["wallets"])
+
+# SERVICE ITEMS
+@router.get("/service-items")
+async def get_service_items(db: Session = Depends(get_db), current_user = Depends(require_role("accountant", "head_teacher", "teacher"))):
+    items = db.query(ServiceItem).filter(ServiceItem.is_active == True).order_by(ServiceItem.category, ServiceItem.name).all()
+    return [{
+        "id": i.id,
+        "name": i.name,
+        "category": i.category.value,
+        "unit_price": i.unit_price,
+        "description": i.description
+    } for i in items]
+
+@router.post("/service-items")
+async def create_service_item(item_data: dict, db: Session = Depends(get_db), current_user = Depends(require_role("accountant", "head_teacher"))):
+    try:
+        category = PaymentCategory(item_data["category"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid category")
+    if float(item_data["unit_price"]) <= 0:
+        raise HTTPException(status_code=400, detail="Unit price must be positive")
+    item = ServiceItem(
+        name=item_data["name"],
+        category=category,
+        unit_price=float(item_data["unit_price"]),
+        description=item_data.get("description"),
+        is_recurring=item_data.get("is_recurring", False)
+    )
+    db.add(item)
+    db.commit()
+    db.refresh(item)
+    return {"message": "Service item created successfully", "id": item.id}
+
+# SERVING-POINT DEBITS
+@router.post("/debits/batch")
+async def post_debit_batch(batch_data: dict, db: Session = Depends(get_db), current_user = Depends(require_role("accountant", "head_teacher", "teacher"))):
+    # Queued purchases from a serving point; each carries a client reference so replays are ignored
+    try:
+        results = wallets.debit_batch(db, batch_data.get("debits", []), current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "debited": sum(1 for r in results if r["status"] == "debited"),
+        "rejected": sum(1 for r in results if r["status"] not in ("debited", "duplicate")),
+        "results": results
+    }
+
+# BALANCES AND TOP-UPS
+@router.get("/{student_id}")
+async def get_wallet(
+    student_id: int,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: Session = Depends(get_db),
+    current_user = Depends(require_role("accountant", "head_teacher", "teacher"))
+):
+    student = db.query(Student).filter(Student.id == student_id).first()
+    if not student:
+        raise HTTPException(status_code=404, detail="Student not found")
+    return {
+        "student": {"id": student.id, "name": f"{student.first_name} {student.last_name}"},
+        **wallets.statement(db, student_id, cursor, limit)
+    }
+
+@router.post("/{student_id}/top-up")
+async def top_up_wallet(student_id: int, top_up_data: dict, db: Session = Depends(get_db), current_user = Depends(require_role("accountant", "head_teacher"))):
+    if not db.query(Student.id).filter(Student.id == student_id).first():
+        raise HTTPException(status_code=404, detail="Student not found")
+    try:
+        transaction = wallets.top_up(
+            db, student_id, float(top_up_data["amount"]), top_up_data.get("payment_method", "cash"),
+            top_up_data.get("reference"), current_user.id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Wallet topped up successfully", "transaction_id": transaction.id, "balance": transaction.balance_after}
@@ -36,6 +36,7 @@ class Settings(BaseSettings):
     MTN_MOMO_SUBSCRIPTION_KEY: str = ""
     AIRTEL_MONEY_CLIENT_ID: str = ""
     AIRTEL_MONEY_CLIENT_SECRET: str = ""
+    MOBILE_MONEY_CALLBACK_TOKEN: str = ""  # callbacks must send it as X-Callback-Token; refused while unset
     
     # Redis
     REDIS_URL: str = "redis://localhost:6379/0"
@@ -55,6 +56,9 @@ class Settings(BaseSettings):
     # File Upload
     MAX_UPLOAD_SIZE_MB: int = 10
     UPLOAD_DIR: str = "./uploads"
+    PDF_WORKERS: int = 0  # invoice/receipt render processes; 0 uses one per CPU
+    DOCUMENT_CACHE_DAYS: int = 30  # rendered PDFs unused this long are pruned by the daily job
+    DOCUMENT_CACHE_MB: int = 500  # beyond this the least recently used PDFs are pruned too
     
     @property
     def origins_list(self) -> List[str]:
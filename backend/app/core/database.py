@@ -8,6 +8,14 @@ engine = create_engine(settings.DATABASE_URL, connect_args=connect_args, pool_pr
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+def dialect_insert(bind, table):
+    """INSERT construct for the session's backend, exposing ON CONFLICT clauses."""
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,77 @@
+"""Date filters and bucketing that behave the same on SQLite and Postgres.
+
+Filters compare the bare column with half-open ``[start, end)`` bounds, so
+an index on the column stays usable; wrapping the column instead (``func.date(
+col) == day``) forces a scan. Bounds are coerced to the column's type, so a
+``DateTime`` column can be filtered by calendar days.
+
+``bucket`` truncates a column to the start of its day, ISO week (Monday) or
+month: ``date_trunc`` on Postgres, ``strftime``/``date`` on SQLite. Both
+return the bucket start as ``YYYY-MM-DD`` text, so results are keyed the
+same way on either backend and match ``bucket_start`` on the Python side.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import DateTime, func
+
+UNITS = ("day", "week", "month")
+
+def _bound(column, value):
+    if isinstance(column.type, DateTime):
+        return value if isinstance(value, datetime) else datetime.combine(value, time.min)
+    return value.date() if isinstance(value, datetime) else value
+
+def between(column, start: date | None = None, end: date | None = None) -> list:
+    """Predicates for ``start <= column < end``; either bound may be omitted."""
+    conditions = []
+    if start is not None:
+        conditions.append(column >= _bound(column, start))
+    if end is not None:
+        conditions.append(column < _bound(column, end))
+    return conditions
+
+def through(column, first: date | None = None, last: date | None = None) -> list:
+    """Predicates for the calendar days ``first`` to ``last`` inclusive, as a half-open range."""
+    if isinstance(last, datetime):
+        last = last.date()
+    return between(column, first, last + timedelta(days=1) if last is not None else None)
+
+def on_day(column, day: date) -> list:
+    if isinstance(column.type, DateTime):
+        return through(column, day, day)
+    return [column == _bound(column, day)]
+
+def bucket(bind, column, unit: str):
+    """``column`` truncated to ``unit`` as ``YYYY-MM-DD`` text, for ``group_by``."""
+    if unit not in UNITS:
+        raise ValueError(f"unit must be one of: {', '.join(UNITS)}")
+    if bind.dialect.name == "postgresql":
+        return func.to_char(func.date_trunc(unit, column), "YYYY-MM-DD")
+    if unit == "month":
+        return func.strftime("%Y-%m-01", column)
+    if unit == "week":
+        return func.date(column, "weekday 0", "-6 days")  # next Sunday (or today), back to its Monday
+    return func.date(column)
+
+def bucket_start(value: date, unit: str) -> date:
+    """Python-side twin of ``bucket``."""
+    if isinstance(value, datetime):
+        value = value.date()
+    if unit == "month":
+        return value.replace(day=1)
+    if unit == "week":
+        return value - timedelta(days=value.weekday())
+    return value
+
+def next_bucket(start: date, unit: str) -> date:
+    """Start of the bucket after the one starting at ``start``."""
+    if unit == "month":
+        return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + timedelta(days=7 if unit == "week" else 1)
+
+def buckets(start: date, end: date, unit: str) -> list[date]:
+    """Every bucket start from the one holding ``start`` up to (not including) ``end``, for zero-filling."""
+    starts, current = [], bucket_start(start, unit)
+    while current < end:
+        starts.append(current)
+        current = next_bucket(current, unit)
+    return starts
@@ -2,7 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from .core.config import settings
-from .core.database import engine, Base
+from .core.database import engine, Base, SessionLocal
 import os
 
 # Import routers first
@@ -11,7 +11,7 @@ try:
         auth, students, classes, attendance, assessments, fees, inventory, 
         announcements, assignments, transport, analytics, parent, admin, 
         admin_students, admin_teachers, head_teacher, accountant, 
-        teacher_enhanced, parent_enhanced
+        teacher_enhanced, parent_enhanced, mobile_money, wallets
     )
 except ImportError as e:
     print(f"Warning: Could not import all routers: {e}")
@@ -19,6 +19,23 @@ except ImportError as e:
 # Create tables
 Base.metadata.create_all(bind=engine)
 
+# Fill the attendance rollup on databases whose marks predate it; a no-op once it has rows
+try:
+    from .services import attendance_summary
+    with SessionLocal() as db:
+        attendance_summary.ensure(db)
+except Exception as e:
+    print(f"Warning: Could not build the attendance rollup: {e}")
+
+# Seed the finance rollup the same way, so dashboard reads never have to
+try:
+    from .services import finance_summary
+    with SessionLocal() as db:
+        finance_summary.ensure_summary(db)
+        db.commit()
+except Exception as e:
+    print(f"Warning: Could not build the finance summary: {e}")
+
 app = FastAPI(
     title="Faith Brilliant Stars School API",
     description="School Management System API",
@@ -71,6 +88,8 @@ try:
     app.include_router(accountant.router, prefix="/api", tags=["Accountant"])
     app.include_router(teacher_enhanced.router, prefix="/api", tags=["Teacher Enhanced"])
     app.include_router(parent_enhanced.router, prefix="/api", tags=["Parent Enhanced"])
+    app.include_router(mobile_money.router, prefix="/api", tags=["Mobile Money"])
+    app.include_router(wallets.router, prefix="/api", tags=["Wallets"])
 except Exception as e:
     print(f"Warning: Could not include all routers: {e}")
 
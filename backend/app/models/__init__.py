@@ -3,24 +3,28 @@ from .student import Student
 from .guardian import Guardian
 from .teacher import Teacher
 from .class_model import Class, Subject
-from .attendance import Attendance
+from .attendance import Attendance, AttendanceDailyClass, AttendanceTermBitmap
 from .assessment import Assessment, Grade
-from .fee import FeeStructure, Invoice, Payment, Wallet, ServiceItem
+from .fee import FeeStructure, Invoice, Payment, Wallet, WalletTransaction, ServiceItem, FinanceSummary, LedgerEntry, OverdueSweep, FinancialPeriod, FinancialPeriodTotal, ReceivablesAging
 from .inventory import InventoryItem, StockTransaction
 from .announcement import Announcement
 from .assignment import Assignment, Submission
 from .transport import Route, Bus, Driver, TransportAttendance
 from .academic_calendar import AcademicTerm, Holiday, SchoolEvent
-from .school_settings import SchoolSettings, PromotionRule, Discount
+from .school_settings import SchoolSettings, PromotionRule, Discount, DiscountApplication
 from .audit_log import AuditLog, Notification
 from .communication import Message, ParentTeacherMeeting
+from .document_sequence import DocumentSequence
+from .reconciliation import StatementImport, StatementLine
+from .mobile_money import MobileMoneyTransaction, MobileMoneyCallback
 
 __all__ = [
     "User", "Student", "Guardian", "Teacher", "Class", "Subject",
-    "Attendance", "Assessment", "Grade", "FeeStructure", "Invoice",
-    "Payment", "Wallet", "ServiceItem", "InventoryItem", "StockTransaction",
+    "Attendance", "AttendanceDailyClass", "AttendanceTermBitmap", "Assessment", "Grade", "FeeStructure", "Invoice",
+    "Payment", "Wallet", "WalletTransaction", "ServiceItem", "FinanceSummary", "LedgerEntry", "OverdueSweep", "FinancialPeriod", "FinancialPeriodTotal", "ReceivablesAging", "InventoryItem", "StockTransaction",
     "Announcement", "Assignment", "Submission", "Route", "Bus", "Driver",
     "TransportAttendance", "AcademicTerm", "Holiday", "SchoolEvent",
-    "SchoolSettings", "PromotionRule", "Discount", "AuditLog", "Notification",
-    "Message", "ParentTeacherMeeting"
+    "SchoolSettings", "PromotionRule", "Discount", "DiscountApplication", "AuditLog", "Notification",
+    "Message", "ParentTeacherMeeting", "DocumentSequence", "StatementImport", "StatementLine",
+    "MobileMoneyTransaction", "MobileMoneyCallback"
 ]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, DateTime, Enum, Boolean
+from sqlalchemy import Column, Integer, String, Date, ForeignKey, DateTime, Enum, Boolean, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.sql import func
 import enum
 from ..core.database import Base
@@ -22,3 +22,44 @@ class Attendance(Base):
     recorded_at = Column(DateTime(timezone=True), server_default=func.now())
     synced = Column(Boolean, default=True)
     synced_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        # One mark per student per day; the key the attendance upsert conflicts on
+        Index("uq_attendance_student_date", "student_id", "date", unique=True),
+        # Offline sync pulls a class's marks changed since a watermark
+        Index("ix_attendance_class_id_synced_at", "class_id", "synced_at"),
+    )
+
+class AttendanceDailyClass(Base):
+    """Marks per status for one class on one day, kept in step by ``services.attendance``."""
+    __tablename__ = "attendance_daily_class"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    class_id = Column(Integer, ForeignKey("classes.id"), nullable=False)
+    date = Column(Date, nullable=False, index=True)
+    present = Column(Integer, nullable=False, default=0)
+    absent = Column(Integer, nullable=False, default=0)
+    late = Column(Integer, nullable=False, default=0)
+    excused = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (UniqueConstraint("class_id", "date", name="uq_attendance_daily_class_class_date"),)
+
+class AttendanceTermBitmap(Base):
+    """One student's marks for one term, packed by ``services.attendance_bitmaps``.
+
+    Day ``i`` is ``start_date + i``. ``marked`` has one bit per day (set when
+    the day has a mark) and ``codes`` two bits per day holding the status.
+    """
+    __tablename__ = "attendance_term_bitmaps"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    term_id = Column(Integer, ForeignKey("academic_terms.id"), nullable=False, index=True)
+    start_date = Column(Date, nullable=False)
+    days = Column(Integer, nullable=False)
+    marked = Column(LargeBinary, nullable=False)
+    codes = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (UniqueConstraint("student_id", "term_id", name="uq_attendance_term_bitmaps_student_term"),)
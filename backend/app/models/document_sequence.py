@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+class DocumentSequence(Base):
+    __tablename__ = "document_sequences"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    doc_type = Column(String, nullable=False)  # invoice, receipt, admission
+    year = Column(Integer, nullable=False)
+    last_value = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    __table_args__ = (UniqueConstraint("doc_type", "year", name="uq_document_sequences_type_year"),)
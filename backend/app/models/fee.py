@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Enum, Boolean, JSON, Index, UniqueConstraint
 from sqlalchemy.sql import func
 import enum
 from ..core.database import Base
@@ -29,6 +29,18 @@ class PaymentMethod(str, enum.Enum):
     AIRTEL_MONEY = "airtel_money"
     WALLET = "wallet"
 
+class LedgerEntryType(str, enum.Enum):
+    OPENING = "opening"
+    INVOICE = "invoice"
+    PAYMENT = "payment"
+    DISCOUNT = "discount"
+    ADJUSTMENT = "adjustment"
+    REVERSAL = "reversal"
+
+class WalletTransactionType(str, enum.Enum):
+    TOP_UP = "top_up"
+    DEBIT = "debit"
+
 class FeeStructure(Base):
     __tablename__ = "fee_structures"
     
@@ -47,7 +59,7 @@ class Invoice(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     invoice_number = Column(String, unique=True, nullable=False, index=True)
-    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
     category = Column(Enum(PaymentCategory), nullable=False)
     term = Column(String)
     amount = Column(Float, nullable=False)
@@ -55,9 +67,19 @@ class Invoice(Base):
     status = Column(Enum(InvoiceStatus), default=InvoiceStatus.PENDING)
     due_date = Column(DateTime(timezone=True))
     description = Column(String)
+    late_fee_for_id = Column(Integer, ForeignKey("invoices.id"))  # set on late-fee invoices raised by the overdue sweep
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    
+    __table_args__ = (
+        # One invoice per student, category and term keeps bulk invoicing idempotent
+        Index("uq_invoices_student_category_term", "student_id", "category", "term", unique=True),
+        # At most one late fee per overdue invoice
+        Index("uq_invoices_late_fee_for_id", "late_fee_for_id", unique=True),
+        # Overdue sweep and dashboard status counts
+        Index("ix_invoices_status_due_date", "status", "due_date"),
+    )
 
 class Payment(Base):
     __tablename__ = "payments"
@@ -67,7 +89,7 @@ class Payment(Base):
     invoice_id = Column(Integer, ForeignKey("invoices.id"))
     amount = Column(Float, nullable=False)
     payment_method = Column(String, nullable=False)
-    payment_date = Column(String)
+    payment_date = Column(Date, index=True)
     recorded_by = Column(Integer, ForeignKey("users.id"))
 
 class Wallet(Base):
@@ -80,6 +102,25 @@ class Wallet(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+class WalletTransaction(Base):
+    __tablename__ = "wallet_transactions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    transaction_type = Column(Enum(WalletTransactionType), nullable=False)
+    amount = Column(Float, nullable=False)  # always positive; the type gives the direction
+    balance_after = Column(Float, nullable=False)
+    service_item_id = Column(Integer, ForeignKey("service_items.id"))
+    quantity = Column(Integer, default=1)
+    payment_method = Column(String)  # top-ups: cash, mtn_momo, airtel_money, bank
+    reference = Column(String, unique=True)  # client-generated id; replays of a queued debit are ignored
+    description = Column(String)
+    recorded_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (Index("ix_wallet_transactions_wallet_id_id", "wallet_id", "id"),)
+
 class ServiceItem(Base):
     __tablename__ = "service_items"
     
@@ -91,3 +132,100 @@ class ServiceItem(Base):
     is_recurring = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class FinanceSummary(Base):
+    __tablename__ = "finance_summary"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, unique=True, nullable=False, index=True)  # all, month:YYYY-MM, method:<payment_method>
+    total_invoiced = Column(Float, default=0.0, nullable=False)
+    total_collected = Column(Float, default=0.0, nullable=False)
+    total_outstanding = Column(Float, default=0.0, nullable=False)
+    invoice_count = Column(Integer, default=0, nullable=False)
+    pending_count = Column(Integer, default=0, nullable=False)
+    partial_count = Column(Integer, default=0, nullable=False)
+    paid_count = Column(Integer, default=0, nullable=False)
+    overdue_count = Column(Integer, default=0, nullable=False)
+    cancelled_count = Column(Integer, default=0, nullable=False)
+    payment_count = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False)
+    sequence = Column(Integer, nullable=False)  # 1, 2, 3... per student
+    entry_type = Column(Enum(LedgerEntryType), nullable=False)
+    invoice_id = Column(Integer)  # no foreign key: entries outlive deleted invoices
+    payment_id = Column(Integer)
+    reference = Column(String)  # invoice or receipt number
+    description = Column(String)
+    debit = Column(Float, default=0.0, nullable=False)
+    credit = Column(Float, default=0.0, nullable=False)
+    balance = Column(Float, nullable=False)  # running balance owed after this entry
+    created_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        # Latest balance is the highest sequence for a student; statements scan by date
+        UniqueConstraint("student_id", "sequence", name="uq_ledger_entries_student_sequence"),
+        Index("ix_ledger_entries_student_created", "student_id", "created_at"),
+    )
+
+class OverdueSweep(Base):
+    __tablename__ = "overdue_sweeps"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    run_date = Column(Date, unique=True, nullable=False)  # one row per day; reruns add to it
+    marked_overdue = Column(Integer, default=0, nullable=False)
+    reopened = Column(Integer, default=0, nullable=False)  # overdue invoices whose due date moved out
+    late_fee_count = Column(Integer, default=0, nullable=False)
+    late_fee_total = Column(Float, default=0.0, nullable=False)
+    late_fee_percentage = Column(Float)
+    grace_period_days = Column(Integer)
+    swept_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class FinancialPeriod(Base):
+    __tablename__ = "financial_periods"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    period = Column(String, unique=True, nullable=False)  # YYYY-MM
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)  # first day of the next month (exclusive)
+    total_collected = Column(Float, default=0.0, nullable=False)
+    payment_count = Column(Integer, default=0, nullable=False)
+    total_invoiced = Column(Float, default=0.0, nullable=False)
+    invoice_count = Column(Integer, default=0, nullable=False)
+    closed_by = Column(Integer, ForeignKey("users.id"))
+    closed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class FinancialPeriodTotal(Base):
+    __tablename__ = "financial_period_totals"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    period_id = Column(Integer, ForeignKey("financial_periods.id", ondelete="CASCADE"), nullable=False)
+    dimension = Column(String, nullable=False)  # method, category or class
+    key = Column(String, nullable=False)  # payment method, category value or class id
+    label = Column(String)  # class name as it was at close
+    total = Column(Float, default=0.0, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint("period_id", "dimension", "key", name="uq_financial_period_totals_period_dimension_key"),
+    )
+
+class ReceivablesAging(Base):
+    __tablename__ = "receivables_aging"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    as_of = Column(Date, nullable=False)  # the sweep day the snapshot was taken
+    class_id = Column(Integer, ForeignKey("classes.id"))
+    class_name = Column(String)
+    category = Column(Enum(PaymentCategory), nullable=False)
+    invoice_count = Column(Integer, default=0, nullable=False)
+    not_due = Column(Float, default=0.0, nullable=False)
+    days_0_30 = Column(Float, default=0.0, nullable=False)
+    days_31_60 = Column(Float, default=0.0, nullable=False)
+    days_61_90 = Column(Float, default=0.0, nullable=False)
+    days_over_90 = Column(Float, default=0.0, nullable=False)
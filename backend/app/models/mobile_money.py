@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Enum, JSON, Index, UniqueConstraint
+from sqlalchemy.sql import func
+import enum
+from ..core.database import Base
+
+class MobileMoneyStatus(str, enum.Enum):
+    PENDING = "pending"
+    SUCCESSFUL = "successful"
+    FAILED = "failed"
+
+class MobileMoneyTransaction(Base):
+    __tablename__ = "mobile_money_transactions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, nullable=False)  # mtn_momo, airtel_money
+    external_id = Column(String, unique=True, nullable=False, index=True)  # our reference, echoed back in callbacks
+    provider_transaction_id = Column(String)  # set once the provider confirms
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False)
+    phone = Column(String, nullable=False)
+    amount = Column(Float, nullable=False)
+    status = Column(Enum(MobileMoneyStatus), default=MobileMoneyStatus.PENDING, nullable=False)
+    failure_reason = Column(String)
+    payment_id = Column(Integer, ForeignKey("payments.id"))
+    initiated_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        # A provider transaction can only ever settle one of our transactions
+        UniqueConstraint("provider", "provider_transaction_id", name="uq_mobile_money_provider_transaction"),
+    )
+
+class MobileMoneyCallback(Base):
+    __tablename__ = "mobile_money_callbacks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    received_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True))  # null while queued
+    result = Column(String)  # posted, failed, duplicate, unknown, pending, amount_mismatch, review
+
+    __table_args__ = (Index("ix_mobile_money_callbacks_queue", "processed_at", "id"),)
@@ -0,0 +1,52 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Enum, Index
+from sqlalchemy.sql import func
+import enum
+from ..core.database import Base
+
+class StatementLineStatus(str, enum.Enum):
+    MATCHED = "matched"      # posted as a new payment, or linked to one already recorded
+    REVIEW = "review"        # waiting for an accountant
+    RESOLVED = "resolved"    # posted by hand from the review queue
+    IGNORED = "ignored"      # not a credit, or dismissed from the review queue
+    DUPLICATE = "duplicate"  # transaction already imported
+
+class StatementImport(Base):
+    __tablename__ = "statement_imports"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, nullable=False)  # payment method: mtn_momo, airtel_money, bank
+    filename = Column(String)
+    line_count = Column(Integer, default=0)
+    matched_count = Column(Integer, default=0)
+    review_count = Column(Integer, default=0)
+    ignored_count = Column(Integer, default=0)
+    duplicate_count = Column(Integer, default=0)
+    matched_amount = Column(Float, default=0.0)
+    imported_by = Column(Integer, ForeignKey("users.id"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class StatementLine(Base):
+    __tablename__ = "statement_lines"
+
+    id = Column(Integer, primary_key=True, index=True)
+    import_id = Column(Integer, ForeignKey("statement_imports.id"), nullable=False)
+    line_number = Column(Integer, nullable=False)
+    source = Column(String, nullable=False)
+    transaction_id = Column(String)  # provider or bank transaction reference
+    transaction_date = Column(Date)
+    amount = Column(Float)
+    reference = Column(String)  # what the payer wrote: invoice or admission number, narrative
+    phone = Column(String)
+    payer_name = Column(String)
+    status = Column(Enum(StatementLineStatus), nullable=False)
+    match_rule = Column(String)  # reference, phone, amount_date
+    note = Column(String)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"))
+    payment_id = Column(Integer, ForeignKey("payments.id"), index=True)
+    resolved_by = Column(Integer, ForeignKey("users.id"))
+    resolved_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index("ix_statement_lines_import_status", "import_id", "status"),
+        Index("ix_statement_lines_source_transaction", "source", "transaction_id"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, JSON, ForeignKey
 from sqlalchemy.sql import func
 from ..core.database import Base
 
@@ -18,6 +18,8 @@ class SchoolSettings(Base):
     current_term = Column(String)
     late_fee_percentage = Column(Float, default=5.0)
     grace_period_days = Column(Integer, default=7)
+    low_attendance_threshold = Column(Float, default=75.0)  # percent present below which a student is flagged
+    low_attendance_window_days = Column(Integer, default=7)
     sms_enabled = Column(Boolean, default=True)
     email_enabled = Column(Boolean, default=True)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -43,3 +45,16 @@ class Discount(Base):
     conditions = Column(JSON)  # {min_siblings: 2, etc}
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class DiscountApplication(Base):
+    __tablename__ = "discount_applications"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    discount_id = Column(Integer, ForeignKey("discounts.id"), nullable=False, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), unique=True, nullable=False)  # one rule discount per invoice
+    student_id = Column(Integer, ForeignKey("students.id"), nullable=False, index=True)
+    term = Column(String)
+    percentage = Column(Float, nullable=False)
+    amount = Column(Float, nullable=False)  # taken off the invoice
+    applied_by = Column(Integer, ForeignKey("users.id"))
+    applied_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -21,7 +21,7 @@ class Student(Base):
     date_of_birth = Column(Date, nullable=False)
     gender = Column(String)
     photo_url = Column(String)
-    class_id = Column(Integer, ForeignKey("classes.id"))
+    class_id = Column(Integer, ForeignKey("classes.id"), index=True)
     enrollment_status = Column(Enum(EnrollmentStatus), default=EnrollmentStatus.ACTIVE)
     enrollment_date = Column(Date, nullable=False)
     emergency_contact = Column(JSON)  # {name, phone, relation}
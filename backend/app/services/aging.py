@@ -0,0 +1,150 @@
+"""Receivables aging: open balances by how long they are past due.
+
+Every open invoice (pending, partial or overdue) with a balance falls into
+one bucket: ``current`` (not yet due, or no due date), ``0_30``, ``31_60``,
+``61_90`` or ``90_plus`` days past due. The buckets are conditional sums
+(``SUM(CASE ...)``) in one grouped query filtered on ``(status, due_date)``;
+the bucket edges are computed in Python, so the SQL is plain comparisons on
+both SQLite and Postgres.
+
+The overdue sweep also saves the class-by-category rows to
+``receivables_aging``, so dashboards can read the day's figures without
+touching the invoices.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import and_, case, delete, func, insert, or_
+from sqlalchemy.orm import Session
+from ..models.class_model import Class
+from ..models.fee import Invoice, InvoiceStatus, PaymentCategory, ReceivablesAging
+from ..models.student import Student
+
+BUCKETS = ("current", "0_30", "31_60", "61_90", "90_plus")
+
+SNAPSHOT_COLUMNS = dict(zip(BUCKETS, ("not_due", "days_0_30", "days_31_60", "days_61_90", "days_over_90")))
+
+OPEN_STATUSES = (InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE)
+
+def bucket_conditions(today: date) -> dict:
+    """{bucket: condition on ``Invoice.due_date``} as of the start of ``today``."""
+    start = datetime.combine(today, time.min)
+    edges = [start - timedelta(days=days) for days in (30, 60, 90)]
+    due = Invoice.due_date
+    return {
+        "current": or_(due.is_(None), due >= start),
+        "0_30": and_(due < start, due >= edges[0]),
+        "31_60": and_(due < edges[0], due >= edges[1]),
+        "61_90": and_(due < edges[1], due >= edges[2]),
+        "90_plus": due < edges[2],
+    }
+
+def _query(db: Session, today: date, *columns, class_id: int | None = None, category: str | None = None):
+    balance = Invoice.amount - func.coalesce(Invoice.amount_paid, 0)
+    sums = [func.coalesce(func.sum(case((condition, balance), else_=0)), 0).label(f"b_{name}")
+            for name, condition in bucket_conditions(today).items()]
+    query = db.query(*columns, func.count(Invoice.id).label("invoice_count"), *sums).select_from(Invoice).join(
+        Student, Student.id == Invoice.student_id
+    ).outerjoin(Class, Class.id == Student.class_id).filter(Invoice.status.in_(OPEN_STATUSES), balance > 0)
+    if class_id:
+        query = query.filter(Student.class_id == class_id)
+    if category:
+        query = query.filter(Invoice.category == PaymentCategory(category))
+    return query
+
+def _buckets(row) -> dict:
+    values = {name: getattr(row, f"b_{name}") or 0.0 for name in BUCKETS}
+    values["total"] = sum(values.values())
+    return values
+
+def class_category_rows(db: Session, today: date | None = None, class_id: int | None = None,
+                        category: str | None = None) -> list[dict]:
+    """One row per class and category with the balance in each bucket."""
+    today = today or date.today()
+    rows = _query(db, today, Student.class_id, Class.name, Invoice.category, class_id=class_id, category=category).group_by(
+        Student.class_id, Class.name, Invoice.category
+    ).order_by(Class.name, Invoice.category).all()
+    return [{
+        "class_id": row.class_id, "class_name": row.name, "category": PaymentCategory(row.category).value,
+        "invoice_count": row.invoice_count, **_buckets(row)
+    } for row in rows]
+
+def _empty() -> dict:
+    return {"invoice_count": 0, "total": 0.0, **{name: 0.0 for name in BUCKETS}}
+
+def summarize(rows: list[dict], as_of: date, snapshot: bool = False) -> dict:
+    """Totals by class and by category folded from ``class_category_rows``."""
+    def fold(key):
+        groups = {}
+        for row in rows:
+            group = groups.setdefault(key(row), _empty())
+            group["invoice_count"] += row["invoice_count"]
+            for name in (*BUCKETS, "total"):
+                group[name] += row[name]
+        return groups
+
+    by_class = fold(lambda row: (row["class_id"], row["class_name"]))
+    return {
+        "as_of": as_of.isoformat(),
+        "snapshot": snapshot,
+        "totals": fold(lambda row: "all").get("all", _empty()),
+        "by_class": [{"class_id": class_id, "class": name or "N/A", **values} for (class_id, name), values in by_class.items()],
+        "by_category": [{"category": category, **values} for category, values in fold(lambda row: row["category"]).items()],
+        "rows": rows,
+    }
+
+def report(db: Session, today: date | None = None, class_id: int | None = None, category: str | None = None) -> dict:
+    today = today or date.today()
+    return summarize(class_category_rows(db, today, class_id, category), today)
+
+def students(db: Session, today: date | None = None, class_id: int | None = None, category: str | None = None,
+             bucket: str | None = None, limit: int = 100) -> list[dict]:
+    """Students with open balances, largest first; ``bucket`` counts only invoices in that bucket."""
+    today = today or date.today()
+    query = _query(db, today, Student.id, Student.admission_number, Student.first_name, Student.last_name, Class.name,
+                   class_id=class_id, category=category)
+    if bucket:
+        query = query.filter(bucket_conditions(today)[bucket])
+    balance = func.sum(Invoice.amount - func.coalesce(Invoice.amount_paid, 0))
+    rows = query.group_by(
+        Student.id, Student.admission_number, Student.first_name, Student.last_name, Class.name
+    ).order_by(balance.desc(), Student.id).limit(limit).all()
+    return [{
+        "student_id": row.id,
+        "admission_number": row.admission_number,
+        "student": f"{row.first_name} {row.last_name}",
+        "class": row.name or "N/A",
+        "invoice_count": row.invoice_count,
+        **_buckets(row)
+    } for row in rows]
+
+def refresh_snapshot(db: Session, today: date | None = None) -> int:
+    """Replace the saved rows with today's; the caller commits."""
+    today = today or date.today()
+    rows = class_category_rows(db, today)
+    db.execute(delete(ReceivablesAging))
+    if rows:
+        db.execute(insert(ReceivablesAging.__table__), [{
+            "as_of": today, "class_id": row["class_id"], "class_name": row["class_name"],
+            "category": PaymentCategory(row["category"]), "invoice_count": row["invoice_count"],
+            **{column: row[name] for name, column in SNAPSHOT_COLUMNS.items()}
+        } for row in rows])
+    return len(rows)
+
+def load_snapshot(db: Session, class_id: int | None = None, category: str | None = None) -> dict | None:
+    """The saved report, or None if no sweep has saved one yet."""
+    query = db.query(ReceivablesAging)
+    if class_id:
+        query = query.filter(ReceivablesAging.class_id == class_id)
+    if category:
+        query = query.filter(ReceivablesAging.category == PaymentCategory(category))
+    saved = query.order_by(ReceivablesAging.class_name, ReceivablesAging.category).all()
+    as_of = db.query(func.max(ReceivablesAging.as_of)).scalar()
+    if as_of is None:
+        return None
+    rows = []
+    for s in saved:
+        values = {name: getattr(s, column) for name, column in SNAPSHOT_COLUMNS.items()}
+        rows.append({
+            "class_id": s.class_id, "class_name": s.class_name, "category": s.category.value,
+            "invoice_count": s.invoice_count, **values, "total": sum(values.values())
+        })
+    return summarize(rows, as_of, snapshot=True)
@@ -0,0 +1,206 @@
+"""Recording attendance marks.
+
+Every write path (the class register, bulk marking, mark-all-present,
+offline sync and absences reported by parents) goes through ``write``:
+one ``INSERT ... ON CONFLICT (student_id, date)`` statement per batch, the
+same on SQLite and Postgres, so marking a class of 45 is one round trip and
+marking a day again replaces the earlier mark instead of adding a row. The
+per-class daily counts in ``attendance_summary`` and the per-term bitmaps
+in ``attendance_bitmaps`` are updated for what a batch touched, in the same
+transaction.
+
+``sync`` is the offline protocol for classroom tablets. A tablet sends the
+watermark from its last sync and the marks it took offline, each with the
+time it was taken (``recorded_at``). A mark replaces the server's only if
+it was taken later; on a tie the server's stays, so replaying a batch or
+receiving batches in a different order ends in the same state. Every
+write stamps ``synced_at`` with the server time, and the response carries
+the marks whose ``synced_at`` is past the watermark, plus a new watermark.
+"""
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Session
+from ..core.database import dialect_insert
+from ..models.attendance import Attendance, AttendanceStatus
+from ..models.student import Student
+from . import attendance_bitmaps, attendance_summary
+
+KEY = ["student_id", "date"]
+
+SYNC_BATCH_LIMIT = 500
+SYNC_PULL_LIMIT = 2000
+SYNC_INITIAL_DAYS = 30
+SYNC_OVERLAP = timedelta(minutes=1)  # re-sends marks committed late by a slow transaction
+SYNC_CLOCK_SKEW = timedelta(minutes=5)
+
+def parse_status(value) -> AttendanceStatus:
+    try:
+        return AttendanceStatus(value)
+    except ValueError:
+        raise ValueError(f"Invalid attendance status: {value}")
+
+def mark_date(value) -> date:
+    """The calendar day of a ``date``, ``datetime`` or ISO string."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.fromisoformat(value).date()
+
+def utc(value) -> datetime:
+    """An ISO string or datetime as an aware UTC datetime; naive values are taken as UTC."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+def write(db: Session, marks, recorded_by: int, on_conflict: str = "overwrite") -> list[tuple]:
+    """Write ``{student_id, class_id, date, status, notes?, recorded_at?}`` marks in one statement; the caller commits.
+
+    ``on_conflict`` decides what happens to a day that already has a mark:
+    ``"overwrite"`` replaces it, ``"keep"`` leaves it, and ``"newer"``
+    replaces it only if the incoming ``recorded_at`` is later (ties keep the
+    stored mark). A student listed twice for the same day keeps the last
+    mark. Every row written gets ``synced_at`` = now, the clock offline
+    sync pulls changes by. Returns the ``(student_id, date)`` keys written.
+    """
+    now = datetime.now(timezone.utc)
+    rows = {}
+    for mark in marks:
+        day = mark_date(mark["date"])
+        rows[(mark["student_id"], day)] = {
+            "student_id": mark["student_id"], "class_id": mark["class_id"], "date": day,
+            "status": parse_status(mark["status"]), "notes": mark.get("notes"), "recorded_by": recorded_by,
+            "recorded_at": utc(mark["recorded_at"]) if mark.get("recorded_at") else now, "synced": True, "synced_at": now
+        }
+    if not rows:
+        return []
+    days = {day for _, day in rows}
+    class_ids = {row["class_id"] for row in rows.values()}
+    if on_conflict != "keep":  # a mark that moves to another class changes that class's counts too
+        class_ids.update(class_id for class_id, in db.query(Attendance.class_id).filter(
+            Attendance.student_id.in_({student_id for student_id, _ in rows}), Attendance.date.in_(days)
+        ).distinct())
+    statement = dialect_insert(db.get_bind(), Attendance.__table__).values(list(rows.values()))
+    if on_conflict == "keep":
+        statement = statement.on_conflict_do_nothing(index_elements=KEY)
+    else:
+        statement = statement.on_conflict_do_update(index_elements=KEY, set_={
+            column: statement.excluded[column]
+            for column in ("class_id", "status", "notes", "recorded_by", "recorded_at", "synced", "synced_at")
+        }, where=(
+            or_(Attendance.recorded_at.is_(None), Attendance.recorded_at < statement.excluded.recorded_at)
+            if on_conflict == "newer" else None
+        ))
+    written = [tuple(key) for key in db.execute(statement.returning(Attendance.student_id, Attendance.date))]
+    attendance_summary.refresh(db, days, class_ids)
+    attendance_bitmaps.record(db, [(student_id, day, rows[(student_id, day)]["status"]) for student_id, day in written])
+    return written
+
+def upsert(db: Session, marks, recorded_by: int, overwrite: bool = True) -> int:
+    """``write`` for the marking endpoints; with ``overwrite=False`` days already marked keep their mark.
+
+    Returns the number of rows written.
+    """
+    return len(write(db, marks, recorded_by, "overwrite" if overwrite else "keep"))
+
+def _watermark(synced_at: datetime | None, last_id: int = 0) -> str:
+    return f"{utc(synced_at or datetime.min).isoformat()}|{last_id}"
+
+def _parse_watermark(watermark: str) -> tuple[datetime, int]:
+    try:
+        synced_at, _, last_id = watermark.partition("|")
+        return utc(synced_at), int(last_id or 0)
+    except ValueError:
+        raise ValueError("Invalid watermark")
+
+def _wire(mark: Attendance) -> dict:
+    return {
+        "student_id": mark.student_id, "class_id": mark.class_id, "date": mark.date.isoformat(),
+        "status": AttendanceStatus(mark.status).value, "notes": mark.notes,
+        "recorded_at": utc(mark.recorded_at).isoformat() if mark.recorded_at else None,
+        "synced_at": utc(mark.synced_at).isoformat() if mark.synced_at else None,
+    }
+
+def outside_classes(db: Session, marks, class_ids) -> set:
+    """Indexes of ``marks`` for a class, or a student, outside ``class_ids``."""
+    class_ids = set(class_ids)
+    student_ids = {mark["student_id"] for mark in marks}
+    student_classes = dict(db.query(Student.id, Student.class_id).filter(Student.id.in_(student_ids))) if student_ids else {}
+    return {index for index, mark in enumerate(marks)
+            if mark["class_id"] not in class_ids or student_classes.get(mark["student_id"]) not in class_ids}
+
+def sync(db: Session, changes: list[dict], watermark: str | None, class_ids, recorded_by: int,
+         today: date | None = None, allowed_class_ids=None) -> dict:
+    """Apply a tablet's offline marks and return the server's marks changed since ``watermark``; commits.
+
+    ``class_ids`` limits what is sent back (``None`` for every class). With
+    no watermark the tablet gets the last ``SYNC_INITIAL_DAYS`` days. At
+    most ``SYNC_PULL_LIMIT`` marks come back at once; ``has_more`` asks the
+    tablet to sync again straight away with the returned watermark.
+    ``allowed_class_ids`` (``None`` for no limit) restricts both ways to the
+    classes the caller may see: ``class_ids`` is narrowed to them, and a
+    change whose class or student is outside them is rejected.
+    """
+    if allowed_class_ids is not None:
+        allowed_class_ids = set(allowed_class_ids)
+        class_ids = allowed_class_ids if class_ids is None else allowed_class_ids & set(class_ids)
+    if len(changes) > SYNC_BATCH_LIMIT:
+        raise ValueError(f"At most {SYNC_BATCH_LIMIT} changes per sync")
+    since = _parse_watermark(watermark) if watermark else None
+    now = datetime.now(timezone.utc)
+
+    marks, errors = [], []
+    for index, change in enumerate(changes):
+        try:
+            if not change.get("recorded_at"):
+                raise ValueError("recorded_at is required")
+            if utc(change["recorded_at"]) > now + SYNC_CLOCK_SKEW:  # a tablet clock running fast would win every conflict
+                raise ValueError("recorded_at is in the future; check the device clock")
+            marks.append({
+                "student_id": int(change["student_id"]), "class_id": int(change["class_id"]),
+                "date": mark_date(change["date"]), "status": parse_status(change["status"]), "notes": change.get("notes"),
+                "recorded_at": utc(change["recorded_at"])
+            })
+            marks[-1]["index"] = index
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({"index": index, "error": str(e)})
+    if allowed_class_ids is not None:
+        outside = outside_classes(db, marks, allowed_class_ids)
+        errors.extend({"index": marks[i]["index"], "error": "Student is not in one of your classes"} for i in sorted(outside))
+        errors.sort(key=lambda error: error["index"])
+        marks = [mark for i, mark in enumerate(marks) if i not in outside]
+    sent = {(mark["student_id"], mark["date"]) for mark in marks}
+    applied = set(write(db, marks, recorded_by, "newer"))
+    conflicts = []
+    if sent - applied:
+        conflicts = [_wire(mark) for mark in db.query(Attendance).filter(
+            tuple_(Attendance.student_id, Attendance.date).in_(sent - applied)
+        ).order_by(Attendance.student_id, Attendance.date)]
+    db.commit()
+
+    pulled_at = datetime.now(timezone.utc)
+    query = db.query(Attendance)
+    if class_ids is not None:
+        query = query.filter(Attendance.class_id.in_(list(class_ids)))
+    if since:
+        synced_at, last_id = since
+        query = query.filter(or_(Attendance.synced_at > synced_at,
+                                 and_(Attendance.synced_at == synced_at, Attendance.id > last_id)))
+    else:
+        query = query.filter(Attendance.date >= (today or date.today()) - timedelta(days=SYNC_INITIAL_DAYS))
+    rows = query.order_by(Attendance.synced_at, Attendance.id).limit(SYNC_PULL_LIMIT + 1).all()
+    has_more = len(rows) > SYNC_PULL_LIMIT
+    rows = rows[:SYNC_PULL_LIMIT]
+    if has_more:
+        next_watermark = _watermark(rows[-1].synced_at, rows[-1].id)
+    else:
+        next_watermark = _watermark(pulled_at - SYNC_OVERLAP)
+
+    return {
+        "watermark": next_watermark,
+        "has_more": has_more,
+        "applied": len(applied),
+        "conflicts": conflicts,
+        "errors": errors,
+        "changes": [_wire(mark) for mark in rows if (mark.student_id, mark.date) not in applied],
+    }
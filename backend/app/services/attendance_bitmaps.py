@@ -0,0 +1,224 @@
+"""Each student's attendance for a term packed into two small blobs.
+
+Day ``i`` of a term is ``start_date + i``. ``marked`` holds one bit per day
+and ``codes`` two bits per day (``CODES``), so a 90-day term is 12 + 23
+bytes per student. A whole school's term decodes from a few hundred blobs
+straight into NumPy matrices (students x days), and rates, absence streaks
+and calendars are array operations rather than loops over ``Attendance``
+rows.
+
+``attendance.upsert`` patches the bitmaps of the students and terms it
+wrote, in the same transaction. A term with no bitmaps yet, or with bitmaps
+built for dates the term no longer has, is rebuilt from ``attendance``.
+"""
+import numpy as np
+from datetime import date, timedelta
+from sqlalchemy import delete, insert
+from sqlalchemy.orm import Session
+from ..core import dates
+from ..models.academic_calendar import AcademicTerm
+from ..models.attendance import Attendance, AttendanceStatus, AttendanceTermBitmap
+from ..models.class_model import Class
+from ..models.student import Student
+
+CODES = {AttendanceStatus.PRESENT: 0, AttendanceStatus.ABSENT: 1, AttendanceStatus.LATE: 2, AttendanceStatus.EXCUSED: 3}
+STATUSES = list(CODES)  # indexed by code
+
+_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)  # four codes per byte, first day in the high bits
+
+def term_days(term: AcademicTerm) -> int:
+    return (term.end_date - term.start_date).days + 1
+
+def pack(marked: np.ndarray, codes: np.ndarray) -> tuple[list[bytes], list[bytes]]:
+    """Encode (students x days) ``marked`` flags and ``codes`` into one pair of blobs per student."""
+    n, days = codes.shape
+    padded = np.zeros((n, -(-days // 4) * 4), dtype=np.uint8)
+    padded[:, :days] = codes
+    packed_codes = np.bitwise_or.reduce(padded.reshape(n, -1, 4) << _SHIFTS, axis=2).astype(np.uint8)
+    packed_marked = np.packbits(marked.astype(bool), axis=1)
+    return [row.tobytes() for row in packed_marked], [row.tobytes() for row in packed_codes]
+
+def unpack(marked: list[bytes], codes: list[bytes], days: int) -> tuple[np.ndarray, np.ndarray]:
+    """Decode blobs of one term into (students x days) ``marked`` and ``codes`` matrices in one go."""
+    if not codes:
+        return np.zeros((0, days), dtype=bool), np.zeros((0, days), dtype=np.uint8)
+    n = len(codes)
+    bits = np.unpackbits(np.frombuffer(b"".join(marked), dtype=np.uint8).reshape(n, -1), axis=1)[:, :days]
+    packed = np.frombuffer(b"".join(codes), dtype=np.uint8).reshape(n, -1)
+    return bits.astype(bool), ((packed[:, :, None] >> _SHIFTS) & 3).reshape(n, -1)[:, :days]
+
+def _is_current(db: Session, term: AcademicTerm) -> bool:
+    layouts = db.query(AttendanceTermBitmap.start_date, AttendanceTermBitmap.days).filter(
+        AttendanceTermBitmap.term_id == term.id
+    ).distinct().all()
+    return layouts == [(term.start_date, term_days(term))]
+
+def rebuild(db: Session, term: AcademicTerm, commit: bool = True) -> int:
+    """Re-encode every student's bitmap for ``term`` from ``attendance``; returns how many were written."""
+    db.execute(delete(AttendanceTermBitmap).where(AttendanceTermBitmap.term_id == term.id))
+    rows = db.query(Attendance.student_id, Attendance.date, Attendance.status).filter(
+        *dates.through(Attendance.date, term.start_date, term.end_date)
+    ).all()
+    student_ids = []
+    if rows:
+        student_ids, rows_index = np.unique(np.array([row[0] for row in rows]), return_inverse=True)
+        day_index = (np.array([row[1] for row in rows], dtype="datetime64[D]") - np.datetime64(term.start_date, "D")).astype(int)
+        marked = np.zeros((len(student_ids), term_days(term)), dtype=bool)
+        codes = np.zeros(marked.shape, dtype=np.uint8)
+        marked[rows_index, day_index] = True
+        codes[rows_index, day_index] = [CODES[AttendanceStatus(row[2])] for row in rows]
+        packed_marked, packed_codes = pack(marked, codes)
+        db.execute(insert(AttendanceTermBitmap.__table__), [{
+            "student_id": int(student_id), "term_id": term.id, "start_date": term.start_date, "days": term_days(term),
+            "marked": packed_marked[i], "codes": packed_codes[i]
+        } for i, student_id in enumerate(student_ids)])
+    if commit:
+        db.commit()
+    return len(student_ids)
+
+def ensure(db: Session, term: AcademicTerm) -> None:
+    if not _is_current(db, term):
+        rebuild(db, term)
+
+def record(db: Session, marks) -> None:
+    """Patch the bitmaps for ``(student_id, day, status)`` marks just written to ``attendance``; the caller commits."""
+    if not marks:
+        return
+    days = [day for _, day, _ in marks]
+    for term in db.query(AcademicTerm).filter(AcademicTerm.start_date <= max(days), AcademicTerm.end_date >= min(days)):
+        in_term = [(student_id, (day - term.start_date).days, CODES[status])
+                   for student_id, day, status in marks if term.start_date <= day <= term.end_date]
+        if not in_term:
+            continue
+        if not _is_current(db, term):
+            rebuild(db, term, commit=False)  # reads the marks just written, so nothing is left to patch
+            continue
+
+        student_ids = sorted({student_id for student_id, _, _ in in_term})
+        index = {student_id: i for i, student_id in enumerate(student_ids)}
+        existing = db.query(AttendanceTermBitmap).filter(
+            AttendanceTermBitmap.term_id == term.id, AttendanceTermBitmap.student_id.in_(student_ids)
+        ).with_for_update().all()
+        marked = np.zeros((len(student_ids), term_days(term)), dtype=bool)
+        codes = np.zeros(marked.shape, dtype=np.uint8)
+        if existing:
+            rows = [index[bitmap.student_id] for bitmap in existing]
+            marked[rows], codes[rows] = unpack([b.marked for b in existing], [b.codes for b in existing], term_days(term))
+
+        marked_students, day_index, values = (np.array(column) for column in zip(*in_term))
+        rows = np.array([index[student_id] for student_id in marked_students.tolist()])
+        marked[rows, day_index] = True
+        codes[rows, day_index] = values
+
+        packed_marked, packed_codes = pack(marked, codes)
+        by_student = {bitmap.student_id: bitmap for bitmap in existing}
+        for student_id, i in index.items():
+            bitmap = by_student.get(student_id)
+            if bitmap is None:
+                bitmap = AttendanceTermBitmap(student_id=student_id, term_id=term.id, start_date=term.start_date,
+                                              days=term_days(term))
+                db.add(bitmap)
+            bitmap.marked, bitmap.codes = packed_marked[i], packed_codes[i]
+    db.flush()  # a later batch in the same transaction must see the new rows
+
+def load(db: Session, term: AcademicTerm, student_ids=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """``(student ids, marked, codes)`` for the term, one matrix row per student with a bitmap."""
+    ensure(db, term)
+    query = db.query(AttendanceTermBitmap.student_id, AttendanceTermBitmap.marked, AttendanceTermBitmap.codes).filter(
+        AttendanceTermBitmap.term_id == term.id
+    )
+    if student_ids is not None:
+        query = query.filter(AttendanceTermBitmap.student_id.in_(list(student_ids)))
+    rows = query.order_by(AttendanceTermBitmap.student_id).all()
+    marked, codes = unpack([row.marked for row in rows], [row.codes for row in rows], term_days(term))
+    return np.array([row.student_id for row in rows], dtype=np.int64), marked, codes
+
+def counts(marked: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """(students x statuses) number of marked days with each status, in ``STATUSES`` order."""
+    return np.stack([(marked & (codes == code)).sum(axis=1) for code in range(len(STATUSES))], axis=1)
+
+def streaks(flags: np.ndarray, marked: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Longest and current run per student of marked days where ``flags`` is set.
+
+    Only marked days count, so weekends and holidays neither end a run nor
+    add to it. The current run is one that reaches the student's last
+    marked day.
+    """
+    ordinal = np.cumsum(marked, axis=1)  # position of each day among the student's marked days
+    longest = np.zeros(len(marked), dtype=int)
+    current = np.zeros(len(marked), dtype=int)
+    rows, columns = np.nonzero(flags & marked)
+    if not len(rows):
+        return longest, current
+    position = ordinal[rows, columns]
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = (rows[1:] != rows[:-1]) | (position[1:] != position[:-1] + 1)
+    lengths = np.bincount(np.cumsum(starts) - 1)
+    run_rows = rows[starts]
+    np.maximum.at(longest, run_rows, lengths)
+    last_position = position[np.r_[np.nonzero(starts)[0][1:] - 1, len(position) - 1]]
+    reaches_end = last_position == ordinal[run_rows, -1]
+    current[run_rows[reaches_end]] = lengths[reaches_end]
+    return longest, current
+
+def _stats(status_counts) -> dict:
+    stats = {status.value: int(count) for status, count in zip(STATUSES, status_counts)}
+    stats["total"] = sum(stats.values())
+    stats["rate"] = round(stats["present"] / stats["total"] * 100, 2) if stats["total"] else 0.0
+    return stats
+
+def term_summary(db: Session, term: AcademicTerm, class_id: int | None = None) -> dict:
+    """Per-student counts, present rate and absence streaks for a term, lowest rate first."""
+    students = db.query(Student.id, Student.admission_number, Student.first_name, Student.last_name, Class.name).outerjoin(
+        Class, Class.id == Student.class_id
+    )
+    if class_id:
+        students = students.filter(Student.class_id == class_id)
+    info = {row.id: row for row in students}
+    student_ids, marked, codes = load(db, term, info.keys() if class_id else None)
+    status_counts = counts(marked, codes)
+    longest, current = streaks(codes == CODES[AttendanceStatus.ABSENT], marked)
+
+    summary = []
+    for i, student_id in enumerate(student_ids.tolist()):
+        row = info.get(student_id)
+        summary.append({
+            "student_id": student_id,
+            "admission_number": row.admission_number if row else None,
+            "student": f"{row.first_name} {row.last_name}" if row else None,
+            "class": (row.name if row else None) or "N/A",
+            **_stats(status_counts[i]),
+            "longest_absence_streak": int(longest[i]),
+            "current_absence_streak": int(current[i]),
+        })
+    summary.sort(key=lambda s: (s["rate"], s["student_id"]))
+    return {
+        "term": {"id": term.id, "name": term.name, "academic_year": term.academic_year,
+                 "start_date": term.start_date.isoformat(), "end_date": term.end_date.isoformat()},
+        "totals": _stats(status_counts.sum(axis=0) if len(status_counts) else np.zeros(len(STATUSES))),
+        "students": summary,
+    }
+
+def calendar(db: Session, term: AcademicTerm, student_id: int) -> dict:
+    """A student's marked days in ``term`` with their status, plus counts and streaks."""
+    _, marked, codes = load(db, term, [student_id])
+    if not len(marked):
+        marked, codes = np.zeros((1, term_days(term)), dtype=bool), np.zeros((1, term_days(term)), dtype=np.uint8)
+    longest, current = streaks(codes == CODES[AttendanceStatus.ABSENT], marked)
+    return {
+        "term_id": term.id,
+        "student_id": student_id,
+        **_stats(counts(marked, codes)[0]),
+        "longest_absence_streak": int(longest[0]),
+        "current_absence_streak": int(current[0]),
+        "days": [{"date": (term.start_date + timedelta(days=int(day))).isoformat(), "status": STATUSES[codes[0, day]].value}
+                 for day in np.nonzero(marked[0])[0]],
+    }
+
+def term_for(db: Session, term_id: int | None = None, today: date | None = None) -> AcademicTerm | None:
+    """The given term, else the active one, else the term that contains ``today``."""
+    if term_id:
+        return db.query(AcademicTerm).filter(AcademicTerm.id == term_id).first()
+    today = today or date.today()
+    return db.query(AcademicTerm).filter(AcademicTerm.is_active == True).order_by(AcademicTerm.start_date.desc()).first() or \
+        db.query(AcademicTerm).filter(AcademicTerm.start_date <= today, AcademicTerm.end_date >= today).first()
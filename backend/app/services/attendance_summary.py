@@ -0,0 +1,132 @@
+"""Per-class daily attendance counts for dashboards and reports.
+
+``attendance_daily_class`` holds one row per class per day with its number
+of present, absent, late and excused marks. ``attendance.upsert`` refreshes
+the rows of the classes and days it wrote inside the same transaction, so
+every attendance rate is a sum over these rows (a class has one per school
+day) instead of a scan of ``attendance``. ``rebuild`` recomputes the table
+from the marks; ``ensure`` runs it once at startup on databases whose marks
+predate the table, so readers never write.
+
+``low_attendance`` is the per-student counterpart for dashboards: one
+grouped query whose ``HAVING`` clause keeps only the students below the
+school's threshold.
+"""
+from datetime import date, timedelta
+from sqlalchemy import case, delete, func, select, true
+from sqlalchemy.orm import Session
+from ..core import dates
+from ..core.database import dialect_insert
+from ..models.attendance import Attendance, AttendanceDailyClass, AttendanceStatus
+from ..models.class_model import Class
+from ..models.school_settings import SchoolSettings
+from ..models.student import Student
+
+RECENT_DAYS = 30
+
+COUNT_COLUMNS = {
+    AttendanceStatus.PRESENT: "present",
+    AttendanceStatus.ABSENT: "absent",
+    AttendanceStatus.LATE: "late",
+    AttendanceStatus.EXCUSED: "excused",
+}
+
+def _write(db: Session, where: list) -> None:
+    """Insert (or overwrite) the counts of every class and day matching ``where`` in one INSERT ... SELECT."""
+    counts = select(Attendance.class_id, Attendance.date, *(
+        func.sum(case((Attendance.status == status, 1), else_=0)) for status in COUNT_COLUMNS
+    )).where(*where).group_by(Attendance.class_id, Attendance.date)  # SQLite needs the WHERE to parse ON CONFLICT
+    statement = dialect_insert(db.get_bind(), AttendanceDailyClass.__table__).from_select(
+        ["class_id", "date", *COUNT_COLUMNS.values()], counts
+    )
+    db.execute(statement.on_conflict_do_update(index_elements=["class_id", "date"], set_={
+        **{name: statement.excluded[name] for name in COUNT_COLUMNS.values()}, "updated_at": func.now()
+    }))
+
+def rebuild(db: Session, commit: bool = True) -> None:
+    """Recompute every row from ``attendance``."""
+    db.execute(delete(AttendanceDailyClass))
+    _write(db, [true()])
+    if commit:
+        db.commit()
+
+def refresh(db: Session, days, class_ids) -> None:
+    """Recompute the rows of ``class_ids`` on ``days`` after their marks changed; the caller commits."""
+    if not db.query(AttendanceDailyClass.id).first():
+        rebuild(db, commit=False)
+        return
+    days, class_ids = list(days), list(class_ids)
+    db.execute(delete(AttendanceDailyClass).where(
+        AttendanceDailyClass.date.in_(days), AttendanceDailyClass.class_id.in_(class_ids)
+    ))
+    _write(db, [Attendance.date.in_(days), Attendance.class_id.in_(class_ids)])
+
+def ensure(db: Session) -> None:
+    """Build the table from existing marks if it has never been filled."""
+    if not db.query(AttendanceDailyClass.id).first() and db.query(Attendance.id).first():
+        rebuild(db)
+
+def _query(db: Session, *columns, start: date | None = None, end: date | None = None, class_ids=None):
+    query = db.query(*columns, *(
+        func.coalesce(func.sum(getattr(AttendanceDailyClass, name)), 0).label(name) for name in COUNT_COLUMNS.values()
+    )).select_from(AttendanceDailyClass).filter(*dates.between(AttendanceDailyClass.date, start, end))
+    if class_ids is not None:
+        query = query.filter(AttendanceDailyClass.class_id.in_(list(class_ids)))
+    return query
+
+def _counts(row) -> dict:
+    counts = {name: int(getattr(row, name) or 0) for name in COUNT_COLUMNS.values()}
+    counts["total"] = sum(counts.values())
+    counts["rate"] = counts["present"] / counts["total"] * 100 if counts["total"] else 0.0
+    return counts
+
+def totals(db: Session, start: date | None = None, end: date | None = None, class_ids=None) -> dict:
+    """Marks per status, their total and the present rate (percent) for days in ``[start, end)``."""
+    return _counts(_query(db, start=start, end=end, class_ids=class_ids).one())
+
+def recent(db: Session, today: date | None = None, days: int = RECENT_DAYS, class_ids=None) -> dict:
+    """``totals`` over the last ``days`` days, the window every dashboard rate uses."""
+    return totals(db, (today or date.today()) - timedelta(days=days), class_ids=class_ids)
+
+def by_class(db: Session, start: date | None = None, end: date | None = None, class_ids=None) -> list[dict]:
+    rows = _query(db, AttendanceDailyClass.class_id, Class.name, start=start, end=end, class_ids=class_ids).outerjoin(
+        Class, Class.id == AttendanceDailyClass.class_id
+    ).group_by(AttendanceDailyClass.class_id, Class.name).order_by(Class.name).all()
+    return [{"class_id": row.class_id, "class": row.name, **_counts(row)} for row in rows]
+
+def by_day(db: Session, start: date | None = None, end: date | None = None, class_ids=None) -> list[dict]:
+    rows = _query(db, AttendanceDailyClass.date, start=start, end=end, class_ids=class_ids).group_by(
+        AttendanceDailyClass.date
+    ).order_by(AttendanceDailyClass.date).all()
+    return [{"date": row.date.isoformat(), **_counts(row)} for row in rows]
+
+def low_attendance_settings(db: Session) -> tuple[float, int]:
+    """(low_attendance_threshold, low_attendance_window_days) from the school settings, or the column defaults."""
+    school = db.query(SchoolSettings.low_attendance_threshold, SchoolSettings.low_attendance_window_days).first()
+    threshold = school.low_attendance_threshold if school and school.low_attendance_threshold is not None else \
+        SchoolSettings.low_attendance_threshold.default.arg
+    window = school.low_attendance_window_days if school and school.low_attendance_window_days is not None else \
+        SchoolSettings.low_attendance_window_days.default.arg
+    return threshold, window
+
+def low_attendance(db: Session, class_ids, threshold: float, window_days: int, today: date | None = None) -> list[dict]:
+    """Students of ``class_ids`` present on less than ``threshold`` percent of their marked days in the window, lowest first."""
+    total = func.count(Attendance.id)
+    present = func.sum(case((Attendance.status == AttendanceStatus.PRESENT, 1), else_=0))
+    rows = db.query(Student.id, Student.first_name, Student.last_name, Class.name, total.label("total"),
+                    present.label("present")).join(Attendance, Attendance.student_id == Student.id).outerjoin(
+        Class, Class.id == Student.class_id
+    ).filter(
+        Student.class_id.in_(list(class_ids)),
+        *dates.between(Attendance.date, (today or date.today()) - timedelta(days=window_days))
+    ).group_by(Student.id, Student.first_name, Student.last_name, Class.name).having(
+        present * 100.0 < total * threshold
+    ).order_by((present * 1.0 / total).asc(), Student.id).all()
+    return [{
+        "student_id": row.id,
+        "name": f"{row.first_name} {row.last_name}",
+        "class": row.name,
+        "present": int(row.present),
+        "total": row.total,
+        "rate": round(row.present / row.total * 100, 1),
+    } for row in rows]
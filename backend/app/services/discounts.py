@@ -0,0 +1,218 @@
+"""Rule-based fee discounts (sibling, scholarship, staff child).
+
+Active ``Discount`` rows are compiled once into predicates over per-student
+facts (family size, staff guardian, class), each fact loaded for every
+student with one grouped query. A term's invoices are then evaluated in a
+single pass: each invoice gets the largest matching discount, taken off in
+the database with one executemany (``amount = amount - x``, the status
+settled against the stored ``amount_paid``) and recorded in
+``discount_applications``, whose unique ``invoice_id`` makes rerunning a
+term a no-op.
+
+``Discount.conditions`` keys, all optional and combined with AND:
+
+* ``min_siblings``  - enrolled children sharing a guardian, the student included
+* ``staff_child``   - true when a guardian's user account is a staff account
+* ``student_ids``   - named students (scholarships)
+* ``class_ids`` / ``grade_levels`` - restrict to classes
+* ``categories``    - payment categories discounted (default ``["tuition"]``)
+* ``max_amount``    - cap per invoice
+"""
+from collections import defaultdict
+from sqlalchemy import bindparam, case, func, insert, literal, update
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from ..models.audit_log import AuditLog
+from ..models.class_model import Class
+from ..models.fee import Invoice, InvoiceStatus, LedgerEntryType, PaymentCategory
+from ..models.guardian import Guardian, student_guardians
+from ..models.school_settings import Discount, DiscountApplication
+from ..models.student import EnrollmentStatus, Student
+from ..models.user import User, UserRole
+from . import finance_summary, ledger
+
+CONDITION_KEYS = {"min_siblings", "staff_child", "student_ids", "class_ids", "grade_levels", "categories", "max_amount"}
+
+STAFF_ROLES = (UserRole.HEAD_TEACHER, UserRole.TEACHER, UserRole.ACCOUNTANT)
+
+class Rule:
+    """A ``Discount`` compiled into predicates; raises ``ValueError`` for conditions it cannot evaluate."""
+
+    def __init__(self, discount: Discount):
+        conditions = discount.conditions or {}
+        if not isinstance(conditions, dict):
+            raise ValueError("Discount conditions must be an object")
+        unknown = set(conditions) - CONDITION_KEYS
+        if unknown:
+            raise ValueError(f"Unknown discount conditions: {', '.join(sorted(unknown))}")
+        if not 0 < (discount.percentage or 0) <= 100:
+            raise ValueError("Discount percentage must be between 0 and 100")
+
+        self.discount = discount
+        self.percentage = discount.percentage
+        try:
+            self.categories = {PaymentCategory(c) for c in conditions.get("categories", [PaymentCategory.TUITION.value])}
+            self.max_amount = float(conditions["max_amount"]) if conditions.get("max_amount") is not None else None
+            self.min_siblings = int(conditions["min_siblings"]) if conditions.get("min_siblings") is not None else None
+            student_ids = {int(i) for i in conditions.get("student_ids", [])}
+            class_ids = {int(i) for i in conditions.get("class_ids", [])}
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid discount conditions: {e}")
+        grade_levels = set(conditions.get("grade_levels", []))
+        self.staff_child = bool(conditions.get("staff_child"))
+
+        self.checks = []
+        if self.min_siblings:
+            self.checks.append(lambda row, facts: facts["family_size"].get(row.student_id, 1) >= self.min_siblings)
+        if self.staff_child:
+            self.checks.append(lambda row, facts: row.student_id in facts["staff_children"])
+        if student_ids:
+            self.checks.append(lambda row, facts: row.student_id in student_ids)
+        if class_ids:
+            self.checks.append(lambda row, facts: row.class_id in class_ids)
+        if grade_levels:
+            self.checks.append(lambda row, facts: row.grade_level in grade_levels)
+
+    def amount(self, row, facts) -> float:
+        """Discount on the invoice in ``row``, 0.0 when the rule does not apply."""
+        if row.category not in self.categories or not all(check(row, facts) for check in self.checks):
+            return 0.0
+        value = round(row.amount * self.percentage / 100.0, 2)
+        if self.max_amount is not None:
+            value = min(value, self.max_amount)
+        return min(value, row.amount)
+
+class _InvoiceRow:
+    """What a rule sees of an invoice."""
+    __slots__ = ("student_id", "category", "amount", "class_id", "grade_level")
+
+    def __init__(self, invoice: Invoice, class_id, grade_level):
+        self.student_id = invoice.student_id
+        self.category = PaymentCategory(invoice.category)
+        self.amount = invoice.amount
+        self.class_id = class_id
+        self.grade_level = grade_level
+
+def compile_rules(db: Session) -> list[Rule]:
+    return [Rule(discount) for discount in db.query(Discount).filter(Discount.is_active == True).order_by(Discount.id)]
+
+def family_sizes(db: Session) -> dict:
+    """{student_id: enrolled children sharing any of their guardians, themselves included}."""
+    sibling = aliased(student_guardians)
+    rows = db.query(
+        student_guardians.c.student_id, func.count(func.distinct(sibling.c.student_id))
+    ).join(
+        sibling, sibling.c.guardian_id == student_guardians.c.guardian_id
+    ).join(
+        Student, Student.id == sibling.c.student_id
+    ).filter(Student.enrollment_status == EnrollmentStatus.ACTIVE).group_by(student_guardians.c.student_id).all()
+    return dict(rows)
+
+def staff_children(db: Session) -> set:
+    rows = db.query(student_guardians.c.student_id).join(
+        Guardian, Guardian.id == student_guardians.c.guardian_id
+    ).join(User, User.id == Guardian.user_id).filter(User.role.in_(STAFF_ROLES)).distinct()
+    return {student_id for student_id, in rows}
+
+def _facts(db: Session, rules: list[Rule]) -> dict:
+    """Only the facts some rule needs are loaded."""
+    return {
+        "family_size": family_sizes(db) if any(rule.min_siblings for rule in rules) else {},
+        "staff_children": staff_children(db) if any(rule.staff_child for rule in rules) else set(),
+    }
+
+_invoices = Invoice.__table__
+
+def _discount():
+    """UPDATE taking ``:b_discount`` off invoice ``:b_id``, marking it paid if that settles it.
+
+    Like ``payments._credit`` it works from the stored values, so a payment
+    posted since the invoices were read is kept, and an invoice paid or
+    cancelled in the meantime makes the update miss.
+    """
+    new_amount = _invoices.c.amount - bindparam("b_discount")
+    return update(_invoices).where(
+        _invoices.c.id == bindparam("b_id"),
+        _invoices.c.status != InvoiceStatus.CANCELLED,
+        _invoices.c.status != InvoiceStatus.PAID  # not IN: executemany cannot expand a list
+    ).values(
+        amount=new_amount,
+        status=case(
+            (func.coalesce(_invoices.c.amount_paid, 0) >= new_amount - 0.005, literal(InvoiceStatus.PAID, _invoices.c.status.type)),
+            else_=_invoices.c.status
+        )
+    )
+
+def apply_term(db: Session, term: str, user_id: int | None = None, dry_run: bool = False) -> dict:
+    """Discount every open invoice of ``term`` that a rule matches and has not been discounted yet.
+
+    With ``dry_run`` nothing is written and the result previews what would be applied.
+    """
+    rules = compile_rules(db)
+    planned = []
+    if rules:
+        facts = _facts(db, rules)
+        categories = set().union(*(rule.categories for rule in rules))
+        already = db.query(DiscountApplication.id).filter(DiscountApplication.invoice_id == Invoice.id).exists()
+        query = db.query(Invoice, Student.class_id, Class.grade_level).join(
+            Student, Student.id == Invoice.student_id
+        ).outerjoin(Class, Class.id == Student.class_id).filter(
+            Invoice.term == term,
+            Invoice.category.in_(categories),
+            Invoice.status.notin_([InvoiceStatus.CANCELLED, InvoiceStatus.PAID]),
+            Invoice.late_fee_for_id.is_(None),
+            ~already
+        ).order_by(Invoice.id)
+        if not dry_run:  # locked so the amounts rolled up below are the ones being discounted
+            query = query.with_for_update(of=Invoice).populate_existing()
+        for invoice, class_id, grade_level in query.all():
+            row = _InvoiceRow(invoice, class_id, grade_level)
+            best = max(((rule.amount(row, facts), rule) for rule in rules), key=lambda pair: pair[0])
+            if best[0] > 0:
+                planned.append((invoice, *best))
+
+    by_discount = defaultdict(lambda: {"count": 0, "total": 0.0})
+    for _, amount, rule in planned:
+        summary = by_discount[rule.discount.id]
+        summary.update(discount_id=rule.discount.id, name=rule.discount.name, percentage=rule.percentage)
+        summary["count"] += 1
+        summary["total"] += amount
+    result = {
+        "term": term,
+        "dry_run": dry_run,
+        "invoices": len(planned),
+        "total": round(sum(amount for _, amount, _ in planned), 2),
+        "by_discount": list(by_discount.values()),
+    }
+    if dry_run or not planned:
+        return result
+
+    finance_summary.ensure_summary(db)  # the update below reaches the table before it is rolled up
+    changes, updates, applications, entries = [], [], [], []
+    for invoice, amount, rule in planned:
+        before = finance_summary.invoice_snapshot(invoice)
+        new_amount = round(invoice.amount - amount, 2)
+        status = InvoiceStatus.PAID if (invoice.amount_paid or 0.0) >= new_amount - 0.005 else invoice.status
+        set_committed_value(invoice, "amount", new_amount)
+        set_committed_value(invoice, "status", status)
+        changes.append((before, invoice))
+        updates.append({"b_id": invoice.id, "b_discount": amount})
+        applications.append({
+            "discount_id": rule.discount.id, "invoice_id": invoice.id, "student_id": invoice.student_id,
+            "term": term, "percentage": rule.percentage, "amount": amount, "applied_by": user_id
+        })
+        entries.append({
+            "student_id": invoice.student_id, "entry_type": LedgerEntryType.DISCOUNT, "invoice_id": invoice.id,
+            "reference": invoice.invoice_number, "description": rule.discount.name, "credit": amount
+        })
+    discounted = db.execute(_discount(), updates).rowcount
+    if db.get_bind().dialect.supports_sane_multi_rowcount and discounted != len(updates):
+        db.rollback()
+        raise ValueError("Invoices were paid or cancelled while discounts were applied; run the term again")
+    db.execute(insert(DiscountApplication.__table__), applications)
+    finance_summary.record_invoice_changes(db, changes)
+    ledger.post_entries(db, entries, user_id)
+    db.add(AuditLog(user_id=user_id, action="apply_discounts", entity_type="term",
+                    changes={k: v for k, v in result.items() if k != "dry_run"}))
+    db.commit()
+    return result
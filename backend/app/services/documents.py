@@ -0,0 +1,397 @@
+"""Printable invoice and receipt PDFs.
+
+Documents are built in two steps. The database is read once into plain
+dicts (``invoice_documents`` / ``receipt_document``), and those dicts are
+drawn with the reportlab canvas in a process pool, so rendering never
+holds the event loop or the database session.
+
+The page layout is fixed: fonts, column positions and the letterhead are
+prepared once per worker process, and the letterhead is drawn into a
+reusable form XObject, so a 600-page class pack stores it once and each
+page only draws its own fields.
+
+Output is cached on disk under ``UPLOAD_DIR/documents`` by a SHA-256 of the
+document data and ``LAYOUT_VERSION``. Printing the same invoice again is a
+file lookup; any change to the invoice (a payment, a discount) changes the
+data and so the file name. Bump ``LAYOUT_VERSION`` whenever the drawing code
+changes. A cache hit touches the file, so its modification time is its last
+use; ``prune`` (run by the daily job) removes files unused for
+``DOCUMENT_CACHE_DAYS`` and then the least recently used ones until the
+cache fits in ``DOCUMENT_CACHE_MB``. Superseded versions of an invoice are
+never used again, so they age out.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..core.config import settings
+from ..models.class_model import Class
+from ..models.fee import Invoice, InvoiceStatus, Payment
+from ..models.school_settings import SchoolSettings
+from ..models.student import Student
+
+LAYOUT_VERSION = 1
+
+KINDS = ("invoice", "receipt")
+
+MAX_LISTED_PAYMENTS = 12
+
+_executor = None
+_layout = None
+
+# DOCUMENT DATA
+def _school(db: Session) -> dict:
+    school = db.query(SchoolSettings).order_by(SchoolSettings.id).first()
+    return {
+        "name": (school and school.school_name) or settings.SCHOOL_NAME,
+        "motto": (school and school.school_motto) or "",
+        "address": (school and school.address) or settings.SCHOOL_ADDRESS,
+        "phone": (school and school.phone) or settings.SCHOOL_PHONE,
+        "email": (school and school.email) or settings.SCHOOL_EMAIL,
+        "currency": (school and school.currency) or settings.CURRENCY,
+    }
+
+OPEN_STATUSES = (InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE)
+
+def _day(value) -> str | None:
+    return value.strftime("%Y-%m-%d") if value else None
+
+def invoice_documents(db: Session, invoice_ids: list[int] | None = None, class_id: int | None = None,
+                      term: str | None = None) -> list[dict]:
+    """Printable data for the given invoices, or for every open (unpaid, uncancelled) invoice of a class and/or term."""
+    query = db.query(
+        Invoice, Student.admission_number, Student.first_name, Student.last_name, Class.name
+    ).join(Student, Student.id == Invoice.student_id).outerjoin(Class, Class.id == Student.class_id)
+    if invoice_ids is not None:
+        query = query.filter(Invoice.id.in_(invoice_ids))
+    else:
+        query = query.filter(Invoice.status.in_(OPEN_STATUSES))
+        if class_id:
+            query = query.filter(Student.class_id == class_id)
+        if term:
+            query = query.filter(Invoice.term == term)
+    rows = query.order_by(Class.name, Student.last_name, Student.first_name, Invoice.id).all()
+    if not rows:
+        return []
+
+    payments = {}
+    for p in db.query(Payment).filter(Payment.invoice_id.in_(query.with_entities(Invoice.id))).order_by(
+        Payment.payment_date, Payment.id
+    ):
+        payments.setdefault(p.invoice_id, []).append({
+            "receipt_number": p.receipt_number, "date": _day(p.payment_date),
+            "method": p.payment_method, "amount": p.amount
+        })
+
+    school = _school(db)
+    return [{
+        "school": school,
+        "number": invoice.invoice_number,
+        "student": {"name": f"{first_name} {last_name}", "admission_number": admission_number, "class": class_name},
+        "category": invoice.category.value,
+        "term": invoice.term,
+        "description": invoice.description,
+        "status": invoice.status.value,
+        "issued": _day(invoice.created_at),
+        "due_date": _day(invoice.due_date),
+        "amount": invoice.amount,
+        "amount_paid": invoice.amount_paid or 0.0,
+        "payments": payments.get(invoice.id, []),
+    } for invoice, admission_number, first_name, last_name, class_name in rows]
+
+def receipt_document(db: Session, payment_id: int) -> dict | None:
+    """Printable data for one payment; the balance shown is the one this payment left behind."""
+    row = db.query(
+        Payment, Invoice, Student.admission_number, Student.first_name, Student.last_name, Class.name
+    ).join(Invoice, Invoice.id == Payment.invoice_id).join(
+        Student, Student.id == Invoice.student_id
+    ).outerjoin(Class, Class.id == Student.class_id).filter(Payment.id == payment_id).first()
+    if not row:
+        return None
+    payment, invoice, admission_number, first_name, last_name, class_name = row
+    paid_to_date = db.query(func.coalesce(func.sum(Payment.amount), 0.0)).filter(
+        Payment.invoice_id == invoice.id, Payment.id <= payment.id
+    ).scalar()
+    return {
+        "school": _school(db),
+        "number": payment.receipt_number,
+        "student": {"name": f"{first_name} {last_name}", "admission_number": admission_number, "class": class_name},
+        "date": _day(payment.payment_date),
+        "method": payment.payment_method,
+        "amount": payment.amount,
+        "invoice": {
+            "number": invoice.invoice_number, "category": invoice.category.value, "term": invoice.term,
+            "amount": invoice.amount, "paid_to_date": paid_to_date,
+        },
+    }
+
+# CACHE
+def document_dir() -> str:
+    return os.path.join(settings.UPLOAD_DIR, "documents")
+
+def document_key(kind: str, docs: list[dict]) -> str:
+    payload = json.dumps({"layout": LAYOUT_VERSION, "kind": kind, "docs": docs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def document_path(kind: str, docs: list[dict], extension: str = "pdf") -> str:
+    key = document_key(kind, docs)
+    return os.path.join(document_dir(), key[:2], f"{key}.{extension}")
+
+def _cached(path: str) -> bool:
+    """Whether ``path`` is cached, marking it as just used if so."""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+def prune(max_age_days: int | None = None, max_mb: int | None = None, now: float | None = None) -> tuple[int, int]:
+    """Remove cached files unused for ``max_age_days``, then the oldest until ``max_mb`` is met; (files, bytes) removed."""
+    max_age = (max_age_days if max_age_days is not None else settings.DOCUMENT_CACHE_DAYS) * 86400
+    max_bytes = (max_mb if max_mb is not None else settings.DOCUMENT_CACHE_MB) * 1024 * 1024
+    now = now or time.time()
+    files = []
+    for directory, _, names in os.walk(document_dir()):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path, name.endswith(".part")))
+    files.sort()
+
+    kept = sum(size for _, size, _, _ in files)
+    removed = removed_bytes = 0
+    for mtime, size, path, partial in files:
+        stale = now - mtime > (3600 if partial else max_age)  # a .part file that old was abandoned by a crash
+        if not stale and (partial or kept <= max_bytes):
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        kept -= size
+        removed += 1
+        removed_bytes += size
+    return removed, removed_bytes
+
+# RENDERING (runs in the worker processes)
+def _money(currency: str, value) -> str:
+    value = float(value or 0)
+    return f"{currency} {value:,.0f}" if value == int(value) else f"{currency} {value:,.2f}"
+
+def _label(value) -> str:
+    return (value or "").replace("_", " ").title()
+
+def _build_layout() -> dict:
+    """Page geometry, shared by every page a worker draws."""
+    global _layout
+    if _layout is None:
+        from reportlab.lib.pagesizes import A4
+        width, height = A4
+        margin = 50
+        _layout = {
+            "size": A4, "width": width, "height": height, "margin": margin,
+            "right": width - margin, "top": height - margin,
+            "body_top": height - margin - 110,
+            "grey": (0.93, 0.93, 0.93), "rule": (0.6, 0.6, 0.6),
+        }
+    return _layout
+
+def _letterhead(c, layout: dict, school: dict, title: str) -> None:
+    """Draw the header once into a form XObject every page of the file reuses."""
+    c.beginForm("letterhead")
+    top, margin, right = layout["top"], layout["margin"], layout["right"]
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(margin, top - 10, school["name"])
+    c.setFont("Helvetica-Oblique", 9)
+    c.drawString(margin, top - 24, school["motto"])
+    c.setFont("Helvetica", 9)
+    c.drawString(margin, top - 38, " | ".join(v for v in (school["address"], school["phone"], school["email"]) if v))
+    c.setFont("Helvetica-Bold", 20)
+    c.drawRightString(right, top - 12, title)
+    c.setStrokeColorRGB(*layout["rule"])
+    c.line(margin, top - 50, right, top - 50)
+    c.setFont("Helvetica", 8)
+    c.drawString(margin, margin - 20, f"{school['name']} - {school['phone']} - {school['email']}")
+    c.endForm()
+
+def _fields(c, x: float, y: float, pairs: list, width: float = 80) -> float:
+    for label, value in pairs:
+        c.setFont("Helvetica", 9)
+        c.drawString(x, y, label)
+        c.setFont("Helvetica-Bold", 9)
+        c.drawString(x + width, y, str(value) if value is not None else "-")
+        y -= 14
+    return y
+
+def _draw_invoice(c, layout: dict, doc: dict) -> None:
+    currency, margin, right = doc["school"]["currency"], layout["margin"], layout["right"]
+    student = doc["student"]
+    y = layout["body_top"]
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(margin, y + 20, "Bill to")
+    _fields(c, margin, y, [("Student", student["name"]), ("Admission No", student["admission_number"]),
+                           ("Class", student["class"])])
+    _fields(c, right - 200, y, [("Invoice No", doc["number"]), ("Issued", doc["issued"]), ("Due date", doc["due_date"]),
+                                ("Term", _label(doc["term"]) or None), ("Status", _label(doc["status"]))])
+
+    y -= 90
+    c.setFillColorRGB(*layout["grey"])
+    c.rect(margin, y - 4, right - margin, 18, stroke=0, fill=1)
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(margin + 6, y + 1, "Description")
+    c.drawString(margin + 300, y + 1, "Category")
+    c.drawRightString(right - 6, y + 1, "Amount")
+    y -= 20
+    c.setFont("Helvetica", 9)
+    c.drawString(margin + 6, y, doc["description"] or f"{_label(doc['category'])} fees")
+    c.drawString(margin + 300, y, _label(doc["category"]))
+    c.drawRightString(right - 6, y, _money(currency, doc["amount"]))
+
+    y -= 30
+    balance = doc["amount"] - doc["amount_paid"]
+    for label, value, font in (("Total", doc["amount"], "Helvetica"), ("Paid", doc["amount_paid"], "Helvetica"),
+                               ("Balance due", balance, "Helvetica-Bold")):
+        c.setFont(font, 10)
+        c.drawString(right - 200, y, label)
+        c.drawRightString(right - 6, y, _money(currency, value))
+        y -= 16
+
+    if doc["payments"]:
+        y -= 20
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(margin, y, "Payments received")
+        y -= 16
+        c.setFont("Helvetica", 9)
+        for p in doc["payments"][:MAX_LISTED_PAYMENTS]:
+            c.drawString(margin + 6, y, p["date"] or "")
+            c.drawString(margin + 90, y, p["receipt_number"])
+            c.drawString(margin + 250, y, _label(p["method"]))
+            c.drawRightString(right - 6, y, _money(currency, p["amount"]))
+            y -= 13
+        if len(doc["payments"]) > MAX_LISTED_PAYMENTS:
+            c.drawString(margin + 6, y, f"... and {len(doc['payments']) - MAX_LISTED_PAYMENTS} more")
+
+    c.setFont("Helvetica-Oblique", 8)
+    c.drawString(margin, margin, "Please quote the invoice number with every payment.")
+
+def _draw_receipt(c, layout: dict, doc: dict) -> None:
+    currency, margin, right = doc["school"]["currency"], layout["margin"], layout["right"]
+    student, invoice = doc["student"], doc["invoice"]
+    y = layout["body_top"]
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(margin, y + 20, "Received from")
+    _fields(c, margin, y, [("Student", student["name"]), ("Admission No", student["admission_number"]),
+                           ("Class", student["class"])])
+    _fields(c, right - 200, y, [("Receipt No", doc["number"]), ("Date", doc["date"]), ("Method", _label(doc["method"])),
+                                ("Invoice No", invoice["number"]), ("Term", _label(invoice["term"]) or None)])
+
+    y -= 100
+    c.setFillColorRGB(*layout["grey"])
+    c.rect(margin, y - 10, right - margin, 30, stroke=0, fill=1)
+    c.setFillColorRGB(0, 0, 0)
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(margin + 6, y, f"Amount received for {_label(invoice['category'])} fees")
+    c.drawRightString(right - 6, y, _money(currency, doc["amount"]))
+
+    y -= 40
+    balance = invoice["amount"] - invoice["paid_to_date"]
+    for label, value, font in (("Invoice total", invoice["amount"], "Helvetica"),
+                               ("Paid to date", invoice["paid_to_date"], "Helvetica"),
+                               ("Balance remaining", balance, "Helvetica-Bold")):
+        c.setFont(font, 10)
+        c.drawString(right - 200, y, label)
+        c.drawRightString(right - 6, y, _money(currency, value))
+        y -= 16
+
+    c.setFont("Helvetica-Oblique", 8)
+    c.drawString(margin, margin, "Thank you. Please keep this receipt as proof of payment.")
+
+_DRAW = {"invoice": (_draw_invoice, "INVOICE"), "receipt": (_draw_receipt, "RECEIPT")}
+
+def render_file(kind: str, docs: list[dict], path: str) -> str:
+    """Draw ``docs`` as consecutive pages of one PDF at ``path``."""
+    from reportlab.pdfgen import canvas
+    layout = _build_layout()
+    draw, title = _DRAW[kind]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.part"
+    c = canvas.Canvas(partial, pagesize=layout["size"], pageCompression=1)
+    c.setTitle(f"{title.title()} {docs[0]['number']}" if len(docs) == 1 else f"{title.title()}s")
+    c.setAuthor(docs[0]["school"]["name"])
+    _letterhead(c, layout, docs[0]["school"], title)
+    for doc in docs:
+        c.doForm("letterhead")
+        draw(c, layout, doc)
+        c.showPage()
+    c.save()
+    os.replace(partial, path)  # readers never see a half-written file
+    return path
+
+def render_files(kind: str, jobs: list[tuple[dict, str]]) -> list[str]:
+    """Render one single-page file per ``(doc, path)``, skipping files already cached."""
+    return [path if _cached(path) else render_file(kind, [doc], path) for doc, path in jobs]
+
+# POOL
+def _workers() -> int:
+    return settings.PDF_WORKERS or os.cpu_count() or 1
+
+def executor() -> ProcessPoolExecutor:
+    """The shared render pool, started on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=_workers(),
+            initializer=_build_layout
+        )
+    return _executor
+
+def shutdown() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+async def render(kind: str, docs: list[dict]) -> str:
+    """Path of one PDF holding ``docs`` in order, rendered in the pool unless already cached."""
+    if kind not in KINDS or not docs:
+        raise ValueError("Nothing to render")
+    path = document_path(kind, docs)
+    if _cached(path):
+        return path
+    return await asyncio.get_running_loop().run_in_executor(executor(), render_file, kind, docs, path)
+
+async def render_zip(kind: str, docs: list[dict], names: list[str]) -> str:
+    """Path of a zip with one PDF per doc; the pages are rendered in parallel chunks across the pool."""
+    if kind not in KINDS or not docs:
+        raise ValueError("Nothing to render")
+    path = document_path(kind, docs, "zip")
+    if _cached(path):
+        return path
+    jobs = [(doc, document_path(kind, [doc])) for doc in docs]
+    pending = [job for job in jobs if not _cached(job[1])]
+    if pending:
+        pool = executor()
+        chunk = max(25, -(-len(pending) // _workers()))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(pool, render_files, kind, pending[i:i + chunk]) for i in range(0, len(pending), chunk)
+        ))
+    return await asyncio.to_thread(_write_zip, path, [(f"{name}.pdf", file) for name, (_, file) in zip(names, jobs)])
+
+def _write_zip(path: str, members: list[tuple[str, str]]) -> str:
+    partial = f"{path}.{os.getpid()}.part"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with zipfile.ZipFile(partial, "w", zipfile.ZIP_STORED) as archive:  # PDF pages are already compressed
+        for name, file in members:
+            archive.write(file, name)
+    os.replace(partial, path)
+    return path
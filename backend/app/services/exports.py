@@ -0,0 +1,48 @@
+"""Streaming tabular exports (CSV and XLSX) for report endpoints.
+
+Both writers consume a row iterator lazily, so callers can feed them
+straight from a ``yield_per`` query and memory stays flat however many
+rows there are.
+"""
+import csv
+import io
+import tempfile
+
+def stream_csv(header: list, rows, batch_size: int = 500):
+    """Yield CSV text, starting with the header before the first row is fetched."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate(0)
+
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def stream_xlsx(title: str, header: list, rows, chunk_size: int = 64 * 1024):
+    """Yield an XLSX workbook built with openpyxl's write-only mode.
+
+    Write-only worksheets spool rows to disk as they are appended, but the
+    workbook is a zip archive that can only be emitted once it is complete,
+    so bytes start flowing after the last row has been written.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=title)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as spool:
+        workbook.save(spool)
+        spool.seek(0)
+        while chunk := spool.read(chunk_size):
+            yield chunk
@@ -0,0 +1,231 @@
+"""Incrementally maintained finance rollups for the accountant dashboard.
+
+Write paths that touch invoices or payments call into this module inside
+their own transaction, so the rollup is committed (or rolled back) together
+with the change it describes. The table is seeded at startup, and reads
+never write to it. ``rebuild_finance_summary`` recomputes every row from
+the base tables and is used for drift repair; it upserts by scope, so
+rebuilds running at once (or a write seeding the table while another
+rebuilds it) overwrite each other's rows instead of colliding on them.
+"""
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import delete, func, update, or_
+from sqlalchemy.orm import Session
+from ..core import dates
+from ..core.database import SessionLocal, dialect_insert
+from ..models.fee import FinanceSummary, Invoice, Payment, InvoiceStatus
+
+OVERALL_SCOPE = "all"
+
+VALUE_COLUMNS = ("total_invoiced", "total_collected", "total_outstanding", "invoice_count", "pending_count",
+                 "partial_count", "paid_count", "overdue_count", "cancelled_count", "payment_count")
+
+STATUS_COUNT_COLUMNS = {
+    InvoiceStatus.PENDING: "pending_count",
+    InvoiceStatus.PARTIAL: "partial_count",
+    InvoiceStatus.PAID: "paid_count",
+    InvoiceStatus.OVERDUE: "overdue_count",
+    InvoiceStatus.CANCELLED: "cancelled_count",
+}
+
+def month_scope(value) -> str:
+    return f"month:{str(value)[:7]}"
+
+def method_scope(method: str) -> str:
+    return f"method:{method}"
+
+def _status(value) -> InvoiceStatus:
+    return InvoiceStatus(value) if value is not None else InvoiceStatus.PENDING
+
+def invoice_snapshot(invoice: Invoice | None):
+    """Capture the fields of an invoice that feed the rollup."""
+    if invoice is None:
+        return None
+    return (invoice.amount or 0.0, invoice.amount_paid or 0.0, _status(invoice.status))
+
+def _invoice_contribution(snapshot) -> dict:
+    amount, amount_paid, status = snapshot
+    return {
+        "total_invoiced": amount,
+        "total_outstanding": 0.0 if status == InvoiceStatus.PAID else amount - amount_paid,
+        "invoice_count": 1,
+        STATUS_COUNT_COLUMNS[status]: 1,
+    }
+
+def _apply(db: Session, changes: dict) -> None:
+    """Add ``changes`` ({scope: {column: delta}}) to the summary rows.
+
+    Increments are issued as ``col = col + delta`` so concurrent writers do
+    not lose updates; new month and method scopes start from a zero row.
+    Call this before the change it describes is flushed: on databases that
+    predate the table (no ``all`` row) the rollup is first rebuilt from the
+    base tables as they stood, and the change is then applied on top.
+    """
+    changes = {scope: {k: v for k, v in deltas.items() if v} for scope, deltas in changes.items()}
+    changes = {scope: deltas for scope, deltas in changes.items() if deltas}
+    if not changes:
+        return
+
+    existing = {
+        row.scope for row in db.query(FinanceSummary.scope).filter(FinanceSummary.scope.in_([OVERALL_SCOPE, *changes]))
+    }
+    if OVERALL_SCOPE not in existing:
+        rebuild_finance_summary(db, commit=False)
+        existing = {row.scope for row in db.query(FinanceSummary.scope).filter(FinanceSummary.scope.in_(list(changes)))}
+    missing = [scope for scope in changes if scope not in existing]
+    if missing:
+        db.execute(dialect_insert(db.get_bind(), FinanceSummary).values([{"scope": scope} for scope in missing])
+                   .on_conflict_do_nothing(index_elements=["scope"]))
+
+    for scope, deltas in changes.items():
+        db.execute(
+            update(FinanceSummary)
+            .where(FinanceSummary.scope == scope)
+            .values({getattr(FinanceSummary, column): getattr(FinanceSummary, column) + delta
+                     for column, delta in deltas.items()})
+            .execution_options(synchronize_session=False)
+        )
+
+def record_invoice_change(db: Session, before, after: Invoice | None) -> None:
+    """Apply the difference between two invoice states to the rollup.
+
+    ``before`` is an ``invoice_snapshot`` taken before the change (``None``
+    for new invoices); ``after`` is the invoice as it now stands in the
+    session (``None`` once it has been deleted).
+    """
+    record_invoice_changes(db, [(before, after)])
+
+def record_invoice_changes(db: Session, changes) -> None:
+    """Apply many ``(before, after)`` invoice changes with a single set of increments."""
+    deltas = defaultdict(int)
+    for before, after in changes:
+        if before is not None:
+            for column, value in _invoice_contribution(before).items():
+                deltas[column] -= value
+        after = invoice_snapshot(after)
+        if after is not None:
+            for column, value in _invoice_contribution(after).items():
+                deltas[column] += value
+    _apply(db, {OVERALL_SCOPE: deltas})
+
+def record_status_changes(db: Session, counts: dict) -> None:
+    """Roll up set-based status flips; ``counts`` maps ``(old_status, new_status)`` to rows moved.
+
+    Only for flips between unpaid statuses, which leave the amounts alone.
+    """
+    deltas = defaultdict(int)
+    for (old, new), count in counts.items():
+        deltas[STATUS_COUNT_COLUMNS[old]] -= count
+        deltas[STATUS_COUNT_COLUMNS[new]] += count
+    _apply(db, {OVERALL_SCOPE: deltas})
+
+def record_invoices_created(db: Session, count: int, total_amount: float) -> None:
+    """Roll up a batch of new pending invoices with a single set of increments."""
+    _apply(db, {OVERALL_SCOPE: {
+        "total_invoiced": total_amount,
+        "total_outstanding": total_amount,
+        "invoice_count": count,
+        "pending_count": count,
+    }})
+
+def record_payment(db: Session, payment: Payment) -> None:
+    record_payments(db, [payment])
+
+def record_payments(db: Session, payments) -> None:
+    """Roll up a batch of payments with one increment per affected scope."""
+    changes = defaultdict(lambda: defaultdict(int))
+    for payment in payments:
+        scopes = [OVERALL_SCOPE, method_scope(payment.payment_method)]
+        if payment.payment_date:
+            scopes.append(month_scope(payment.payment_date))
+        for scope in scopes:
+            changes[scope]["total_collected"] += payment.amount
+            changes[scope]["payment_count"] += 1
+    _apply(db, changes)
+
+def _compute_rows(db: Session) -> dict:
+    """Every summary row as ``{scope: {column: value}}``, aggregated from ``invoices`` and ``payments``."""
+    rows = defaultdict(lambda: defaultdict(int))
+    overall = rows[OVERALL_SCOPE]
+
+    by_status = db.query(
+        Invoice.status,
+        func.count(Invoice.id),
+        func.coalesce(func.sum(Invoice.amount), 0),
+        func.coalesce(func.sum(Invoice.amount - func.coalesce(Invoice.amount_paid, 0)), 0)
+    ).group_by(Invoice.status).all()
+    for status, count, invoiced, balance in by_status:
+        status = _status(status)
+        overall["invoice_count"] += count
+        overall[STATUS_COUNT_COLUMNS[status]] += count
+        overall["total_invoiced"] += invoiced
+        if status != InvoiceStatus.PAID:
+            overall["total_outstanding"] += balance
+
+    by_method = db.query(
+        Payment.payment_method, func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0)
+    ).group_by(Payment.payment_method).all()
+    for method, count, total in by_method:
+        overall["payment_count"] += count
+        overall["total_collected"] += total
+        rows[method_scope(method)].update(payment_count=count, total_collected=total)
+
+    month = dates.bucket(db.get_bind(), Payment.payment_date, "month")
+    by_month = db.query(
+        month, func.count(Payment.id), func.coalesce(func.sum(Payment.amount), 0)
+    ).filter(Payment.payment_date.isnot(None)).group_by(month).all()
+    for month_start, count, total in by_month:
+        rows[month_scope(month_start)].update(payment_count=count, total_collected=total)
+    return {scope: {column: values.get(column, 0) for column in VALUE_COLUMNS} for scope, values in rows.items()}
+
+def rebuild_finance_summary(db: Session, commit: bool = True) -> None:
+    """Recompute every summary row from ``invoices`` and ``payments``."""
+    rows = _compute_rows(db)
+    statement = dialect_insert(db.get_bind(), FinanceSummary.__table__).values([
+        {"scope": scope, **values} for scope, values in rows.items()
+    ])
+    db.execute(statement.on_conflict_do_update(index_elements=["scope"], set_={
+        **{column: statement.excluded[column] for column in VALUE_COLUMNS}, "updated_at": func.now()
+    }))
+    db.execute(delete(FinanceSummary).where(FinanceSummary.scope.notin_(list(rows))))
+    for row in [obj for obj in db.identity_map.values() if isinstance(obj, FinanceSummary)]:
+        db.expire(row)  # loaded before the rebuild
+    if commit:
+        db.commit()
+
+def ensure_summary(db: Session) -> None:
+    """Seed the rollup before a write that reaches the base tables ahead of its record_* call."""
+    if not db.query(FinanceSummary.id).filter(FinanceSummary.scope == OVERALL_SCOPE).first():
+        rebuild_finance_summary(db, commit=False)
+
+def rebuild_in_background() -> None:
+    db = SessionLocal()
+    try:
+        rebuild_finance_summary(db)
+    finally:
+        db.close()
+
+def load_finance_summary(db: Session, today: date | None = None) -> dict:
+    """Read the overall, current-month and per-method rows in one query.
+
+    Never writes: on a database whose rollup has not been seeded yet (it is
+    seeded at startup and by the first write) the rows are aggregated from
+    the base tables for this read only.
+    """
+    today = today or date.today()
+    current_month = month_scope(today)
+    rows = db.query(FinanceSummary).filter(or_(
+        FinanceSummary.scope.in_([OVERALL_SCOPE, current_month]),
+        FinanceSummary.scope.like("method:%")
+    )).all()
+    if not any(row.scope == OVERALL_SCOPE for row in rows):
+        rows = [FinanceSummary(scope=scope, **values) for scope, values in _compute_rows(db).items()
+                if scope in (OVERALL_SCOPE, current_month) or scope.startswith("method:")]
+
+    by_scope = {row.scope: row for row in rows}
+    return {
+        "overall": by_scope[OVERALL_SCOPE],
+        "month": by_scope.get(current_month),
+        "methods": [row for row in rows if row.scope.startswith("method:")],
+    }
@@ -0,0 +1,200 @@
+"""Weekly cash-flow forecast from open invoices and past payment delays.
+
+Past payments (the last ``HISTORY_DAYS``) are loaded as pandas columns and
+turned into, per class, the share of money that arrived 0, 1, 2... weeks
+after the invoice was due (``MIN_LAG_WEEKS`` allows early payers). Classes
+with fewer than ``MIN_SAMPLES`` payments use the school-wide distribution.
+Each class also gets a collection rate: the share of invoiced money that
+was eventually paid on invoices due more than ``MATURITY_DAYS`` ago.
+
+Open balances are then spread over the coming weeks as one NumPy matrix
+(invoices x delay weeks): weeks that have already passed without payment
+are dropped and the remaining shares renormalised, so a month-overdue
+invoice is projected from the tail of its class's distribution rather than
+its head. Nothing loops over invoices in Python.
+
+Results are cached in process until the day changes or the watermark
+does: the highest payment id plus the invoice count, open balance and
+latest ``updated_at``, so new term invoices, late fees, discounts and
+cancellations refresh the forecast as well as payments.
+"""
+import threading
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+from ..core import dates
+from ..models.academic_calendar import AcademicTerm
+from ..models.class_model import Class
+from ..models.fee import Invoice, InvoiceStatus, Payment
+from ..models.student import Student
+
+HISTORY_DAYS = 365
+MATURITY_DAYS = 60
+MIN_SAMPLES = 20
+MIN_LAG_WEEKS = -4
+MAX_LAG_WEEKS = 26
+DEFAULT_WEEKS = 12
+
+OPEN_STATUSES = (InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE)
+
+NO_CLASS = -1
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _frame(db: Session, statement, columns: list[str]) -> pd.DataFrame:
+    return pd.DataFrame(db.execute(statement).all(), columns=columns)
+
+def _days(values: pd.Series) -> pd.Series:
+    """Dates or datetimes as midnight timestamps, keeping the wall-clock day of timezone-aware values."""
+    values = pd.to_datetime(values)
+    if values.dt.tz is not None:
+        values = values.dt.tz_localize(None)
+    return values.dt.normalize()
+
+def _history(db: Session, today: date) -> pd.DataFrame:
+    """Payments of the last year with the delay after their invoice's due date, in whole weeks."""
+    frame = _frame(db, select(Student.class_id, Invoice.due_date, Payment.payment_date, Payment.amount).join(
+        Invoice, Invoice.id == Payment.invoice_id
+    ).join(Student, Student.id == Invoice.student_id).where(
+        *dates.between(Payment.payment_date, today - timedelta(days=HISTORY_DAYS)), Invoice.due_date.isnot(None)
+    ), ["class_id", "due_date", "payment_date", "amount"])
+    frame["class_id"] = frame["class_id"].fillna(NO_CLASS).astype(int)
+    frame["delay_days"] = (_days(frame["payment_date"]) - _days(frame["due_date"])).dt.days
+    frame["lag"] = (frame["delay_days"] // 7).clip(MIN_LAG_WEEKS, MAX_LAG_WEEKS) - MIN_LAG_WEEKS
+    return frame
+
+def _distributions(history: pd.DataFrame, class_ids: np.ndarray) -> np.ndarray:
+    """Row per class in ``class_ids``: share of payments landing in each delay week."""
+    bins = MAX_LAG_WEEKS - MIN_LAG_WEEKS + 1
+    if history.empty:
+        on_time = np.zeros(bins)
+        on_time[-MIN_LAG_WEEKS] = 1.0  # no history: assume everything is paid the week it is due
+        return np.tile(on_time, (len(class_ids), 1))
+    weights = history.pivot_table(index="class_id", columns="lag", values="amount", aggfunc="sum", fill_value=0.0)
+    weights = weights.reindex(columns=range(bins), fill_value=0.0)
+    overall = weights.sum(axis=0).to_numpy()
+    overall = overall / overall.sum()
+    samples = history.groupby("class_id").size()
+    enough = samples[samples >= MIN_SAMPLES].index
+    own = weights.loc[weights.index.intersection(enough)]
+    own = own.div(own.sum(axis=1), axis=0)
+    return own.reindex(class_ids).fillna(pd.Series(overall, index=own.columns)).to_numpy()
+
+def _collection_rates(db: Session, today: date, class_ids: np.ndarray) -> np.ndarray:
+    matured = _frame(db, select(Student.class_id, Invoice.amount, Invoice.amount_paid).join(
+        Student, Student.id == Invoice.student_id
+    ).where(
+        *dates.between(Invoice.due_date, today - timedelta(days=HISTORY_DAYS), today - timedelta(days=MATURITY_DAYS)),
+        Invoice.status != InvoiceStatus.CANCELLED
+    ), ["class_id", "amount", "amount_paid"])
+    if matured.empty or matured["amount"].sum() <= 0:
+        return np.ones(len(class_ids))
+    matured["class_id"] = matured["class_id"].fillna(NO_CLASS).astype(int)
+    matured["collected"] = np.minimum(matured["amount_paid"].fillna(0.0), matured["amount"])
+    totals = matured.groupby("class_id")[["collected", "amount"]].sum()
+    overall = totals["collected"].sum() / totals["amount"].sum()
+    rates = (totals["collected"] / totals["amount"].where(totals["amount"] > 0)).reindex(class_ids)
+    return rates.fillna(overall).clip(0.0, 1.0).to_numpy()
+
+def _horizon(db: Session, today: date, weeks: int | None) -> tuple[date, str | None]:
+    if weeks:
+        return today + timedelta(weeks=weeks), None
+    term = db.query(AcademicTerm).filter(AcademicTerm.is_active == True, AcademicTerm.end_date >= today).order_by(
+        AcademicTerm.end_date
+    ).first()
+    if term:
+        return term.end_date, term.name
+    return today + timedelta(weeks=DEFAULT_WEEKS), None
+
+def project(db: Session, today: date | None = None, weeks: int | None = None) -> dict:
+    """Expected collections per week from this week to the end of the active term (or ``weeks`` ahead)."""
+    today = today or date.today()
+    horizon_end, term = _horizon(db, today, weeks)
+    week0 = dates.bucket_start(today, "week")
+    week_starts = dates.buckets(today, horizon_end + timedelta(days=1), "week")
+    n_weeks = len(week_starts)
+
+    invoices = _frame(db, select(
+        Student.class_id, Invoice.due_date, Invoice.amount - func.coalesce(Invoice.amount_paid, 0)
+    ).join(Student, Student.id == Invoice.student_id).where(
+        Invoice.status.in_(OPEN_STATUSES), Invoice.amount - func.coalesce(Invoice.amount_paid, 0) > 0
+    ), ["class_id", "due_date", "balance"])
+    invoices["class_id"] = invoices["class_id"].fillna(NO_CLASS).astype(int)
+    history = _history(db, today)
+
+    class_ids = np.union1d(invoices["class_id"].to_numpy(), [NO_CLASS])
+    distributions = _distributions(history, class_ids)
+    rates = _collection_rates(db, today, class_ids)
+    class_index = np.searchsorted(class_ids, invoices["class_id"].to_numpy())
+
+    # invoices x delay-week matrices
+    due = _days(invoices["due_date"]).fillna(pd.Timestamp(today))
+    due_week = ((due - pd.Timestamp(week0)).dt.days // 7).to_numpy()
+    target = due_week[:, None] + np.arange(MIN_LAG_WEEKS, MAX_LAG_WEEKS + 1)[None, :]
+    shares = np.where(target >= 0, distributions[class_index], 0.0)
+    remaining = shares.sum(axis=1)
+    shares = np.divide(shares, remaining[:, None], out=np.zeros_like(shares), where=remaining[:, None] > 0)
+    expected = shares * (invoices["balance"].to_numpy() * rates[class_index])[:, None]
+
+    in_horizon = (target >= 0) & (target < n_weeks)
+    by_class_week = np.zeros((len(class_ids), max(n_weeks, 1)))
+    rows = np.broadcast_to(class_index[:, None], target.shape)
+    np.add.at(by_class_week, (rows[in_horizon], target[in_horizon]), expected[in_horizon])
+    by_class_week = by_class_week[:, :n_weeks]
+    after_horizon = np.where(target >= n_weeks, expected, 0.0).sum(axis=1)
+    open_by_class = np.bincount(class_index, weights=invoices["balance"].to_numpy(), minlength=len(class_ids))
+    after_by_class = np.bincount(class_index, weights=after_horizon, minlength=len(class_ids))
+    invoice_counts = np.bincount(class_index, minlength=len(class_ids))
+    median_delay = history.groupby("class_id")["delay_days"].median() if not history.empty else pd.Series(dtype=float)
+
+    names = dict(db.query(Class.id, Class.name).filter(Class.id.in_([int(c) for c in class_ids if c != NO_CLASS])).all())
+    open_balance = float(invoices["balance"].sum())
+    in_horizon_total = float(by_class_week.sum())
+    return {
+        "as_of": today.isoformat(),
+        "term": term,
+        "horizon_end": horizon_end.isoformat(),
+        "open_balance": round(open_balance, 2),
+        "expected_in_horizon": round(in_horizon_total, 2),
+        "expected_after_horizon": round(float(after_by_class.sum()), 2),
+        "not_expected": round(open_balance - in_horizon_total - float(after_by_class.sum()), 2),
+        "history_payments": len(history),
+        "weeks": [{"week_start": start.isoformat(), "expected": round(float(total), 2)}
+                  for start, total in zip(week_starts, by_class_week.sum(axis=0))],
+        "classes": [{
+            "class_id": int(class_id) if class_id != NO_CLASS else None,
+            "class": names.get(int(class_id), "N/A"),
+            "invoice_count": int(invoice_counts[i]),
+            "open_balance": round(float(open_by_class[i]), 2),
+            "collection_rate": round(float(rates[i]), 3),
+            "median_delay_days": float(median_delay[class_id]) if class_id in median_delay.index else None,
+            "expected_in_horizon": round(float(by_class_week[i].sum()), 2),
+            "weeks": [round(float(value), 2) for value in by_class_week[i]],
+        } for i, class_id in enumerate(class_ids) if invoice_counts[i]],
+    }
+
+def _watermark(db: Session) -> tuple:
+    """Changes whenever a payment is posted or an invoice is added, removed or edited."""
+    open_balance = func.sum(case((Invoice.status.in_(OPEN_STATUSES), Invoice.amount - func.coalesce(Invoice.amount_paid, 0)),
+                                 else_=0))  # updated_at only has whole seconds on SQLite
+    invoices = db.query(func.count(Invoice.id), func.max(Invoice.updated_at), open_balance).one()
+    return (db.query(func.max(Payment.id)).scalar(), *invoices)
+
+def cached_projection(db: Session, today: date | None = None, weeks: int | None = None) -> dict:
+    """``project`` reused until a payment or an invoice changes, or the day does."""
+    today = today or date.today()
+    watermark = _watermark(db)
+    key = (today, weeks)
+    with _cache_lock:
+        hit = _cache.get(key)
+    if hit and hit[0] == watermark:
+        return hit[1]
+    result = project(db, today, weeks)
+    with _cache_lock:
+        for stale in [k for k in _cache if k[0] != today]:
+            del _cache[stale]
+        _cache[key] = (watermark, result)
+    return result
@@ -0,0 +1,122 @@
+"""Invoice creation in bulk, including term invoicing from fee structures.
+
+``create_invoices`` is the one write path for batches: numbers come from a
+single reserved block, rows go in with one multi-row ``INSERT ... ON
+CONFLICT DO NOTHING`` on the unique ``(student_id, category, term)`` index,
+and the rollup and ledger each get one write. Reruns are therefore no-ops.
+
+``plan_term`` joins the active fee structures to enrolled students in one
+query. A class-specific structure beats a school-wide one (``class_id``
+null) for the same category, and a structure for the term beats one
+without a term (charged every term). Structures tagged with another term
+are left out even if marked recurring.
+"""
+from collections import defaultdict
+from datetime import date
+from sqlalchemy import and_, case, or_
+from sqlalchemy.orm import Session
+from ..core.database import dialect_insert
+from ..models.class_model import Class
+from ..models.fee import FeeStructure, Invoice, InvoiceStatus, PaymentCategory
+from ..models.student import EnrollmentStatus, Student
+from . import finance_summary, ledger, sequences
+
+def create_invoices(db: Session, rows: list[dict], user_id: int | None = None) -> int:
+    """Insert ``rows`` (``student_id``, ``category``, ``term``, ``amount`` and optional
+    ``due_date``/``description``) as pending invoices; returns how many were created."""
+    if not rows:
+        return 0
+    invoice_numbers = sequences.reserve_block(db, "invoice", len(rows))
+    finance_summary.ensure_summary(db)  # the insert reaches the table before it is rolled up
+
+    stmt = dialect_insert(db.get_bind(), Invoice).values([{
+        "invoice_number": invoice_number,
+        "student_id": row["student_id"],
+        "category": row["category"],
+        "term": row["term"],
+        "amount": row["amount"],
+        "amount_paid": 0,
+        "status": InvoiceStatus.PENDING,
+        "due_date": row.get("due_date"),
+        "description": row.get("description"),
+        "created_by": user_id
+    } for invoice_number, row in zip(invoice_numbers, rows)]).on_conflict_do_nothing(
+        index_elements=["student_id", "category", "term"]
+    )
+    created_count = db.execute(stmt).rowcount
+    if not created_count:
+        return 0
+    created = db.query(Invoice.id, Invoice.student_id, Invoice.invoice_number, Invoice.amount).filter(
+        Invoice.invoice_number.in_(invoice_numbers)
+    ).all()
+    finance_summary.record_invoices_created(db, len(created), sum(i.amount for i in created))
+    ledger.record_invoices_created(db, created, user_id)
+    return len(created)
+
+def plan_term(db: Session, term: str, class_id: int | None = None) -> tuple[list[dict], int]:
+    """Invoices ``term`` still needs, one per student and category, and how many already exist."""
+    has_invoice = db.query(Invoice.id).filter(and_(
+        Invoice.student_id == Student.id, Invoice.category == FeeStructure.category, Invoice.term == term
+    )).exists()
+    query = db.query(
+        Student.id, Student.class_id, Class.name, FeeStructure.category, FeeStructure.amount,
+        FeeStructure.description, has_invoice.label("has_invoice")
+    ).join(
+        FeeStructure, or_(FeeStructure.class_id == Student.class_id, FeeStructure.class_id.is_(None))
+    ).outerjoin(Class, Class.id == Student.class_id).filter(
+        Student.enrollment_status == EnrollmentStatus.ACTIVE,
+        FeeStructure.is_active == True,
+        or_(FeeStructure.term == term, FeeStructure.term.is_(None))  # a structure pinned to another term never applies
+    )
+    if class_id:
+        query = query.filter(Student.class_id == class_id)
+    # Most specific structure first within each student and category; the rank keeps
+    # term-less rows out of the NULL ordering, which differs between backends
+    rows = query.order_by(
+        Student.id, FeeStructure.category, FeeStructure.class_id.is_(None),
+        case((FeeStructure.term == term, 0), else_=1), FeeStructure.id.desc()
+    ).all()
+
+    planned, seen, existing = [], set(), 0
+    for row in rows:
+        key = (row.id, row.category)
+        if key in seen:
+            continue
+        seen.add(key)
+        if row.has_invoice:
+            existing += 1
+            continue
+        planned.append({
+            "student_id": row.id, "class_id": row.class_id, "class_name": row.name,
+            "category": PaymentCategory(row.category), "term": term, "amount": row.amount,
+            "description": row.description
+        })
+    return planned, existing
+
+def generate_term(db: Session, term: str, due_date: date | None = None, class_id: int | None = None,
+                  user_id: int | None = None, dry_run: bool = False) -> dict:
+    """Create every invoice ``term`` still needs; with ``dry_run`` only report the totals."""
+    planned, existing = plan_term(db, term, class_id)
+
+    by_class = defaultdict(lambda: {"invoices": 0, "total": 0.0})
+    for row in planned:
+        summary = by_class[(row["class_id"], row["category"])]
+        summary.update(class_id=row["class_id"], class_name=row["class_name"], category=row["category"].value)
+        summary["invoices"] += 1
+        summary["total"] += row["amount"]
+    result = {
+        "term": term,
+        "dry_run": dry_run,
+        "invoices": len(planned),
+        "total": sum(row["amount"] for row in planned),
+        "already_invoiced": existing,
+        "by_class": sorted(by_class.values(), key=lambda s: (s["class_name"] or "", s["category"])),
+    }
+    if dry_run:
+        return result
+
+    for row in planned:
+        row["due_date"] = due_date
+    result["created"] = create_invoices(db, planned, user_id)
+    db.commit()
+    return result
@@ -0,0 +1,180 @@
+"""Append-only student ledger with running balances.
+
+Every change to what a student owes is appended as a ``ledger_entries`` row
+carrying the balance after it, so a balance is one indexed read of the
+latest entry and a statement is a range scan. Entries are never updated or
+deleted; corrections are new entries.
+
+A student's balance is the sum of ``amount - amount_paid`` over their
+invoices that are not cancelled. Write paths snapshot ``invoice_balance``
+before changing an invoice and post the difference afterwards, inside the
+same transaction as the change itself.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from ..models.fee import Invoice, InvoiceStatus, LedgerEntry, LedgerEntryType, Payment
+from ..models.student import Student
+
+def invoice_balance(invoice: Invoice | None) -> float:
+    """What an invoice contributes to its student's balance."""
+    if invoice is None or invoice.status in (InvoiceStatus.CANCELLED, InvoiceStatus.CANCELLED.value):
+        return 0.0
+    return (invoice.amount or 0.0) - (invoice.amount_paid or 0.0)
+
+def _latest(db: Session, student_ids: list[int]) -> dict:
+    """{student_id: (sequence, balance)} for students that have entries."""
+    head = db.query(
+        LedgerEntry.student_id, func.max(LedgerEntry.sequence).label("sequence")
+    ).filter(LedgerEntry.student_id.in_(student_ids)).group_by(LedgerEntry.student_id).subquery()
+    rows = db.query(LedgerEntry.student_id, LedgerEntry.sequence, LedgerEntry.balance).join(
+        head, (LedgerEntry.student_id == head.c.student_id) & (LedgerEntry.sequence == head.c.sequence)
+    ).all()
+    return {r.student_id: (r.sequence, r.balance) for r in rows}
+
+def _invoice_balances(db: Session, student_ids: list[int]) -> dict:
+    """Balances recomputed from invoices, for students without ledger history."""
+    rows = db.query(
+        Invoice.student_id, func.sum(Invoice.amount - func.coalesce(Invoice.amount_paid, 0))
+    ).filter(
+        Invoice.student_id.in_(student_ids),
+        Invoice.status != InvoiceStatus.CANCELLED
+    ).group_by(Invoice.student_id).all()
+    return {student_id: total or 0.0 for student_id, total in rows}
+
+def post_entries(db: Session, entries: list[dict], created_by: int | None = None) -> None:
+    """Append entries in order, threading each student's running balance.
+
+    Each entry is a dict with ``student_id``, ``entry_type`` and ``debit``
+    and/or ``credit``, plus optional ``invoice_id``, ``payment_id``,
+    ``reference`` and ``description``. Pending changes are flushed first so
+    the invoice balances below see them. Students with invoices that predate
+    the ledger get an opening entry for what they owed before this batch.
+    """
+    if not entries:
+        return
+    db.flush()
+    student_ids = sorted({e["student_id"] for e in entries})
+    # Serialise writers posting for the same students (a no-op on SQLite, which locks the whole database)
+    db.query(Student.id).filter(Student.id.in_(student_ids)).with_for_update().all()
+    heads = _latest(db, student_ids)
+
+    rows = []
+    missing = [student_id for student_id in student_ids if student_id not in heads]
+    if missing:
+        current = _invoice_balances(db, missing)
+        batch_delta = defaultdict(float)
+        for e in entries:
+            batch_delta[e["student_id"]] += e.get("debit", 0.0) - e.get("credit", 0.0)
+        for student_id in missing:
+            opening = round(current.get(student_id, 0.0) - batch_delta[student_id], 2)
+            heads[student_id] = (0, 0.0)
+            if opening:
+                heads[student_id] = (1, opening)
+                rows.append({
+                    "student_id": student_id, "sequence": 1, "entry_type": LedgerEntryType.OPENING,
+                    "description": "Opening balance", "debit": max(opening, 0.0),
+                    "credit": max(-opening, 0.0), "balance": opening, "created_by": created_by
+                })
+
+    for e in entries:
+        sequence, balance = heads[e["student_id"]]
+        debit, credit = e.get("debit", 0.0), e.get("credit", 0.0)
+        sequence, balance = sequence + 1, round(balance + debit - credit, 2)
+        heads[e["student_id"]] = (sequence, balance)
+        rows.append({
+            "student_id": e["student_id"], "sequence": sequence, "entry_type": e["entry_type"],
+            "invoice_id": e.get("invoice_id"), "payment_id": e.get("payment_id"),
+            "reference": e.get("reference"), "description": e.get("description"),
+            "debit": debit, "credit": credit, "balance": balance, "created_by": created_by
+        })
+    db.execute(insert(LedgerEntry.__table__), rows)
+
+def record_invoice_change(db: Session, invoice: Invoice, before: float, entry_type: LedgerEntryType,
+                          description: str | None = None, created_by: int | None = None,
+                          removed: bool = False) -> None:
+    """Post the change in an invoice's contribution since ``before``.
+
+    ``before`` is ``invoice_balance`` taken before the change (``0.0`` for a
+    new invoice). Pass ``removed=True`` once the invoice has been deleted.
+    Nothing is posted when the contribution did not move.
+    """
+    delta = round((0.0 if removed else invoice_balance(invoice)) - before, 2)
+    if not delta:
+        return
+    db.flush()  # new invoices need their id
+    post_entries(db, [{
+        "student_id": invoice.student_id,
+        "entry_type": entry_type,
+        "invoice_id": invoice.id,
+        "reference": invoice.invoice_number,
+        "description": description,
+        "debit": max(delta, 0.0),
+        "credit": max(-delta, 0.0),
+    }], created_by)
+
+def record_invoices_created(db: Session, invoices: list, created_by: int | None = None) -> None:
+    """Post one debit per new invoice with a single multi-row insert."""
+    post_entries(db, [{
+        "student_id": i.student_id,
+        "entry_type": LedgerEntryType.INVOICE,
+        "invoice_id": i.id,
+        "reference": i.invoice_number,
+        "debit": i.amount,
+    } for i in invoices], created_by)
+
+def record_payment(db: Session, payment: Payment, student_id: int, created_by: int | None = None) -> None:
+    record_payments(db, [(payment, student_id)], created_by)
+
+def record_payments(db: Session, payments, created_by: int | None = None) -> None:
+    """Post one credit per ``(payment, student_id)`` pair with a single multi-row insert."""
+    db.flush()  # new payments need their id
+    post_entries(db, [{
+        "student_id": student_id,
+        "entry_type": LedgerEntryType.PAYMENT,
+        "invoice_id": payment.invoice_id,
+        "payment_id": payment.id,
+        "reference": payment.receipt_number,
+        "description": payment.payment_method,
+        "credit": payment.amount,
+    } for payment, student_id in payments], created_by)
+
+def balances(db: Session, student_ids: list[int]) -> dict:
+    """{student_id: balance owed} read from each student's latest entry."""
+    if not student_ids:
+        return {}
+    result = {student_id: balance for student_id, (_, balance) in _latest(db, student_ids).items()}
+    missing = [student_id for student_id in student_ids if student_id not in result]
+    if missing:
+        fallback = _invoice_balances(db, missing)
+        result.update({student_id: fallback.get(student_id, 0.0) for student_id in missing})
+    return result
+
+def balance(db: Session, student_id: int) -> float:
+    return balances(db, [student_id])[student_id]
+
+def statement(db: Session, student_id: int, start: date | None = None, end: date | None = None) -> dict:
+    """Entries between ``start`` and ``end`` (inclusive) with opening and closing balances."""
+    query = db.query(LedgerEntry).filter(LedgerEntry.student_id == student_id)
+    opening = 0.0
+    if start:
+        previous = query.filter(LedgerEntry.created_at < start).order_by(LedgerEntry.sequence.desc()).first()
+        opening = previous.balance if previous else 0.0
+        query = query.filter(LedgerEntry.created_at >= start)
+    if end:
+        query = query.filter(LedgerEntry.created_at < end + timedelta(days=1))
+    entries = query.order_by(LedgerEntry.sequence).all()
+    return {
+        "opening_balance": opening,
+        "closing_balance": entries[-1].balance if entries else opening,
+        "entries": [{
+            "date": str(e.created_at) if e.created_at else None,
+            "type": e.entry_type.value,
+            "reference": e.reference,
+            "description": e.description,
+            "debit": e.debit,
+            "credit": e.credit,
+            "balance": e.balance
+        } for e in entries]
+    }
@@ -0,0 +1,203 @@
+"""Mobile-money collections: pending transactions and the callback inbox.
+
+Initiating a collection records a PENDING ``mobile_money_transactions`` row
+whose ``external_id`` is the reference sent to the provider. Provider
+callbacks are stored verbatim in ``mobile_money_callbacks`` and acknowledged
+straight away; ``process_callbacks`` drains that inbox in batches, off the
+request path.
+
+Callbacks are at-least-once, so settling is idempotent twice over: a
+transaction leaves PENDING through a compare-and-set update that only one
+callback can win, and ``(provider, provider_transaction_id)`` is unique so a
+provider transaction can never settle two of ours.
+
+A callback is only trusted for the amount we asked for: one reporting a
+different amount is held (``amount_mismatch``) and leaves the transaction
+pending. A successful collection that would take its invoice past the open
+balance, for instance two pending requests on one invoice both paid, is
+settled but not posted (``review``) so an accountant decides where the
+money goes.
+"""
+import threading
+import uuid
+from datetime import date, datetime
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from ..core.database import SessionLocal
+from ..models.fee import Invoice
+from ..models.mobile_money import MobileMoneyCallback, MobileMoneyStatus, MobileMoneyTransaction
+from . import ledger, payments
+
+PROVIDERS = ("mtn_momo", "airtel_money")
+
+PROVIDER_NAMES = {"mtn momo": "mtn_momo", "mtn": "mtn_momo", "airtel money": "airtel_money", "airtel": "airtel_money"}
+
+def provider_code(name: str) -> str | None:
+    """``mtn_momo``/``airtel_money`` for a code or a display name such as "MTN MoMo"."""
+    value = str(name or "").strip().lower()
+    return value if value in PROVIDERS else PROVIDER_NAMES.get(value)
+
+def create_transaction(db: Session, invoice: Invoice, provider: str, phone: str, amount: float,
+                       user_id: int | None = None) -> MobileMoneyTransaction:
+    transaction = MobileMoneyTransaction(
+        provider=provider, external_id=uuid.uuid4().hex, invoice_id=invoice.id, phone=phone,
+        amount=amount, status=MobileMoneyStatus.PENDING, initiated_by=user_id
+    )
+    db.add(transaction)
+    db.commit()
+    db.refresh(transaction)
+    return transaction
+
+def enqueue_callback(db: Session, provider: str, payload: dict) -> MobileMoneyCallback:
+    callback = MobileMoneyCallback(provider=provider, payload=payload)
+    db.add(callback)
+    db.commit()
+    return callback
+
+def parse_callback(provider: str, payload: dict) -> dict | None:
+    """Normalise a provider payload to ``external_id``, ``provider_transaction_id``, ``status``, ``amount`` and ``reason``."""
+    if not isinstance(payload, dict):
+        return None
+    if provider == "mtn_momo":
+        status = {"SUCCESSFUL": MobileMoneyStatus.SUCCESSFUL, "FAILED": MobileMoneyStatus.FAILED}.get(
+            str(payload.get("status", "")).upper(), MobileMoneyStatus.PENDING)
+        reason = payload.get("reason")
+        parsed = {
+            "external_id": payload.get("externalId"),
+            "provider_transaction_id": payload.get("financialTransactionId"),
+            "status": status,
+            "amount": payload.get("amount"),
+            "reason": reason.get("message") or reason.get("code") if isinstance(reason, dict) else reason,
+        }
+    elif provider == "airtel_money":
+        transaction = payload.get("transaction") or {}
+        status = {"TS": MobileMoneyStatus.SUCCESSFUL, "TF": MobileMoneyStatus.FAILED}.get(
+            str(transaction.get("status_code", "")).upper(), MobileMoneyStatus.PENDING)
+        parsed = {
+            "external_id": transaction.get("id"),
+            "provider_transaction_id": transaction.get("airtel_money_id"),
+            "status": status,
+            "amount": transaction.get("amount"),
+            "reason": transaction.get("message"),
+        }
+    else:
+        return None
+    if not parsed["external_id"]:
+        return None
+    try:
+        parsed["amount"] = float(parsed["amount"]) if parsed["amount"] not in (None, "") else None
+    except (TypeError, ValueError):
+        parsed["amount"] = None
+    return parsed
+
+def stub_callback(transaction: MobileMoneyTransaction, status: MobileMoneyStatus = MobileMoneyStatus.SUCCESSFUL,
+                  provider_transaction_id: str | None = None) -> dict:
+    """The payload the provider would send for ``transaction``; used by the local stub and tests."""
+    provider_transaction_id = provider_transaction_id or f"{transaction.provider.upper()}-{transaction.external_id[:12]}"
+    successful = status == MobileMoneyStatus.SUCCESSFUL
+    if transaction.provider == "airtel_money":
+        return {"transaction": {
+            "id": transaction.external_id, "airtel_money_id": provider_transaction_id,
+            "status_code": "TS" if successful else "TF", "amount": transaction.amount,
+            "message": "Paid" if successful else "Transaction failed"
+        }}
+    payload = {
+        "externalId": transaction.external_id, "financialTransactionId": provider_transaction_id,
+        "amount": str(transaction.amount), "currency": "RWF", "status": "SUCCESSFUL" if successful else "FAILED",
+        "payer": {"partyIdType": "MSISDN", "partyId": transaction.phone}
+    }
+    if not successful:
+        payload["reason"] = "PAYER_LIMIT_REACHED"
+    return payload
+
+def _settle(db: Session, transaction: MobileMoneyTransaction, parsed: dict, now: datetime) -> bool:
+    """Move a transaction out of PENDING; False when another callback already did."""
+    values = {"status": parsed["status"], "completed_at": now}
+    if parsed["status"] == MobileMoneyStatus.SUCCESSFUL:
+        values["provider_transaction_id"] = parsed["provider_transaction_id"]
+    else:
+        values["failure_reason"] = parsed["reason"]
+    try:
+        with db.begin_nested():
+            claimed = db.execute(
+                update(MobileMoneyTransaction)
+                .where(MobileMoneyTransaction.id == transaction.id, MobileMoneyTransaction.status == MobileMoneyStatus.PENDING)
+                .values(**values)
+            ).rowcount
+    except IntegrityError:
+        return False  # provider transaction id already settled another transaction
+    return bool(claimed)
+
+def process_callbacks(db: Session, limit: int = 200) -> int:
+    """Settle up to ``limit`` queued callbacks in one transaction; returns how many were processed.
+
+    Successful collections are posted together through ``payments.post_payments``
+    so a burst of callbacks costs one rollup and one ledger write per batch.
+    """
+    callbacks = db.query(MobileMoneyCallback).filter(
+        MobileMoneyCallback.processed_at.is_(None)
+    ).order_by(MobileMoneyCallback.id).limit(limit).with_for_update(skip_locked=True).all()
+    if not callbacks:
+        return 0
+
+    parsed = {callback.id: parse_callback(callback.provider, callback.payload) for callback in callbacks}
+    external_ids = {p["external_id"] for p in parsed.values() if p}
+    transactions = {t.external_id: t for t in db.query(MobileMoneyTransaction).filter(
+        MobileMoneyTransaction.external_id.in_(external_ids))} if external_ids else {}
+    invoice_ids = {t.invoice_id for t in transactions.values()}
+    invoices = {i.id: i for i in db.query(Invoice).filter(
+        Invoice.id.in_(invoice_ids)).with_for_update().populate_existing()} if invoice_ids else {}
+    remaining = {invoice_id: ledger.invoice_balance(invoice) for invoice_id, invoice in invoices.items()}
+
+    now = datetime.now()
+    to_post = []
+    for callback in callbacks:
+        event = parsed[callback.id]
+        transaction = transactions.get(event["external_id"]) if event else None
+        if transaction is None or transaction.provider != callback.provider:
+            callback.result = "unknown"
+        elif event["status"] == MobileMoneyStatus.PENDING:
+            callback.result = "pending"
+        elif event["status"] == MobileMoneyStatus.SUCCESSFUL and event["amount"] is not None and \
+                abs(event["amount"] - transaction.amount) > 0.005:
+            callback.result = "amount_mismatch"
+        elif not _settle(db, transaction, event, now):
+            callback.result = "duplicate"
+        elif event["status"] == MobileMoneyStatus.SUCCESSFUL:
+            if transaction.amount > remaining[transaction.invoice_id] + 0.005:
+                callback.result = "review"
+                transaction.failure_reason = "Paid more than the invoice's open balance; not posted"
+            else:
+                callback.result = "posted"
+                remaining[transaction.invoice_id] -= transaction.amount
+                to_post.append((transaction, transaction.amount))
+        else:
+            callback.result = "failed"
+        callback.processed_at = now
+
+    for provider in PROVIDERS:
+        batch = [(transaction, amount) for transaction, amount in to_post if transaction.provider == provider]
+        posted = payments.post_payments(db, [
+            (invoices[transaction.invoice_id], amount, date.today()) for transaction, amount in batch
+        ], provider, None)
+        if posted:
+            db.execute(update(MobileMoneyTransaction), [
+                {"id": transaction.id, "payment_id": payment.id} for (transaction, _), payment in zip(batch, posted)
+            ])
+    db.commit()
+    return len(callbacks)
+
+_drain_lock = threading.Lock()
+
+def drain_in_background() -> None:
+    """Empty the inbox; concurrent calls coalesce into the drain already running."""
+    if not _drain_lock.acquire(blocking=False):
+        return
+    db = SessionLocal()
+    try:
+        while process_callbacks(db):
+            pass
+    finally:
+        db.close()
+        _drain_lock.release()
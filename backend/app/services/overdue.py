@@ -0,0 +1,109 @@
+"""Daily overdue sweep and late fees.
+
+Open invoices past their due date are flipped to OVERDUE with one
+``UPDATE`` per source status, so dashboards count overdue invoices by
+status through ``ix_invoices_status_due_date`` instead of filtering on
+dates. Invoices still unpaid ``grace_period_days`` after their due date
+get one late-fee invoice of ``late_fee_percentage`` of their balance,
+raised by a single ``INSERT ... SELECT``. The sweep then saves the day's
+receivables aging snapshot.
+
+Every statement only touches rows that still need the change and
+``late_fee_for_id`` is unique, so a sweep can be rerun at any time; the
+``overdue_sweeps`` row for the day records that the daily run happened.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import Numeric, cast, exists, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session, aliased
+from ..core.database import dialect_insert
+from ..models.fee import Invoice, InvoiceStatus, OverdueSweep, PaymentCategory
+from ..models.school_settings import SchoolSettings
+from . import aging, finance_summary, ledger
+
+OPEN_STATUSES = (InvoiceStatus.PENDING, InvoiceStatus.PARTIAL)
+
+def late_fee_settings(db: Session) -> tuple[float, int]:
+    """(late_fee_percentage, grace_period_days) from the school settings, or the column defaults."""
+    school = db.query(SchoolSettings.late_fee_percentage, SchoolSettings.grace_period_days).first()
+    percentage = school.late_fee_percentage if school and school.late_fee_percentage is not None else \
+        SchoolSettings.late_fee_percentage.default.arg
+    grace = school.grace_period_days if school and school.grace_period_days is not None else \
+        SchoolSettings.grace_period_days.default.arg
+    return percentage, grace
+
+def _set_status(db: Session, status: InvoiceStatus, *conditions) -> int:
+    return db.execute(
+        update(Invoice).where(*conditions).values(status=status).execution_options(synchronize_session=False)
+    ).rowcount
+
+def sweep(db: Session, today: date | None = None, user_id: int | None = None) -> OverdueSweep:
+    """Mark overdue invoices and raise late fees as of ``today``, then commit."""
+    today = today or date.today()
+    start = datetime.combine(today, time.min)
+    percentage, grace = late_fee_settings(db)
+
+    # Claim the day's row first so concurrent sweeps of the same day queue behind each other
+    db.execute(dialect_insert(db.get_bind(), OverdueSweep.__table__).values(
+        run_date=today, marked_overdue=0, reopened=0, late_fee_count=0, late_fee_total=0.0
+    ).on_conflict_do_nothing(index_elements=["run_date"]))
+    run = db.query(OverdueSweep).filter(OverdueSweep.run_date == today).with_for_update().one()
+    finance_summary.ensure_summary(db)  # the updates below reach the table before they are rolled up
+
+    counts = {}
+    for status in OPEN_STATUSES:
+        counts[status] = _set_status(db, InvoiceStatus.OVERDUE, Invoice.status == status, Invoice.due_date < start)
+    # Due dates pushed back (or cleared) after the invoice went overdue
+    not_due = or_(Invoice.due_date.is_(None), Invoice.due_date >= start)
+    reopened = {
+        InvoiceStatus.PARTIAL: _set_status(db, InvoiceStatus.PARTIAL, Invoice.status == InvoiceStatus.OVERDUE,
+                                           not_due, Invoice.amount_paid > 0),
+        InvoiceStatus.PENDING: _set_status(db, InvoiceStatus.PENDING, Invoice.status == InvoiceStatus.OVERDUE,
+                                           not_due, func.coalesce(Invoice.amount_paid, 0) <= 0),
+    }
+    finance_summary.record_status_changes(db, {
+        **{(status, InvoiceStatus.OVERDUE): count for status, count in counts.items()},
+        **{(InvoiceStatus.OVERDUE, status): count for status, count in reopened.items()},
+    })
+
+    fees = []
+    if percentage > 0:
+        late_fee = aliased(Invoice)
+        balance = Invoice.amount - func.coalesce(Invoice.amount_paid, 0)
+        source = select(
+            literal("LF-") + Invoice.invoice_number,
+            Invoice.student_id,
+            literal(PaymentCategory.OTHER, Invoice.category.type),
+            func.round(cast(balance * percentage / 100.0, Numeric(12, 2)), 2),
+            literal(0.0),
+            literal(InvoiceStatus.PENDING, Invoice.status.type),
+            literal(start + timedelta(days=grace), Invoice.due_date.type),
+            literal("Late fee on ") + Invoice.invoice_number,
+            Invoice.id,
+            literal(user_id, Invoice.created_by.type),
+        ).where(
+            Invoice.status == InvoiceStatus.OVERDUE,
+            Invoice.due_date < start - timedelta(days=grace),
+            Invoice.late_fee_for_id.is_(None),
+            balance > 0,
+            ~exists().where(late_fee.late_fee_for_id == Invoice.id)
+        )
+        fees = db.execute(
+            insert(Invoice).from_select(
+                ["invoice_number", "student_id", "category", "amount", "amount_paid", "status",
+                 "due_date", "description", "late_fee_for_id", "created_by"], source
+            ).returning(Invoice.id, Invoice.student_id, Invoice.invoice_number, Invoice.amount)
+        ).all()
+    late_fee_total = sum(fee.amount for fee in fees)
+    if fees:
+        finance_summary.record_invoices_created(db, len(fees), late_fee_total)
+        ledger.record_invoices_created(db, fees, user_id)
+
+    run.marked_overdue += sum(counts.values())
+    run.reopened += sum(reopened.values())
+    run.late_fee_count += len(fees)
+    run.late_fee_total += late_fee_total
+    run.late_fee_percentage = percentage
+    run.grace_period_days = grace
+    aging.refresh_snapshot(db, today)
+    db.commit()
+    return run
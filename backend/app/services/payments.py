@@ -0,0 +1,182 @@
+"""Posting payments against invoices.
+
+``post_payments`` is shared by the write paths that receive money outside
+the accountant's payment form (statement reconciliation, mobile-money
+callbacks): each batch reserves its receipt numbers at once and writes the
+rollup and the ledger once.
+
+``allocate`` backs the payment form: one receipt is spread over a student's
+(or a guardian's) open invoices, oldest due date first, and committed as
+one transaction.
+
+Both add to ``amount_paid`` in the database (``amount_paid = amount_paid +
+x``) instead of writing back a total computed in Python, so two payments
+landing on the same invoice at once cannot overwrite each other.
+"""
+from datetime import date
+from sqlalchemy import bindparam, case, func, insert, literal, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from ..models.fee import Invoice, InvoiceStatus, Payment
+from ..models.guardian import student_guardians
+from . import finance_summary, ledger, sequences
+
+OPEN_STATUSES = (InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE)
+
+_invoices = Invoice.__table__
+
+def _credit(guarded: bool = False):
+    """UPDATE adding ``:b_credit`` to invoice ``:b_id`` and setting its status from the new total.
+
+    ``guarded`` only matches while the balance still covers the credit, so a
+    payment posted in between makes the update miss instead of overpaying.
+    """
+    paid = func.coalesce(_invoices.c.amount_paid, 0)
+    statement = update(_invoices).where(_invoices.c.id == bindparam("b_id")).values(
+        amount_paid=paid + bindparam("b_credit"),
+        status=case(
+            (paid + bindparam("b_credit") >= _invoices.c.amount - 0.005, literal(InvoiceStatus.PAID, _invoices.c.status.type)),
+            (_invoices.c.status == InvoiceStatus.OVERDUE, literal(InvoiceStatus.OVERDUE, _invoices.c.status.type)),
+            else_=literal(InvoiceStatus.PARTIAL, _invoices.c.status.type)  # overdue stays overdue until settled
+        )
+    )
+    if guarded:
+        statement = statement.where(_invoices.c.amount - paid >= bindparam("b_credit") - 0.005)
+    return statement
+
+def post_payments(db: Session, items, method: str, user_id: int | None) -> list:
+    """Post ``(invoice, amount, payment_date)`` items as payments in one batch.
+
+    Receipt numbers come from one reserved block, payments are inserted and
+    invoices credited with one executemany each, and the rollup and ledger
+    each get a single write. Callers check the amounts against the open
+    balances; the credit is guarded all the same, and ``ValueError`` is
+    raised if an invoice would end up overpaid.
+    """
+    if not items:
+        return []
+    finance_summary.ensure_summary(db)  # the writes below reach the tables before they are rolled up
+    receipts = sequences.reserve_block(db, "receipt", len(items))
+
+    before = {}
+    credit = {}
+    rows = []
+    for receipt_number, (invoice, amount, payment_date) in zip(receipts, items):
+        before.setdefault(invoice.id, (invoice, finance_summary.invoice_snapshot(invoice)))
+        credit[invoice.id] = credit.get(invoice.id, 0.0) + amount
+        rows.append({
+            "receipt_number": receipt_number, "invoice_id": invoice.id, "amount": amount, "payment_method": method,
+            "payment_date": payment_date or date.today(), "recorded_by": user_id
+        })
+    db.execute(insert(Payment.__table__), rows)
+    by_receipt = {p.receipt_number: p for p in db.query(Payment).filter(Payment.receipt_number.in_(receipts))}
+    payments = [by_receipt[receipt_number] for receipt_number in receipts]
+
+    updates = []
+    for invoice, _ in before.values():
+        paid = (invoice.amount_paid or 0.0) + credit[invoice.id]
+        if paid >= invoice.amount - 0.005:
+            status = InvoiceStatus.PAID
+        else:
+            status = InvoiceStatus.OVERDUE if invoice.status == InvoiceStatus.OVERDUE else InvoiceStatus.PARTIAL
+        set_committed_value(invoice, "amount_paid", paid)
+        set_committed_value(invoice, "status", status)
+        updates.append({"b_id": invoice.id, "b_credit": credit[invoice.id]})
+    credited = db.execute(_credit(guarded=True), updates).rowcount
+    if db.get_bind().dialect.supports_sane_multi_rowcount and credited != len(updates):
+        raise ValueError("Payment amount exceeds remaining balance")
+
+    finance_summary.record_invoice_changes(db, [(snapshot, invoice) for invoice, snapshot in before.values()])
+    finance_summary.record_payments(db, payments)
+    ledger.record_payments(db, [(payment, invoice.student_id) for payment, (invoice, _, _) in zip(payments, items)], user_id)
+    return payments
+
+def open_invoices(db: Session, student_ids=None, invoice_ids=None) -> list[Invoice]:
+    """Open invoices with a balance, oldest due date first (undated last), locked until the transaction ends."""
+    balance = Invoice.amount - func.coalesce(Invoice.amount_paid, 0)
+    query = db.query(Invoice).filter(Invoice.status.in_(OPEN_STATUSES), balance > 0.005)
+    if student_ids is not None:
+        query = query.filter(Invoice.student_id.in_(student_ids))
+    if invoice_ids is not None:
+        query = query.filter(Invoice.id.in_(invoice_ids))
+    return query.order_by(Invoice.due_date.is_(None), Invoice.due_date, Invoice.id).with_for_update().populate_existing().all()
+
+def guardian_student_ids(db: Session, guardian_id: int) -> list[int]:
+    return [student_id for student_id, in db.query(student_guardians.c.student_id).filter(
+        student_guardians.c.guardian_id == guardian_id
+    )]
+
+def allocate(db: Session, amount: float, method: str, student_ids=None, invoice_ids=None,
+             payment_date: date | None = None, user_id: int | None = None) -> dict:
+    """Spread one receipt over the open invoices of ``student_ids`` (or ``invoice_ids``) and commit.
+
+    Invoices are paid off oldest due date first. Each line gets its own
+    payment row; with more than one line the receipt number is suffixed
+    ``-1``, ``-2``... so the lines stay traceable to the one receipt. Raises
+    ``ValueError`` (nothing written) if the amount is more than the open
+    balance, or if an invoice was paid by someone else in the meantime.
+    """
+    amount = round(float(amount), 2)
+    if amount <= 0:
+        raise ValueError("Payment amount must be positive")
+    invoices = open_invoices(db, student_ids, invoice_ids)
+    open_balance = round(sum(ledger.invoice_balance(invoice) for invoice in invoices), 2)
+    if amount > open_balance + 0.005:
+        db.rollback()
+        raise ValueError(f"Payment amount exceeds remaining balance ({open_balance:,.2f})")
+
+    lines, left = [], amount
+    for invoice in invoices:
+        if left <= 0.005:
+            break
+        line = round(min(left, ledger.invoice_balance(invoice)), 2)
+        lines.append((invoice, line))
+        left = round(left - line, 2)
+
+    try:
+        finance_summary.ensure_summary(db)
+        receipt_number = sequences.next_number(db, "receipt")
+        receipts = [receipt_number] if len(lines) == 1 else [f"{receipt_number}-{i}" for i in range(1, len(lines) + 1)]
+
+        changes = []
+        for invoice, line in lines:
+            snapshot = finance_summary.invoice_snapshot(invoice)
+            row = db.execute(_credit(guarded=True).returning(_invoices.c.amount_paid, _invoices.c.status),
+                             {"b_id": invoice.id, "b_credit": line}).first()
+            if row is None:
+                raise ValueError(f"Invoice {invoice.invoice_number} was paid in the meantime; try again")
+            set_committed_value(invoice, "amount_paid", row.amount_paid)
+            set_committed_value(invoice, "status", row.status)
+            changes.append((snapshot, invoice))
+
+        db.execute(insert(Payment.__table__), [{
+            "receipt_number": receipt, "invoice_id": invoice.id, "amount": line, "payment_method": method,
+            "payment_date": payment_date or date.today(), "recorded_by": user_id
+        } for receipt, (invoice, line) in zip(receipts, lines)])
+        by_receipt = {p.receipt_number: p for p in db.query(Payment).filter(Payment.receipt_number.in_(receipts))}
+        payments = [by_receipt[receipt] for receipt in receipts]
+
+        finance_summary.record_invoice_changes(db, changes)
+        finance_summary.record_payments(db, payments)
+        ledger.record_payments(db, [(payment, invoice.student_id) for payment, (invoice, _) in zip(payments, lines)], user_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return {
+        "receipt_number": receipt_number,
+        "amount": amount,
+        "allocations": [{
+            "payment_id": payment.id,
+            "receipt_number": payment.receipt_number,
+            "invoice_id": invoice.id,
+            "invoice_number": invoice.invoice_number,
+            "student_id": invoice.student_id,
+            "category": invoice.category.value if invoice.category else None,
+            "amount": line,
+            "remaining_balance": round(ledger.invoice_balance(invoice), 2),
+            "status": invoice.status.value,
+        } for payment, (invoice, line) in zip(payments, lines)],
+        "remaining_open_balance": round(open_balance - amount, 2),
+    }
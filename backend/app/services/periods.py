@@ -0,0 +1,162 @@
+"""Monthly financial periods.
+
+Closing a month freezes its collections, split by payment method, fee
+category and class, into ``financial_periods`` and
+``financial_period_totals``. Historical charts read those rows, and only
+the open month is computed from ``payments``, through a half-open
+``payment_date`` range that can use the index on SQLite and Postgres alike.
+
+Months are closed by ``period_closer.py`` (scheduled daily) or an admin,
+never by a read: ``history`` totals any ended month that is not closed yet
+live, month by month, so nothing is written to draw a chart. Closing a
+month again recomputes it, which picks up payments that were backdated into
+it after it was closed; the totals are upserted, so two closes of the same
+month at once end with the same rows instead of a duplicate key.
+"""
+from datetime import date, datetime
+from sqlalchemy import delete, func, not_, tuple_
+from sqlalchemy.orm import Session
+from ..core import dates
+from ..core.database import dialect_insert
+from ..models.class_model import Class
+from ..models.fee import FinancialPeriod, FinancialPeriodTotal, Invoice, Payment
+from ..models.student import Student
+
+DIMENSIONS = ("method", "category", "class")
+
+def month_start(value: date) -> date:
+    return dates.bucket_start(value, "month")
+
+def next_month(value: date) -> date:
+    return dates.next_bucket(value, "month")
+
+def period_name(start: date) -> str:
+    return start.strftime("%Y-%m")
+
+def parse_period(period: str) -> date:
+    """First day of a ``YYYY-MM`` period; raises ``ValueError`` for anything else."""
+    try:
+        return datetime.strptime(period, "%Y-%m").date()
+    except ValueError:
+        raise ValueError("Period must be YYYY-MM")
+
+def collections(db: Session, start: date, end: date | None = None) -> dict:
+    """Payments dated in ``[start, end)`` totalled overall and by method, category and class."""
+    query = db.query(
+        Payment.payment_method, Invoice.category, Student.class_id, Class.name,
+        func.count(Payment.id), func.sum(Payment.amount)
+    ).outerjoin(Invoice, Invoice.id == Payment.invoice_id).outerjoin(
+        Student, Student.id == Invoice.student_id
+    ).outerjoin(Class, Class.id == Student.class_id).filter(*dates.between(Payment.payment_date, start, end))
+    rows = query.group_by(Payment.payment_method, Invoice.category, Student.class_id, Class.name).all()
+
+    totals = {"total": 0.0, "count": 0, **{dimension: {} for dimension in DIMENSIONS}}
+    for method, category, class_id, class_name, count, total in rows:
+        total = total or 0.0
+        totals["total"] += total
+        totals["count"] += count
+        for dimension, key, label in (("method", method, None),
+                                      ("category", category.value if category else "none", None),
+                                      ("class", str(class_id) if class_id else "none", class_name)):
+            entry = totals[dimension].setdefault(key, {"key": key, "label": label, "total": 0.0, "count": 0})
+            entry["total"] += total
+            entry["count"] += count
+    return totals
+
+def _invoiced(db: Session, start: date, end: date) -> tuple[int, float]:
+    count, total = db.query(func.count(Invoice.id), func.coalesce(func.sum(Invoice.amount), 0.0)).filter(
+        *dates.between(Invoice.created_at, start, end)
+    ).one()
+    return count, total
+
+def close_period(db: Session, period: str, user_id: int | None = None, today: date | None = None) -> FinancialPeriod:
+    """Freeze (or refreeze) the totals of a past month and commit."""
+    start = parse_period(period)
+    end = next_month(start)
+    if end > month_start(today or date.today()):
+        raise ValueError("Only months that have ended can be closed")
+
+    totals = collections(db, start, end)
+    invoice_count, total_invoiced = _invoiced(db, start, end)
+    db.execute(dialect_insert(db.get_bind(), FinancialPeriod.__table__).values(
+        period=period, start_date=start, end_date=end
+    ).on_conflict_do_nothing(index_elements=["period"]))
+    row = db.query(FinancialPeriod).filter(FinancialPeriod.period == period).one()
+    row.total_collected = totals["total"]
+    row.payment_count = totals["count"]
+    row.total_invoiced = total_invoiced
+    row.invoice_count = invoice_count
+    row.closed_by = user_id
+    row.closed_at = func.now()
+
+    entries = [{"period_id": row.id, "dimension": dimension, **entry}
+               for dimension in DIMENSIONS for entry in totals[dimension].values()]
+    stale = delete(FinancialPeriodTotal).where(FinancialPeriodTotal.period_id == row.id)
+    if entries:
+        statement = dialect_insert(db.get_bind(), FinancialPeriodTotal.__table__).values(entries)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["period_id", "dimension", "key"],
+            set_={column: statement.excluded[column] for column in ("label", "total", "count")}
+        ))
+        stale = stale.where(not_(tuple_(FinancialPeriodTotal.dimension, FinancialPeriodTotal.key).in_(
+            [(entry["dimension"], entry["key"]) for entry in entries]
+        )))
+    db.execute(stale)
+    db.commit()
+    db.refresh(row)
+    return row
+
+def ensure_closed(db: Session, today: date | None = None, user_id: int | None = None) -> int:
+    """Close every ended month since the first payment that is not closed yet; returns how many."""
+    first = db.query(func.min(Payment.payment_date)).scalar()
+    if not first:
+        return 0
+    current = month_start(today or date.today())
+    closed = {period for period, in db.query(FinancialPeriod.period)}
+    count, start = 0, month_start(first)
+    while start < current:
+        if period_name(start) not in closed:
+            close_period(db, period_name(start), user_id, today)
+            count += 1
+        start = next_month(start)
+    return count
+
+def history(db: Session, today: date | None = None) -> dict:
+    """Monthly collections from the closed periods plus live totals for every month not closed, and all-time totals per dimension."""
+    current = month_start(today or date.today())
+    closed = {p.period: p for p in db.query(FinancialPeriod).filter(FinancialPeriod.start_date < current)}
+    first = db.query(func.min(Payment.payment_date)).scalar()
+    open_months = [start for start in dates.buckets(first, current, "month") if period_name(start) not in closed] \
+        if first else []
+    open_months.append(current)
+
+    months = [{
+        "period": p.period, "total": p.total_collected, "count": p.payment_count,
+        "invoiced": p.total_invoiced, "closed": True, "start": p.start_date
+    } for p in closed.values()]
+    live = []
+    for start in open_months:
+        end = next_month(start)
+        totals = collections(db, start, end)
+        live.append(totals)
+        months.append({"period": period_name(start), "total": totals["total"], "count": totals["count"],
+                       "invoiced": _invoiced(db, start, end)[1], "closed": False, "start": start})
+    months.sort(key=lambda m: m.pop("start"))
+
+    by_dimension = {dimension: {} for dimension in DIMENSIONS}
+    frozen = db.query(
+        FinancialPeriodTotal.dimension, FinancialPeriodTotal.key, func.max(FinancialPeriodTotal.label),
+        func.sum(FinancialPeriodTotal.count), func.sum(FinancialPeriodTotal.total)
+    ).join(FinancialPeriod, FinancialPeriod.id == FinancialPeriodTotal.period_id).filter(
+        FinancialPeriod.start_date < current
+    ).group_by(FinancialPeriodTotal.dimension, FinancialPeriodTotal.key).all()
+    for dimension, key, label, count, total in frozen:
+        by_dimension[dimension][key] = {"key": key, "label": label, "total": total, "count": count}
+    for totals in live:
+        for dimension in DIMENSIONS:
+            for key, entry in totals[dimension].items():
+                merged = by_dimension[dimension].setdefault(key, {"key": key, "label": entry["label"], "total": 0.0, "count": 0})
+                merged["label"] = entry["label"] or merged["label"]
+                merged["total"] += entry["total"]
+                merged["count"] += entry["count"]
+    return {"months": months, **{dimension: list(by_dimension[dimension].values()) for dimension in DIMENSIONS}}
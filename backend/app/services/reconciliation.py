@@ -0,0 +1,331 @@
+"""Bank and mobile-money statement reconciliation.
+
+A statement file (CSV or XLSX) is read one row at a time and every credit is
+matched against open invoices through in-memory hash indexes built once per
+import:
+
+* ``reference``   - invoice or admission numbers quoted by the payer
+* ``phone``       - guardian phone numbers, compared on their last nine digits
+* ``amount_date`` - payments already recorded by hand for the same amount,
+  day and method, so they are linked rather than posted twice
+
+Matched lines are posted as ``Payment`` rows a batch at a time; everything
+else stays in ``statement_lines`` as the review queue.
+"""
+import csv
+import io
+import re
+from collections import defaultdict
+from datetime import date, datetime
+from itertools import islice
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from ..models.fee import Invoice, InvoiceStatus, Payment
+from ..models.guardian import Guardian, student_guardians
+from ..models.reconciliation import StatementImport, StatementLine, StatementLineStatus
+from ..models.student import Student
+from . import ledger, payments
+
+SOURCES = ("mtn_momo", "airtel_money", "bank")
+
+OPEN_STATUSES = (InvoiceStatus.PENDING, InvoiceStatus.PARTIAL, InvoiceStatus.OVERDUE)
+
+HEADER_ALIASES = {
+    "transaction_id": ("transaction id", "txn id", "financial transaction id", "transaction reference", "ref no", "id"),
+    "transaction_date": ("date", "transaction date", "value date", "posting date", "date time"),
+    "amount": ("amount", "amount rwf", "credit", "credit amount", "deposit"),
+    "reference": ("reference", "narrative", "description", "details", "message", "note"),
+    "phone": ("phone", "phone number", "msisdn", "from msisdn", "sender", "from"),
+    "payer_name": ("name", "payer", "payer name", "from name", "sender name"),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S")
+
+def normalize_phone(value) -> str | None:
+    """Last nine digits, so 0788..., 250788... and +250 788... compare equal."""
+    if value is None:
+        return None
+    if isinstance(value, float):
+        value = int(value)
+    digits = re.sub(r"\D", "", str(value))
+    return digits[-9:] if len(digits) >= 9 else None
+
+def _map_header(header) -> dict:
+    names = [re.sub(r"[^a-z0-9]+", " ", str(cell or "").lower()).strip() for cell in header]
+    columns = {}
+    for field, aliases in HEADER_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                columns[field] = names.index(alias)
+                break
+    if "amount" not in columns or "transaction_date" not in columns:
+        raise ValueError("Statement needs at least a date and an amount column")
+    return columns
+
+def _xlsx_rows(fileobj):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def read_statement(fileobj, filename: str):
+    """Yield ``(line_number, {field: raw value})`` for each data row of a statement."""
+    if filename.lower().endswith(".xlsx"):
+        rows = _xlsx_rows(fileobj)
+    else:
+        rows = csv.reader(io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline=""))
+    header = next(rows, None)
+    if header is None:
+        raise ValueError("Statement file is empty")
+    columns = _map_header(header)
+
+    for line_number, row in enumerate(rows, 2):
+        if not any(cell not in (None, "") for cell in row):
+            continue
+        yield line_number, {field: row[i] if i < len(row) else None for field, i in columns.items()}
+
+def _parse_amount(value) -> float | None:
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(re.sub(r"[^0-9.\-]", "", str(value or "")))
+    except ValueError:
+        return None
+
+def _parse_date(value, formats: list) -> date | None:
+    """Parse with the first format that fits, moving it to the front for the next row."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or "").strip()
+    for position, fmt in enumerate(formats):
+        try:
+            parsed = datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+        if position:
+            formats.insert(0, formats.pop(position))
+        return parsed
+    return None
+
+def _text(value) -> str | None:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+def parse_line(line_number: int, raw: dict, date_formats: list) -> dict:
+    """Turn a raw statement row into ``statement_lines`` column values."""
+    return {
+        "line_number": line_number,
+        "transaction_id": _text(raw.get("transaction_id")),
+        "transaction_date": _parse_date(raw.get("transaction_date"), date_formats),
+        "amount": _parse_amount(raw.get("amount")),
+        "reference": _text(raw.get("reference")),
+        "phone": normalize_phone(raw.get("phone")),
+        "payer_name": _text(raw.get("payer_name")),
+    }
+
+class MatchIndex:
+    """Hash indexes over open invoices, built with three queries per import."""
+
+    def __init__(self, db: Session, source: str):
+        self.db = db
+        self.source = source
+        self.invoices = {}                     # invoice id -> Invoice
+        self.remaining = {}                    # invoice id -> balance not yet matched
+        self.by_invoice_number = {}            # open invoice number -> invoice id
+        self.by_admission = {}                 # admission number -> student id
+        self.by_student = defaultdict(list)    # student id -> open invoice ids, oldest due first
+        self.by_phone = defaultdict(set)       # guardian phone -> student ids
+        self._recorded = {}                    # day -> {amount: [recorded payment]}
+
+        invoices = db.query(Invoice).filter(Invoice.status.in_(OPEN_STATUSES)).order_by(Invoice.due_date, Invoice.id)
+        for invoice in invoices:
+            self.invoices[invoice.id] = invoice
+            self.remaining[invoice.id] = ledger.invoice_balance(invoice)
+            self.by_invoice_number[invoice.invoice_number.upper()] = invoice.id
+            self.by_student[invoice.student_id].append(invoice.id)
+
+        for student_id, admission_number in db.query(Student.id, Student.admission_number):
+            if admission_number:
+                self.by_admission[admission_number.upper()] = student_id
+        for student_id, phone in db.query(student_guardians.c.student_id, Guardian.phone).join(
+            Guardian, Guardian.id == student_guardians.c.guardian_id
+        ):
+            phone = normalize_phone(phone)
+            if phone:
+                self.by_phone[phone].add(student_id)
+
+    def _recorded_on(self, day: date) -> dict:
+        """Hand-recorded payments for this method and day that no statement line claims yet."""
+        if day not in self._recorded:
+            claimed = select(StatementLine.payment_id).where(StatementLine.payment_id.isnot(None))
+            rows = self.db.query(
+                Payment.id, Payment.amount, Payment.invoice_id, Invoice.invoice_number, Invoice.student_id
+            ).join(
+                Invoice, Payment.invoice_id == Invoice.id
+            ).filter(
+                Payment.payment_method == self.source,
+                Payment.payment_date == day,
+                Payment.id.notin_(claimed)
+            ).order_by(Payment.id)
+            by_amount = defaultdict(list)
+            for row in rows:
+                by_amount[round(row.amount, 2)].append(row)
+            self._recorded[day] = by_amount
+        return self._recorded[day]
+
+    def _take_recorded(self, line: dict, tokens: set, students: set):
+        """Claim a hand-recorded payment of the same amount and day, if one fits this line."""
+        bucket = self._recorded_on(line["transaction_date"]).get(round(line["amount"], 2), [])
+        for position, payment in enumerate(bucket):
+            if payment.student_id in students or payment.invoice_number.upper() in tokens:
+                return bucket.pop(position)
+        if not students and len(bucket) == 1:
+            return bucket.pop()
+        return None
+
+    def _candidates(self, line: dict, tokens: set):
+        """Rule, candidate open invoice ids and the students the line points at."""
+        invoice_ids = [self.by_invoice_number[token] for token in tokens if token in self.by_invoice_number]
+        students = {self.by_admission[token] for token in tokens if token in self.by_admission}
+        if invoice_ids or students:
+            invoice_ids += [invoice_id for student_id in sorted(students) for invoice_id in self.by_student[student_id]]
+            students |= {self.invoices[invoice_id].student_id for invoice_id in invoice_ids}
+            return "reference", list(dict.fromkeys(invoice_ids)), students
+        students = self.by_phone.get(line["phone"], set())
+        if students:
+            return "phone", [invoice_id for student_id in sorted(students) for invoice_id in self.by_student[student_id]], students
+        return None, [], set()
+
+    def match(self, line: dict) -> dict:
+        """Classify a parsed credit line and reserve its amount against an invoice."""
+        tokens = set(re.findall(r"[A-Z0-9-]+", (line["reference"] or "").upper()))
+        rule, candidates, students = self._candidates(line, tokens)
+
+        recorded = self._take_recorded(line, tokens, students)
+        if recorded:
+            return {"status": StatementLineStatus.MATCHED, "match_rule": rule or "amount_date",
+                    "invoice_id": recorded.invoice_id, "payment_id": recorded.id, "note": "Already recorded"}
+
+        amount = line["amount"]
+        open_candidates = [invoice_id for invoice_id in candidates if self.remaining[invoice_id] > 0.005]
+        if not open_candidates:
+            note = "No matching open invoice" if not candidates else "Matched invoices are already paid"
+            return {"status": StatementLineStatus.REVIEW, "match_rule": rule, "note": note,
+                    "invoice_id": candidates[0] if candidates else None}
+
+        exact = [invoice_id for invoice_id in open_candidates if abs(self.remaining[invoice_id] - amount) < 0.005]
+        fits = exact or [invoice_id for invoice_id in open_candidates if self.remaining[invoice_id] >= amount - 0.005]
+        if not fits:
+            return {"status": StatementLineStatus.REVIEW, "match_rule": rule, "invoice_id": open_candidates[0],
+                    "note": "Amount exceeds the open balance"}
+
+        self.remaining[fits[0]] -= amount
+        return {"status": StatementLineStatus.MATCHED, "match_rule": rule, "invoice_id": fits[0]}
+
+def _batches(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def import_statement(db: Session, fileobj, filename: str, source: str, user_id: int | None = None,
+                     batch_size: int = 500) -> StatementImport:
+    """Read, match and post a statement file in one transaction."""
+    statement = StatementImport(source=source, filename=filename, imported_by=user_id)
+    db.add(statement)
+    db.flush()
+
+    index = MatchIndex(db, source)
+    counts = defaultdict(int)
+    matched_amount = 0.0
+    seen = set()
+    date_formats = list(DATE_FORMATS)
+
+    for batch in _batches(read_statement(fileobj, filename), batch_size):
+        lines = [parse_line(line_number, raw, date_formats) for line_number, raw in batch]
+        transaction_ids = {line["transaction_id"] for line in lines if line["transaction_id"]}
+        if transaction_ids:
+            seen.update(row[0] for row in db.query(StatementLine.transaction_id).filter(
+                StatementLine.source == source, StatementLine.transaction_id.in_(transaction_ids)
+            ))
+
+        to_post = []
+        for line in lines:
+            line.update(import_id=statement.id, source=source)
+            if line["transaction_id"] and line["transaction_id"] in seen:
+                line.update(status=StatementLineStatus.DUPLICATE, note="Transaction already imported")
+            elif line["amount"] is None or line["transaction_date"] is None:
+                line.update(status=StatementLineStatus.REVIEW, note="Could not read the amount or date")
+            elif line["amount"] <= 0:
+                line.update(status=StatementLineStatus.IGNORED, note="Not a credit")
+            else:
+                line.update(index.match(line))
+                if line["status"] == StatementLineStatus.MATCHED:
+                    matched_amount += line["amount"]
+                    if not line.get("payment_id"):
+                        to_post.append(line)
+            if line["transaction_id"]:
+                seen.add(line["transaction_id"])
+            counts[line["status"]] += 1
+
+        posted = payments.post_payments(db, [
+            (index.invoices[line["invoice_id"]], line["amount"], line["transaction_date"]) for line in to_post
+        ], source, user_id)
+        for line, payment in zip(to_post, posted):
+            line["payment_id"] = payment.id
+        db.execute(insert(StatementLine.__table__), [{
+            "payment_id": None, "invoice_id": None, "match_rule": None, "note": None, **line
+        } for line in lines])
+
+    statement.line_count = sum(counts.values())
+    statement.matched_count = counts[StatementLineStatus.MATCHED]
+    statement.review_count = counts[StatementLineStatus.REVIEW]
+    statement.ignored_count = counts[StatementLineStatus.IGNORED]
+    statement.duplicate_count = counts[StatementLineStatus.DUPLICATE]
+    statement.matched_amount = round(matched_amount, 2)
+    db.commit()
+    db.refresh(statement)
+    return statement
+
+def _close_review_line(db: Session, line: StatementLine, status: StatementLineStatus, user_id: int | None) -> None:
+    line.status = status
+    line.resolved_by = user_id
+    line.resolved_at = datetime.now()
+    db.execute(
+        update(StatementImport)
+        .where(StatementImport.id == line.import_id)
+        .values(review_count=StatementImport.review_count - 1)
+    )
+
+def resolve_line(db: Session, line: StatementLine, invoice: Invoice, user_id: int | None = None) -> Payment:
+    """Post a review-queue line against the invoice an accountant picked."""
+    if line.status != StatementLineStatus.REVIEW:
+        raise ValueError("Statement line is not waiting for review")
+    if not line.amount or line.amount <= 0:
+        raise ValueError("Statement line has no amount to post")
+    if invoice.status not in OPEN_STATUSES:
+        raise ValueError("Invoice is not open")
+    if line.amount > ledger.invoice_balance(invoice) + 0.005:
+        raise ValueError("Payment amount exceeds remaining balance")
+
+    payment, = payments.post_payments(db, [(invoice, line.amount, line.transaction_date)], line.source, user_id)
+    line.invoice_id = invoice.id
+    line.payment_id = payment.id
+    _close_review_line(db, line, StatementLineStatus.RESOLVED, user_id)
+    db.commit()
+    return payment
+
+def ignore_line(db: Session, line: StatementLine, note: str | None = None, user_id: int | None = None) -> None:
+    if line.status != StatementLineStatus.REVIEW:
+        raise ValueError("Statement line is not waiting for review")
+    if note:
+        line.note = note
+    _close_review_line(db, line, StatementLineStatus.IGNORED, user_id)
+    db.commit()
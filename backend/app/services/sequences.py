@@ -0,0 +1,61 @@
+"""Concurrency-safe document numbers (invoices, receipts, admission numbers).
+
+Numbers come from a counter row per document type and year that is bumped
+with a single ``UPDATE ... RETURNING``, so concurrent writers never hand out
+the same number and no scan of the numbered table is needed. Bulk jobs
+reserve a whole block in that one statement.
+"""
+from datetime import date
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+from ..core.database import dialect_insert
+from ..models.document_sequence import DocumentSequence
+from ..models.fee import Invoice, Payment
+from ..models.student import Student
+
+# doc_type -> (numbered column, prefix template, zero-padded width)
+DOCUMENT_FORMATS = {
+    "invoice": (Invoice.invoice_number, "INV-{year}-", 5),
+    "receipt": (Payment.receipt_number, "RCP-{year}-", 5),
+    "admission": (Student.admission_number, "FBS{year}", 4),
+}
+
+def format_number(doc_type: str, year: int, value: int) -> str:
+    _, prefix, width = DOCUMENT_FORMATS[doc_type]
+    return f"{prefix.format(year=year)}{value:0{width}d}"
+
+def _highest_issued(db: Session, doc_type: str, year: int) -> int:
+    """Largest number already issued for the year, so new counters continue after legacy data."""
+    column, prefix, width = DOCUMENT_FORMATS[doc_type]
+    prefix = prefix.format(year=year)
+    highest = db.query(func.max(column)).filter(
+        column.like(f"{prefix}%"), func.length(column) == len(prefix) + width
+    ).scalar()
+    return int(highest[len(prefix):]) if highest else 0
+
+def reserve_block(db: Session, doc_type: str, count: int, year: int | None = None) -> list[str]:
+    """Reserve ``count`` consecutive numbers and return them formatted."""
+    if count <= 0:
+        return []
+    year = year or date.today().year
+    bump = (
+        update(DocumentSequence)
+        .where(DocumentSequence.doc_type == doc_type, DocumentSequence.year == year)
+        .values(last_value=DocumentSequence.last_value + count)
+        .returning(DocumentSequence.last_value)
+        .execution_options(synchronize_session=False)
+    )
+    last_value = db.execute(bump).scalar()
+    if last_value is None:
+        # First number of the year for this type: create the counter, then bump it
+        db.execute(
+            dialect_insert(db.get_bind(), DocumentSequence.__table__)
+            .values(doc_type=doc_type, year=year, last_value=_highest_issued(db, doc_type, year))
+            .on_conflict_do_nothing(index_elements=["doc_type", "year"])
+        )
+        last_value = db.execute(bump).scalar()
+    first = last_value - count + 1
+    return [format_number(doc_type, year, value) for value in range(first, last_value + 1)]
+
+def next_number(db: Session, doc_type: str, year: int | None = None) -> str:
+    return reserve_block(db, doc_type, 1, year)[0]
@@ -0,0 +1,180 @@
+"""Student prepaid wallets for canteen and other service purchases.
+
+Balances only ever move through a single conditional ``UPDATE ... RETURNING``:
+top-ups add to the balance, and debits subtract only ``WHERE balance >=
+amount``, so two serving points charging the same student at once can
+never overdraw the wallet and no balance is read before it is written.
+Every movement is appended to ``wallet_transactions`` with the balance it
+left behind.
+
+Serving-point devices queue purchases offline and post them in batches.
+Each purchase carries a client-generated ``reference``; references already
+recorded are reported as duplicates, so replaying a batch is safe. The
+reference is claimed before the balance moves: the transaction row is
+inserted first with ``ON CONFLICT (reference) DO NOTHING ... RETURNING``,
+and only the rows that came back move a balance. Two replays of the same
+batch racing each other therefore charge once, and the loser sees
+duplicates rather than a unique-key error.
+"""
+from sqlalchemy import bindparam, delete, func, insert, update
+from sqlalchemy.orm import Session
+from ..core.database import dialect_insert
+from ..models.fee import ServiceItem, Wallet, WalletTransaction, WalletTransactionType
+
+MAX_BATCH = 1000
+
+def _claim(db: Session, rows: list[dict]) -> dict:
+    """Insert transaction rows whose ``reference`` is not taken yet; ``{reference: id}`` of those inserted."""
+    if not rows:
+        return {}
+    statement = dialect_insert(db.get_bind(), WalletTransaction.__table__).values(rows)
+    return {row.reference: row.id for row in db.execute(
+        statement.on_conflict_do_nothing(index_elements=["reference"]).returning(WalletTransaction.id, WalletTransaction.reference)
+    )}
+
+def _settle(db: Session, balances: list[dict]) -> None:
+    """Write the balance each claimed row left behind (``{"b_id", "b_balance"}``)."""
+    if balances:
+        db.execute(update(WalletTransaction.__table__).where(WalletTransaction.id == bindparam("b_id")).values(
+            balance_after=bindparam("b_balance")
+        ), balances)
+
+def top_up(db: Session, student_id: int, amount: float, payment_method: str, reference: str | None = None,
+           user_id: int | None = None) -> WalletTransaction:
+    """Credit a wallet, opening it on the first top-up; a repeated ``reference`` returns the original."""
+    if amount <= 0:
+        raise ValueError("Amount must be positive")
+
+    db.execute(dialect_insert(db.get_bind(), Wallet.__table__).values(student_id=student_id, balance=0.0)
+               .on_conflict_do_nothing(index_elements=["student_id"]))
+    wallet_id = db.query(Wallet.id).filter(Wallet.student_id == student_id).scalar()
+    row = {
+        "wallet_id": wallet_id, "student_id": student_id, "transaction_type": WalletTransactionType.TOP_UP,
+        "amount": amount, "balance_after": 0.0, "service_item_id": None, "quantity": 1, "payment_method": payment_method,
+        "reference": reference, "description": "Top-up", "recorded_by": user_id
+    }
+    if reference:
+        transaction_id = _claim(db, [row]).get(reference)
+        if transaction_id is None:
+            db.rollback()
+            return db.query(WalletTransaction).filter(WalletTransaction.reference == reference).one()
+    else:
+        transaction_id = db.execute(insert(WalletTransaction.__table__).values(row).returning(WalletTransaction.id)).scalar()
+
+    balance = db.execute(
+        update(Wallet).where(Wallet.id == wallet_id)
+        .values(balance=func.coalesce(Wallet.balance, 0) + amount, last_top_up=func.now())
+        .returning(Wallet.balance)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    _settle(db, [{"b_id": transaction_id, "b_balance": balance}])
+    db.commit()
+    return db.get(WalletTransaction, transaction_id)
+
+def debit_batch(db: Session, items: list[dict], user_id: int | None = None) -> list[dict]:
+    """Post queued purchases in one transaction and report the outcome of each.
+
+    Each item has ``student_id`` and either ``service_item_id`` (with an
+    optional ``quantity``) or an explicit ``amount``, plus an optional
+    ``reference``. Outcomes: ``debited``, ``duplicate``, ``insufficient_funds``,
+    ``no_wallet`` or ``invalid``.
+    """
+    if len(items) > MAX_BATCH:
+        raise ValueError(f"At most {MAX_BATCH} debits per batch")
+    item_ids = {item["service_item_id"] for item in items if item.get("service_item_id")}
+    services = {s.id: s for s in db.query(ServiceItem).filter(ServiceItem.id.in_(item_ids), ServiceItem.is_active == True)} \
+        if item_ids else {}
+    student_ids = {item["student_id"] for item in items if item.get("student_id")}
+    wallet_ids = dict(db.query(Wallet.student_id, Wallet.id).filter(Wallet.student_id.in_(student_ids))) \
+        if student_ids else {}
+
+    results, debits, seen = [], [], set()
+    for item in items:
+        reference = item.get("reference")
+        result = {"reference": reference, "student_id": item.get("student_id")}
+        results.append(result)
+        if reference and reference in seen:
+            result["status"] = "duplicate"
+            continue
+
+        service = services.get(item.get("service_item_id"))
+        try:
+            quantity = int(item.get("quantity") or 1)
+            amount = round(service.unit_price * quantity if service else float(item.get("amount") or 0), 2)
+        except (TypeError, ValueError):
+            quantity, amount = 0, 0
+        if not item.get("student_id") or quantity <= 0 or amount <= 0 or (item.get("service_item_id") and not service):
+            result["status"] = "invalid"
+            continue
+        if item["student_id"] not in wallet_ids:
+            result.update(status="no_wallet", balance=None)
+            continue
+
+        if reference:
+            seen.add(reference)
+        debits.append((result, {
+            "wallet_id": wallet_ids[item["student_id"]], "student_id": item["student_id"],
+            "transaction_type": WalletTransactionType.DEBIT, "amount": amount, "balance_after": 0.0,
+            "service_item_id": service.id if service else None, "quantity": quantity, "payment_method": None,
+            "reference": reference, "description": service.name if service else item.get("description"),
+            "recorded_by": user_id
+        }))
+
+    # Claim the references first; only the rows inserted here may move a balance
+    claimed = _claim(db, [row for _, row in debits if row["reference"]])
+    balances, unclaimed, rows = [], [], []
+    for result, row in debits:
+        if row["reference"] and row["reference"] not in claimed:
+            result["status"] = "duplicate"
+            continue
+        debited = db.execute(
+            update(Wallet).where(Wallet.id == row["wallet_id"], Wallet.balance >= row["amount"])
+            .values(balance=Wallet.balance - row["amount"])
+            .returning(Wallet.balance)
+            .execution_options(synchronize_session=False)
+        ).scalar()
+        if debited is None:
+            balance = db.query(Wallet.balance).filter(Wallet.id == row["wallet_id"]).scalar()
+            result.update(status="insufficient_funds", balance=balance)
+            if row["reference"]:
+                unclaimed.append(claimed[row["reference"]])
+            continue
+
+        result.update(status="debited", amount=row["amount"], balance=debited)
+        if row["reference"]:
+            balances.append({"b_id": claimed[row["reference"]], "b_balance": debited})
+        else:
+            rows.append({**row, "balance_after": debited})
+    _settle(db, balances)
+    if unclaimed:  # a declined purchase may be retried under the same reference once topped up
+        db.execute(delete(WalletTransaction).where(WalletTransaction.id.in_(unclaimed)))
+    if rows:
+        db.execute(insert(WalletTransaction.__table__), rows)
+    db.commit()
+    return results
+
+def statement(db: Session, student_id: int, cursor: int | None = None, limit: int = 50) -> dict:
+    """Balance and transactions newest first, paged by transaction id."""
+    wallet = db.query(Wallet).filter(Wallet.student_id == student_id).first()
+    if not wallet:
+        return {"balance": 0.0, "last_top_up": None, "transactions": [], "next_cursor": None}
+    query = db.query(WalletTransaction).filter(WalletTransaction.wallet_id == wallet.id)
+    if cursor:
+        query = query.filter(WalletTransaction.id < cursor)
+    transactions = query.order_by(WalletTransaction.id.desc()).limit(limit).all()
+    return {
+        "balance": wallet.balance,
+        "last_top_up": str(wallet.last_top_up) if wallet.last_top_up else None,
+        "transactions": [{
+            "id": t.id,
+            "type": t.transaction_type.value,
+            "amount": t.amount,
+            "balance_after": t.balance_after,
+            "description": t.description,
+            "quantity": t.quantity,
+            "payment_method": t.payment_method,
+            "reference": t.reference,
+            "date": str(t.created_at) if t.created_at else None
+        } for t in transactions],
+        "next_cursor": transactions[-1].id if len(transactions) == limit else None
+    }
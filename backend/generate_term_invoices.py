@@ -0,0 +1,30 @@
+import argparse
+from datetime import datetime
+from app.core.database import SessionLocal, Base, engine
+from app.models import *
+from app.services.invoicing import generate_term
+
+# Create every invoice a term needs from the active fee structures (safe to rerun)
+parser = argparse.ArgumentParser(description="Generate term invoices from fee structures")
+parser.add_argument("term", help="e.g. term_1")
+parser.add_argument("--due-date", help="YYYY-MM-DD")
+parser.add_argument("--class-id", type=int)
+parser.add_argument("--dry-run", action="store_true", help="only print totals per class and category")
+args = parser.parse_args()
+
+Base.metadata.create_all(bind=engine)
+
+db = SessionLocal()
+try:
+    due_date = datetime.strptime(args.due_date, "%Y-%m-%d").date() if args.due_date else None
+    result = generate_term(db, args.term, due_date, args.class_id, dry_run=args.dry_run)
+    for row in result["by_class"]:
+        print(f"{row['class_name'] or 'No class':<12} {row['category']:<16} {row['invoices']:>5} {row['total']:>14,.0f}")
+    print(f"{result['invoices']} invoices, {result['total']:,.0f} total, {result['already_invoiced']} already invoiced")
+    if not args.dry_run:
+        print(f"Created {result['created']} invoices")
+except Exception as e:
+    print(f"Error: {e}")
+    db.rollback()
+finally:
+    db.close()
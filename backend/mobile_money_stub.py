@@ -0,0 +1,28 @@
+import argparse
+import httpx
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import *
+from app.models.mobile_money import MobileMoneyStatus
+from app.services.mobile_money import stub_callback
+
+# Local stand-in for the providers: replays callbacks for pending transactions against the API
+parser = argparse.ArgumentParser(description="Replay mobile-money callbacks for pending transactions")
+parser.add_argument("--url", default="http://localhost:8001/api/mobile-money/callback")
+parser.add_argument("--fail", action="store_true", help="report the transactions as failed")
+parser.add_argument("--repeat", type=int, default=1, help="send each callback this many times")
+args = parser.parse_args()
+
+db = SessionLocal()
+try:
+    pending = db.query(MobileMoneyTransaction).filter(MobileMoneyTransaction.status == MobileMoneyStatus.PENDING).all()
+    status = MobileMoneyStatus.FAILED if args.fail else MobileMoneyStatus.SUCCESSFUL
+    headers = {"X-Callback-Token": settings.MOBILE_MONEY_CALLBACK_TOKEN}
+    with httpx.Client() as client:
+        for transaction in pending:
+            for _ in range(args.repeat):
+                response = client.post(f"{args.url}/{transaction.provider}", json=stub_callback(transaction, status), headers=headers)
+                print(f"{transaction.external_id} {transaction.provider} {transaction.amount}: {response.status_code}")
+    print(f"Replayed callbacks for {len(pending)} pending transactions")
+finally:
+    db.close()
@@ -0,0 +1,22 @@
+import time
+from app.core.database import SessionLocal, Base, engine
+from app.models import *
+from app.services.mobile_money import process_callbacks
+
+# Drain queued mobile-money callbacks into payments; run alongside the API during fee deadlines
+Base.metadata.create_all(bind=engine)
+
+db = SessionLocal()
+try:
+    while True:
+        try:
+            if not process_callbacks(db):
+                time.sleep(2)
+        except Exception as e:
+            print(f"Error: {e}")
+            db.rollback()
+            time.sleep(2)
+except KeyboardInterrupt:
+    print("Mobile money worker stopped")
+finally:
+    db.close()
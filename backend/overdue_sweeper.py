@@ -0,0 +1,20 @@
+from app.core.database import SessionLocal, Base, engine
+from app.models import *
+from app.services.documents import prune
+from app.services.overdue import sweep
+
+# Daily job (cron): mark overdue invoices and raise late fees, then prune the PDF cache; safe to rerun
+Base.metadata.create_all(bind=engine)
+
+db = SessionLocal()
+try:
+    run = sweep(db)
+    print(f"Marked {run.marked_overdue} invoices overdue, raised {run.late_fee_count} late fees ({run.late_fee_total:,.0f})")
+except Exception as e:
+    print(f"Error: {e}")
+    db.rollback()
+finally:
+    db.close()
+
+files, size = prune()
+print(f"Pruned {files} cached documents ({size / 1024 / 1024:,.1f} MB)")
@@ -0,0 +1,15 @@
+from app.core.database import SessionLocal, Base, engine
+from app.models import *
+from app.services.periods import ensure_closed
+
+# Daily job (cron): close every ended month into the period snapshots; safe to rerun
+Base.metadata.create_all(bind=engine)
+
+db = SessionLocal()
+try:
+    print(f"Closed {ensure_closed(db)} financial periods")
+except Exception as e:
+    print(f"Error: {e}")
+    db.rollback()
+finally:
+    db.close()
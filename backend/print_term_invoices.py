@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import shutil
+from app.core.database import SessionLocal, Base, engine
+from app.models import *
+from app.services import documents
+
+# Render every open invoice of a term (optionally one class) into one PDF or a zip of single PDFs
+def main():
+    parser = argparse.ArgumentParser(description="Print term invoices as PDF")
+    parser.add_argument("term", help="e.g. term_1")
+    parser.add_argument("--class-id", type=int)
+    parser.add_argument("--zip", action="store_true", help="one PDF per invoice in a zip instead of one merged PDF")
+    parser.add_argument("--output", help="copy the result here")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    try:
+        docs = documents.invoice_documents(db, class_id=args.class_id, term=args.term)
+    finally:
+        db.close()
+    if not docs:
+        print("No invoices to print")
+        return
+    if args.zip:
+        path = asyncio.run(documents.render_zip("invoice", docs, [doc["number"] for doc in docs]))
+    else:
+        path = asyncio.run(documents.render("invoice", docs))
+    documents.shutdown()
+    if args.output:
+        path = shutil.copyfile(path, args.output)
+    print(f"{len(docs)} invoices written to {path}")
+
+if __name__ == "__main__":  # the render pool re-imports this module on platforms that spawn workers
+    main()
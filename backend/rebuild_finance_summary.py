@@ -0,0 +1,16 @@
+from app.core.database import SessionLocal, Base, engine
+from app.models import *
+from app.services.finance_summary import rebuild_finance_summary
+
+# Recompute the finance_summary rollup from invoices and payments (drift repair)
+Base.metadata.create_all(bind=engine)
+
+db = SessionLocal()
+try:
+    rebuild_finance_summary(db)
+    print("Finance summary rebuilt successfully!")
+except Exception as e:
+    print(f"Error: {e}")
+    db.rollback()
+finally:
+    db.close()
@@ -0,0 +1,155 @@
+import asyncio
+import csv
+import io
+import pytest
+from datetime import date, datetime
+from openpyxl import load_workbook
+from sqlalchemy.orm import sessionmaker
+from app.api import accountant
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.models.user import UserRole
+from app.services import finance_summary, invoicing, ledger
+
+@pytest.fixture
+def user(db):
+    user = User(id=1, email="accounts@fbs.test", hashed_password="x", full_name="Accounts", role=UserRole.ACCOUNTANT)
+    db.add_all([user,
+                Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P1 B", grade_level="P1", academic_year="2024"),
+                Class(id=3, name="P2 A", grade_level="P2", academic_year="2024")])
+    for n, class_id in ((1, 1), (2, 1), (3, 2), (4, None)):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=class_id,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.commit()
+    return user
+
+def add_invoice(db, n, student_id, amount, paid=0, category=PaymentCategory.TUITION, term="term_1", status=InvoiceStatus.PENDING,
+                due_date=None):
+    db.add(Invoice(id=n, invoice_number=f"INV-{n:03d}", student_id=student_id, category=category, term=term,
+                   amount=amount, amount_paid=paid, status=status, due_date=due_date))
+
+def list_invoices(db, user, **filters):
+    params = {"status": None, "class_id": None, "term": None, "category": None, "due_from": None, "due_to": None,
+              "cursor": None, "limit": 50, **filters}
+    return asyncio.run(accountant.get_all_invoices(**params, db=db, user=user))
+
+def test_invoice_listing_pages_by_keyset_cursor(db, user):
+    categories = list(PaymentCategory)
+    for n in range(1, 8):
+        add_invoice(db, n, student_id=n % 4 + 1, amount=1000 * n, category=categories[n],
+                    term="term_1" if n % 2 else "term_2")
+    db.commit()
+
+    pages, cursor = [], None
+    while True:
+        page = list_invoices(db, user, cursor=cursor, limit=3)
+        pages.append([item["id"] for item in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    # Newest first, each cursor is the last id shown, and the final page has no cursor
+    assert pages == [[7, 6, 5], [4, 3, 2], [1]]
+
+    # A page that exactly fills the limit does not promise another one
+    page = list_invoices(db, user, cursor=4, limit=3)
+    assert [item["id"] for item in page["items"]] == [3, 2, 1] and page["next_cursor"] is None
+    assert list_invoices(db, user, cursor=1, limit=3) == {"items": [], "next_cursor": None}
+    assert list_invoices(db, user, limit=7)["next_cursor"] is None
+
+    # Filters apply before the page is cut
+    page = list_invoices(db, user, term="term_1", limit=2)
+    assert [item["id"] for item in page["items"]] == [7, 5] and page["next_cursor"] == 5
+    page = list_invoices(db, user, term="term_1", cursor=5, limit=2)
+    assert [item["id"] for item in page["items"]] == [3, 1] and page["next_cursor"] is None
+
+    item = list_invoices(db, user, class_id=2, limit=1)["items"][0]
+    assert (item["id"], item["student_name"], item["class"], item["balance"]) == (6, "S3 L", "P1 B", 6000)
+
+def test_bulk_invoices_skip_students_already_billed(db, user):
+    add_invoice(db, 1, student_id=2, amount=80000)
+    db.commit()
+    bulk = {"class_id": 1, "category": "tuition", "term": "term_1", "amount": 90000, "due_date": "2024-02-15"}
+
+    result = asyncio.run(accountant.create_bulk_invoices(bulk, db=db, user=user))
+    assert (result["created"], result["skipped"]) == (1, 1)
+    assert db.query(Invoice.amount).filter(Invoice.student_id == 2).scalar() == 80000
+    new = db.query(Invoice).filter(Invoice.student_id == 1).one()
+    assert (new.amount, new.created_by, new.due_date.date()) == (90000, user.id, date(2024, 2, 15))
+    assert ledger.balance(db, 1) == 90000
+
+    # Rerunning is a no-op, and a whole-school run only bills the students still missing one
+    assert asyncio.run(accountant.create_bulk_invoices(bulk, db=db, user=user))["created"] == 0
+    result = asyncio.run(accountant.create_bulk_invoices({**bulk, "class_id": None}, db=db, user=user))
+    assert (result["created"], result["skipped"]) == (2, 2)
+    assert db.query(Invoice).count() == 4
+    assert finance_summary.load_finance_summary(db)["overall"].total_invoiced == 80000 + 3 * 90000
+
+def test_invoice_inserts_do_nothing_on_duplicates(db, user):
+    # Rows the probe missed (a concurrent run, or repeats in one batch) fall to ON CONFLICT DO NOTHING
+    add_invoice(db, 1, student_id=2, amount=80000)
+    db.commit()
+    rows = [{"student_id": s, "category": PaymentCategory.TUITION, "term": "term_1", "amount": 90000} for s in (1, 2, 1, 3)]
+
+    assert invoicing.create_invoices(db, rows, user.id) == 2
+    db.commit()
+    assert sorted(db.query(Invoice.student_id, Invoice.amount).all()) == [(1, 90000), (2, 80000), (3, 90000)]
+    assert ledger.balance(db, 1) == 90000 and ledger.balance(db, 2) == 80000
+    assert invoicing.create_invoices(db, rows, user.id) == 0
+
+def test_collection_rate_folds_classes_into_grades(db, user):
+    add_invoice(db, 1, student_id=1, amount=100000, paid=60000)
+    add_invoice(db, 2, student_id=2, amount=30000, paid=30000, category=PaymentCategory.LUNCH, status=InvoiceStatus.PAID)
+    add_invoice(db, 3, student_id=3, amount=50000)
+    add_invoice(db, 4, student_id=3, amount=40000, paid=40000, term="term_2", status=InvoiceStatus.PAID)
+    add_invoice(db, 5, student_id=4, amount=10000)  # no class, so in neither list
+    db.commit()
+
+    def rates(**filters):
+        report = asyncio.run(accountant.get_collection_rate(**{"term": None, "category": None, **filters}, db=db, user=user))
+        return ([(r["class"], r["grade_level"], r["total_invoiced"], r["total_collected"], r["outstanding"], r["collection_rate"])
+                 for r in report["classes"]],
+                [(r["grade_level"], r["total_invoiced"], r["total_collected"], r["collection_rate"]) for r in report["by_grade"]])
+
+    # Classes with no invoices keep a zero row, and grades sum their classes before the rate is taken
+    assert rates() == ([("P1 A", "P1", 130000, 90000, 40000, 69.2), ("P1 B", "P1", 90000, 40000, 50000, 44.4),
+                        ("P2 A", "P2", 0, 0, 0, 0)],
+                       [("P1", 220000, 130000, 59.1), ("P2", 0, 0, 0)])
+    assert rates(term="term_1") == ([("P1 A", "P1", 130000, 90000, 40000, 69.2), ("P1 B", "P1", 50000, 0, 50000, 0.0),
+                                     ("P2 A", "P2", 0, 0, 0, 0)],
+                                    [("P1", 180000, 90000, 50.0), ("P2", 0, 0, 0)])
+    classes, by_grade = rates(category="lunch")
+    assert [row[2:] for row in classes] == [(30000, 30000, 0, 100.0), (0, 0, 0, 0), (0, 0, 0, 0)]
+    assert by_grade == [("P1", 30000, 30000, 100.0), ("P2", 0, 0, 0)]
+
+    with pytest.raises(accountant.HTTPException) as exc:
+        rates(category="books")
+    assert exc.value.status_code == 400
+
+def test_outstanding_export_streams_unpaid_invoices(db, user, monkeypatch):
+    add_invoice(db, 1, student_id=1, amount=100000, paid=60000, due_date=datetime(2024, 2, 15))
+    add_invoice(db, 2, student_id=2, amount=30000, paid=30000, status=InvoiceStatus.PAID)
+    add_invoice(db, 3, student_id=4, amount=50000, category=PaymentCategory.LUNCH)
+    db.commit()
+    # The row generator opens its own session once the response starts streaming
+    monkeypatch.setattr(accountant, "SessionLocal", sessionmaker(bind=db.get_bind()))
+
+    async def download(format):
+        response = await accountant.export_outstanding_report(format=format, user=user)
+        return response, b"".join([chunk if isinstance(chunk, bytes) else chunk.encode() async for chunk in response.body_iterator])
+
+    response, body = asyncio.run(download("csv"))
+    assert response.media_type == "text/csv"
+    assert response.headers["content-disposition"] == f'attachment; filename="outstanding-fees-{date.today().isoformat()}.csv"'
+    assert list(csv.reader(io.StringIO(body.decode()))) == [
+        ["Student", "Class", "Invoice", "Category", "Amount", "Paid", "Balance", "Due Date"],
+        ["S1 L", "P1 A", "INV-001", "tuition", "100000.0", "60000.0", "40000.0", "2024-02-15"],
+        ["S4 L", "N/A", "INV-003", "lunch", "50000.0", "0", "50000.0", ""]]
+
+    response, body = asyncio.run(download("xlsx"))
+    assert response.headers["content-disposition"].endswith('.xlsx"')
+    sheet = load_workbook(io.BytesIO(body))["Outstanding Fees"]
+    rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+    assert rows[0] == ["Student", "Class", "Invoice", "Category", "Amount", "Paid", "Balance", "Due Date"]
+    assert rows[1][:7] == ["S1 L", "P1 A", "INV-001", "tuition", 100000, 60000, 40000] and rows[1][7].date() == date(2024, 2, 15)
+    assert rows[2] == ["S4 L", "N/A", "INV-003", "lunch", 50000, 0, 50000, None]
@@ -0,0 +1,46 @@
+import pytest
+from datetime import date, datetime, timedelta
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import aging, overdue
+
+def test_aging_buckets_by_class_category_and_student(db):
+    today = date(2024, 6, 30)
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024"),
+                SchoolSettings(late_fee_percentage=0)])
+    for n in (1, 2):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=n,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    # (student, category, days past due or None, amount, paid, status)
+    invoices = [(1, PaymentCategory.TUITION, None, 100, 0, InvoiceStatus.PENDING),
+                (1, PaymentCategory.LUNCH, 0, 50, 10, InvoiceStatus.PARTIAL),
+                (1, PaymentCategory.TRANSPORT, 30, 30, 0, InvoiceStatus.PENDING),
+                (2, PaymentCategory.TUITION, 31, 200, 0, InvoiceStatus.OVERDUE),
+                (2, PaymentCategory.LUNCH, 90, 40, 0, InvoiceStatus.OVERDUE),
+                (2, PaymentCategory.TRANSPORT, 91, 70, 20, InvoiceStatus.PARTIAL),
+                (2, PaymentCategory.UNIFORM, 200, 80, 80, InvoiceStatus.PAID),
+                (2, PaymentCategory.TRIP, 200, 60, 0, InvoiceStatus.CANCELLED)]
+    for n, (student_id, category, days, amount, paid, status) in enumerate(invoices, 1):
+        due = datetime.combine(today - timedelta(days=days), datetime.min.time()) + timedelta(hours=9) if days is not None else None
+        db.add(Invoice(invoice_number=f"INV-{n}", student_id=student_id, category=category, term="term_1",
+                       amount=amount, amount_paid=paid, status=status, due_date=due))
+    db.commit()
+
+    report = aging.report(db, today)
+    assert {k: report["totals"][k] for k in (*aging.BUCKETS, "total", "invoice_count")} == {
+        "current": 140, "0_30": 30, "31_60": 200, "61_90": 40, "90_plus": 50, "total": 460, "invoice_count": 6
+    }
+    assert {c["class"]: c["total"] for c in report["by_class"]} == {"P1 A": 170, "P2 A": 290}
+    assert {c["category"]: c["total"] for c in report["by_category"]} == {"tuition": 300, "lunch": 80, "transport": 80}
+    assert aging.report(db, today, class_id=2, category="lunch")["totals"]["61_90"] == 40
+
+    drill = aging.students(db, today, bucket="90_plus")
+    assert [(s["student_id"], s["90_plus"], s["total"]) for s in drill] == [(2, 50, 50)]
+    assert [s["student_id"] for s in aging.students(db, today)] == [2, 1]
+
+    assert aging.load_snapshot(db) is None
+    overdue.sweep(db, today)
+    saved = aging.load_snapshot(db)
+    assert saved["snapshot"] and saved["as_of"] == today.isoformat()
+    assert saved["totals"] == aging.report(db, today)["totals"]
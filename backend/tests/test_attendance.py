@@ -0,0 +1,219 @@
+import numpy as np
+import pytest
+from datetime import date, datetime, timedelta, timezone
+from sqlalchemy import event
+from app.models import *
+from app.models.attendance import AttendanceStatus
+from app.models.user import UserRole
+from app.services import attendance, attendance_bitmaps, attendance_summary
+
+def test_upsert_marks_a_class_in_one_statement_and_replaces_on_remark(db):
+    db.add(Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"))
+    db.add(User(id=1, email="t@school.rw", full_name="T", hashed_password="x", role=UserRole.TEACHER))
+    for n in range(1, 46):
+        db.add(Student(id=n, admission_number=f"FBS2024{n:04d}", first_name=f"S{n}", last_name="L", class_id=1,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.commit()
+    day = date(2024, 3, 4)
+    marks = [{"student_id": n, "class_id": 1, "date": "2024-03-04", "status": "present"} for n in range(1, 46)]
+
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    assert attendance.upsert(db, marks, 1) == 45
+    assert len([s for s in statements if s.startswith("INSERT INTO attendance ")]) == 1
+    db.commit()
+
+    marks[0]["status"], marks[0]["notes"] = "late", "bus"
+    attendance.upsert(db, marks[:2], 1)
+    attendance.upsert(db, [{"student_id": 2, "class_id": 1, "date": day, "status": "absent"},
+                           {"student_id": 3, "class_id": 1, "date": date(2024, 3, 5), "status": "absent"}], 1, overwrite=False)
+    db.commit()
+    assert db.query(Attendance).count() == 46
+    first, second = (db.query(Attendance).filter(Attendance.student_id == n, Attendance.date == day).one() for n in (1, 2))
+    assert (first.status, first.notes) == (AttendanceStatus.LATE, "bus")
+    assert second.status == AttendanceStatus.PRESENT  # overwrite=False keeps the existing mark
+
+    with pytest.raises(ValueError, match="Invalid attendance status"):
+        attendance.upsert(db, [{"student_id": 1, "class_id": 1, "date": day, "status": "sick"}], 1)
+
+def test_daily_class_rollup_follows_the_marks(db):
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    # marks written before the rollup existed are picked up at startup; reads alone never fill it
+    db.add_all([Attendance(student_id=n, class_id=1, date=date(2024, 3, 1), status=AttendanceStatus.PRESENT, recorded_by=1)
+                for n in (1, 2, 3)])
+    db.commit()
+    assert attendance_summary.totals(db)["present"] == 0
+    attendance_summary.ensure(db)
+    assert attendance_summary.totals(db)["present"] == 3
+
+    attendance.upsert(db, [{"student_id": 1, "class_id": 1, "date": "2024-03-04", "status": "present"},
+                           {"student_id": 2, "class_id": 1, "date": "2024-03-04", "status": "absent"},
+                           {"student_id": 3, "class_id": 1, "date": "2024-03-04", "status": "late"},
+                           {"student_id": 4, "class_id": 2, "date": "2024-03-04", "status": "excused"}], 1)
+    attendance.upsert(db, [{"student_id": 3, "class_id": 2, "date": "2024-03-04", "status": "present"}], 1)  # moved class
+    db.commit()
+
+    assert db.query(AttendanceDailyClass).count() == 3
+    day = attendance_summary.totals(db, date(2024, 3, 4), date(2024, 3, 5))
+    assert {k: day[k] for k in ("present", "absent", "late", "excused", "total", "rate")} == {
+        "present": 2, "absent": 1, "late": 0, "excused": 1, "total": 4, "rate": 50.0
+    }
+    assert [(c["class"], c["present"], c["total"]) for c in attendance_summary.by_class(db, date(2024, 3, 4))] == [
+        ("P1 A", 1, 2), ("P2 A", 1, 2)
+    ]
+    assert [(d["date"], d["total"]) for d in attendance_summary.by_day(db, class_ids=[1])] == [
+        ("2024-03-01", 3), ("2024-03-04", 2)
+    ]
+
+    attendance_summary.rebuild(db)
+    assert attendance_summary.totals(db, date(2024, 3, 4), date(2024, 3, 5)) == day
+
+def test_term_bitmaps_match_the_marks(db):
+    term = AcademicTerm(id=1, name="Term 1", academic_year="2024", start_date=date(2024, 3, 4), end_date=date(2024, 3, 22))
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"), term])
+    for n in (1, 2):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=1,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.add(Attendance(student_id=1, class_id=1, date=date(2024, 3, 4), status=AttendanceStatus.PRESENT, recorded_by=1))
+    db.commit()
+
+    # student 1: P A | weekend | A A L, then E on the last day; student 2: A on the first day only
+    week = {date(2024, 3, 5): "absent", date(2024, 3, 11): "absent", date(2024, 3, 12): "absent",
+            date(2024, 3, 13): "late", date(2024, 3, 22): "excused"}
+    attendance.upsert(db, [{"student_id": 1, "class_id": 1, "date": day, "status": status} for day, status in week.items()], 1)
+    attendance.upsert(db, [{"student_id": 2, "class_id": 1, "date": date(2024, 3, 4), "status": "absent"},
+                           {"student_id": 1, "class_id": 1, "date": date(2024, 3, 4), "status": "absent"}], 1, overwrite=False)
+    db.commit()
+    assert db.query(AttendanceTermBitmap).count() == 2
+
+    summary = attendance_bitmaps.term_summary(db, term)
+    first = next(s for s in summary["students"] if s["student_id"] == 1)
+    assert {k: first[k] for k in ("present", "absent", "late", "excused", "total", "longest_absence_streak",
+                                  "current_absence_streak")} == {
+        "present": 1, "absent": 3, "late": 1, "excused": 1, "total": 6, "longest_absence_streak": 3, "current_absence_streak": 0
+    }
+    assert summary["totals"]["absent"] == 4 and summary["students"][0]["student_id"] == 2
+
+    calendar = attendance_bitmaps.calendar(db, term, 2)
+    assert calendar["days"] == [{"date": "2024-03-04", "status": "absent"}] and calendar["current_absence_streak"] == 1
+
+    # rebuilding from the marks (e.g. after the term dates change) gives the same answer
+    term.start_date = date(2024, 3, 1)
+    db.commit()
+    assert attendance_bitmaps.term_summary(db, term)["students"] == summary["students"]
+    assert {b.start_date for b in db.query(AttendanceTermBitmap)} == {date(2024, 3, 1)}
+
+def test_streaks_skip_unmarked_days():
+    marked = np.array([[1, 1, 0, 0, 1, 1, 1], [1, 0, 1, 1, 0, 0, 0]], dtype=bool)
+    absent = np.array([[0, 1, 0, 0, 1, 0, 1], [1, 0, 1, 1, 0, 0, 0]], dtype=bool)
+    longest, current = attendance_bitmaps.streaks(absent, marked)
+    assert longest.tolist() == [2, 3] and current.tolist() == [1, 3]
+
+    codes = np.random.default_rng(0).integers(0, 4, (5, 90)).astype(np.uint8)
+    flags = np.random.default_rng(1).integers(0, 2, (5, 90)).astype(bool)
+    packed_marked, packed_codes = attendance_bitmaps.pack(flags, codes)
+    assert len(packed_codes[0]) == 23 and len(packed_marked[0]) == 12
+    decoded_marked, decoded_codes = attendance_bitmaps.unpack(packed_marked, packed_codes, 90)
+    assert (decoded_marked == flags).all() and (decoded_codes == codes).all()
+
+def test_sync_resolves_conflicts_by_recorded_time_and_pulls_changes_since_the_watermark(db, monkeypatch):
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    db.commit()
+    day = date.today()
+    first = attendance.sync(db, [], None, [1], 1)
+    assert first["changes"] == [] and first["applied"] == 0
+
+    # the register is marked online while a tablet is offline
+    attendance.upsert(db, [{"student_id": n, "class_id": 1, "date": day, "status": "present"} for n in (1, 2, 3)], 1)
+    attendance.upsert(db, [{"student_id": 9, "class_id": 2, "date": day, "status": "present"}], 1)
+    db.commit()
+    server_time = db.query(Attendance).filter(Attendance.student_id == 1).one().recorded_at
+
+    taken_before = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    taken_after = (datetime.now(timezone.utc) + timedelta(seconds=1)).isoformat()
+    result = attendance.sync(db, [
+        {"student_id": 1, "class_id": 1, "date": day.isoformat(), "status": "absent", "recorded_at": taken_before},
+        {"student_id": 2, "class_id": 1, "date": day.isoformat(), "status": "late", "recorded_at": taken_after},
+        {"student_id": 4, "class_id": 1, "date": day.isoformat(), "status": "absent", "recorded_at": taken_before},
+        {"student_id": 5, "class_id": 1, "date": day.isoformat(), "status": "sick", "recorded_at": taken_before},
+        {"student_id": 6, "class_id": 1, "date": day.isoformat(), "status": "absent"},
+        {"student_id": 7, "class_id": 1, "date": day.isoformat(), "status": "absent",
+         "recorded_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()},
+    ], first["watermark"], [1], 1)
+
+    assert result["applied"] == 2
+    assert [(c["student_id"], c["status"]) for c in result["conflicts"]] == [(1, "present")]
+    assert [e["index"] for e in result["errors"]] == [3, 4, 5]
+    # the tablet gets the marks it did not send (student 1 as the conflict, 3 as a change), not class 2
+    assert [(c["student_id"], c["status"]) for c in result["changes"]] == [(1, "present"), (3, "present")]
+    assert db.query(Attendance).filter(Attendance.student_id == 2).one().status == AttendanceStatus.LATE
+    assert db.query(Attendance).filter(Attendance.student_id == 1).one().recorded_at == server_time
+
+    # replaying the same batch changes nothing
+    again = attendance.sync(db, [
+        {"student_id": 2, "class_id": 1, "date": day.isoformat(), "status": "late", "recorded_at": taken_after}
+    ], result["watermark"], [1], 1)
+    assert again["applied"] == 0 and again["conflicts"][0]["status"] == "late"
+
+    monkeypatch.setattr(attendance, "SYNC_PULL_LIMIT", 2)
+    pages = [attendance.sync(db, [], None, None, 1)]
+    while pages[-1]["has_more"]:
+        pages.append(attendance.sync(db, [], pages[-1]["watermark"], None, 1))
+    pulled = [(c["student_id"], c["date"]) for page in pages for c in page["changes"]]
+    assert len(pages) == 3 and len(set(pulled)) == len(pulled) == db.query(Attendance).count()
+
+    with pytest.raises(ValueError, match="Invalid watermark"):
+        attendance.sync(db, [], "yesterday", [1], 1)
+
+def test_sync_is_limited_to_the_allowed_classes(db):
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    for n, class_id in ((1, 1), (2, 2)):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=class_id,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.commit()
+    day = date.today()
+    attendance.upsert(db, [{"student_id": n, "class_id": n, "date": day, "status": "present"} for n in (1, 2)], 1)
+    db.commit()
+
+    taken = datetime.now(timezone.utc).isoformat()
+    result = attendance.sync(db, [
+        {"student_id": 1, "class_id": 1, "date": day.isoformat(), "status": "late", "recorded_at": taken},
+        {"student_id": 2, "class_id": 2, "date": day.isoformat(), "status": "absent", "recorded_at": taken},
+        {"student_id": 2, "class_id": 1, "date": day.isoformat(), "status": "absent", "recorded_at": taken},  # class 2's student
+    ], None, [1, 2], 1, allowed_class_ids=[1])
+
+    assert result["applied"] == 1
+    assert [e["index"] for e in result["errors"]] == [1, 2]
+    assert {c["class_id"] for c in result["changes"]} <= {1}
+    assert db.query(Attendance).filter(Attendance.student_id == 2).one().status == AttendanceStatus.PRESENT
+
+def test_low_attendance_is_one_grouped_query(db):
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    for n, class_id in ((1, 1), (2, 1), (3, 1), (4, 2)):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=class_id,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    today = date(2024, 3, 15)
+    # present on 3, 2, 4 and 0 of the last 4 days; student 3's absences are older than the window
+    present_days = {1: 3, 2: 2, 3: 4, 4: 0}
+    for n, present in present_days.items():
+        for k in range(4):
+            attendance.upsert(db, [{"student_id": n, "class_id": 1 if n < 4 else 2, "date": today - timedelta(days=k),
+                                    "status": "present" if k < present else "absent"}], 1)
+    attendance.upsert(db, [{"student_id": 3, "class_id": 1, "date": today - timedelta(days=20), "status": "absent"}], 1)
+    db.commit()
+
+    assert attendance_summary.low_attendance_settings(db) == (75.0, 7)
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+    flagged = attendance_summary.low_attendance(db, [1], 75.0, 7, today)
+    assert len(statements) == 1 and "HAVING" in statements[0]
+    assert [(s["student_id"], s["rate"]) for s in flagged] == [(2, 50.0)]
+    assert [s["student_id"] for s in attendance_summary.low_attendance(db, [1, 2], 80.0, 30, today)] == [4, 2, 1]  # student 3 is at exactly 80
+
+    db.add(SchoolSettings(low_attendance_threshold=60.0, low_attendance_window_days=2))
+    db.commit()
+    assert attendance_summary.low_attendance_settings(db) == (60.0, 2)
@@ -0,0 +1,39 @@
+import pytest
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_mock_engine, func
+from sqlalchemy.dialects import postgresql
+from app.core import dates
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+
+def test_buckets_match_python_and_ranges_are_half_open(db):
+    days = [date(2023, 12, 25) + timedelta(days=n) for n in range(0, 70, 3)]
+    db.add_all(Payment(receipt_number=f"RCP-{n}", amount=1, payment_method="cash", payment_date=day) for n, day in enumerate(days))
+    db.commit()
+    for unit in dates.UNITS:
+        bucket = dates.bucket(db.get_bind(), Payment.payment_date, unit)
+        rows = dict(db.query(bucket, func.count(Payment.id)).group_by(bucket).all())
+        expected = {}
+        for day in days:
+            key = dates.bucket_start(day, unit).isoformat()
+            expected[key] = expected.get(key, 0) + 1
+        assert rows == expected
+        assert {date.fromisoformat(key) for key in rows} <= set(dates.buckets(days[0], days[-1] + timedelta(days=1), unit))
+
+    assert db.query(Payment).filter(*dates.through(Payment.payment_date, date(2024, 1, 3), date(2024, 1, 9))).count() == 3
+    assert db.query(Payment).filter(*dates.on_day(Payment.payment_date, datetime(2024, 1, 3, 15, 30))).count() == 1
+
+    db.add(Student(id=1, admission_number="FBS20240001", first_name="S", last_name="L",
+                   date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.add(Invoice(invoice_number="INV-1", student_id=1, category=PaymentCategory.TUITION, term="term_1", amount=1,
+                   amount_paid=0, status=InvoiceStatus.PENDING, due_date=datetime(2024, 2, 1, 23, 59)))
+    db.commit()
+    assert db.query(Invoice).filter(*dates.on_day(Invoice.due_date, date(2024, 2, 1))).count() == 1
+    assert db.query(Invoice).filter(*dates.between(Invoice.due_date, end=date(2024, 2, 1))).count() == 0
+
+def test_postgres_buckets_use_date_trunc():
+    bind = create_mock_engine("postgresql://", executor=None)
+    sql = str(dates.bucket(bind, Payment.payment_date, "week").compile(dialect=postgresql.dialect()))
+    assert "date_trunc" in sql and "to_char" in sql
+    with pytest.raises(ValueError):
+        dates.bucket(bind, Payment.payment_date, "year")
@@ -0,0 +1,67 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.models.guardian import student_guardians
+from app.models.user import UserRole
+from app.services import discounts, finance_summary, ledger
+
+def test_term_discounts_apply_best_rule_once(db):
+    # Students 1 and 2 are siblings of a teacher, 3 is a scholar, 4 has no discount
+    db.add(User(id=1, email="t@x", hashed_password="x", full_name="T", role=UserRole.TEACHER))
+    db.add(Guardian(id=1, user_id=1, first_name="G", last_name="1", phone="0788000001"))
+    for n in range(1, 5):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L",
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+        for category, amount in ((PaymentCategory.TUITION, 100000), (PaymentCategory.LUNCH, 20000)):
+            db.add(Invoice(invoice_number=f"INV-{n}-{category.value}", student_id=n, category=category,
+                           term="term_1", amount=amount, amount_paid=0, status=InvoiceStatus.PENDING))
+    db.flush()
+    db.execute(student_guardians.insert(), [{"student_id": 1, "guardian_id": 1}, {"student_id": 2, "guardian_id": 1}])
+    db.add_all([
+        Discount(name="Sibling", discount_type="sibling", percentage=10, conditions={"min_siblings": 2}),
+        Discount(name="Staff child", discount_type="staff_child", percentage=25,
+                 conditions={"staff_child": True, "categories": ["tuition", "lunch"], "max_amount": 20000}),
+        Discount(name="Scholarship", discount_type="scholarship", percentage=50, conditions={"student_ids": [3]}),
+    ])
+    db.commit()
+
+    preview = discounts.apply_term(db, "term_1", dry_run=True)
+    assert (preview["invoices"], preview["total"]) == (5, 2 * (20000 + 5000) + 50000)
+    assert db.query(DiscountApplication).count() == 0
+
+    result = discounts.apply_term(db, "term_1", user_id=1)
+    assert result["total"] == preview["total"]
+    amounts = dict(db.query(Invoice.invoice_number, Invoice.amount))
+    assert (amounts["INV-1-tuition"], amounts["INV-1-lunch"], amounts["INV-3-tuition"], amounts["INV-4-tuition"]) == (80000, 15000, 50000, 100000)
+    assert ledger.balance(db, 1) == 95000
+    assert db.query(AuditLog).filter(AuditLog.action == "apply_discounts").count() == 1
+
+    assert discounts.apply_term(db, "term_1")["invoices"] == 0
+    overall = finance_summary.load_finance_summary(db)["overall"]
+    total = overall.total_invoiced
+    finance_summary.rebuild_finance_summary(db)
+    assert total == finance_summary.load_finance_summary(db)["overall"].total_invoiced == 480000 - preview["total"]
+
+def test_discount_update_keeps_payments_posted_since_the_invoices_were_read(db):
+    for n in range(1, 4):
+        db.add(Invoice(id=n, invoice_number=f"INV-{n}", student_id=n, category=PaymentCategory.TUITION, term="term_1",
+                       amount=100000, amount_paid=0, status=InvoiceStatus.PENDING))
+    db.commit()
+    # Payments land after apply_term planned its discounts
+    for invoice_id, paid, status in ((1, 90000, InvoiceStatus.PARTIAL), (2, 30000, InvoiceStatus.PARTIAL),
+                                     (3, 100000, InvoiceStatus.PAID)):
+        db.query(Invoice).filter(Invoice.id == invoice_id).update({"amount_paid": paid, "status": status})
+    db.commit()
+
+    result = db.execute(discounts._discount(), [{"b_id": n, "b_discount": 10000} for n in (1, 2, 3)])
+    db.commit()
+    if db.get_bind().dialect.supports_sane_multi_rowcount:
+        assert result.rowcount == 2  # the paid invoice is left alone
+    rows = {i.id: (i.amount, i.amount_paid, i.status) for i in db.query(Invoice)}
+    assert rows == {1: (90000, 90000, InvoiceStatus.PAID), 2: (90000, 30000, InvoiceStatus.PARTIAL),
+                    3: (100000, 100000, InvoiceStatus.PAID)}
+
+def test_unknown_conditions_are_rejected():
+    with pytest.raises(ValueError):
+        discounts.Rule(Discount(name="Bad", percentage=10, conditions={"min_sibling": 2}))
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import pytest
+import zipfile
+from datetime import date
+from app.core.config import settings
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import documents
+
+@pytest.fixture
+def db(db, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    try:
+        yield db
+    finally:
+        documents.shutdown()
+
+def _seed(db):
+    db.add(Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"))
+    for n in range(1, 4):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=1,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+        db.add(Invoice(id=n, invoice_number=f"INV-{n}", student_id=n, category=PaymentCategory.TUITION,
+                       term="term_1", amount=50000, amount_paid=0, status=InvoiceStatus.PENDING))
+    db.commit()
+
+def test_invoice_pdf_is_cached_until_the_invoice_changes(db):
+    _seed(db)
+    docs = documents.invoice_documents(db, [1])
+    path = asyncio.run(documents.render("invoice", docs))
+    with open(path, "rb") as f:
+        assert f.read(5) == b"%PDF-"
+    assert asyncio.run(documents.render("invoice", documents.invoice_documents(db, [1]))) == path
+
+    db.add(Payment(id=1, receipt_number="RCP-1", invoice_id=1, amount=20000, payment_method="cash", payment_date=date(2024, 2, 1)))
+    db.add(Payment(id=2, receipt_number="RCP-2", invoice_id=1, amount=5000, payment_method="cash", payment_date=date(2024, 2, 2)))
+    db.query(Invoice).filter(Invoice.id == 1).update({"amount_paid": 25000, "status": InvoiceStatus.PARTIAL})
+    db.commit()
+    docs = documents.invoice_documents(db, [1])
+    assert [p["receipt_number"] for p in docs[0]["payments"]] == ["RCP-1", "RCP-2"]
+    assert asyncio.run(documents.render("invoice", docs)) != path
+
+    receipt = documents.receipt_document(db, 1)
+    assert (receipt["amount"], receipt["invoice"]["paid_to_date"]) == (20000, 20000)
+    assert documents.receipt_document(db, 99) is None
+
+def test_class_term_pack_as_merged_pdf_and_zip(db):
+    _seed(db)
+    db.add(Invoice(id=4, invoice_number="INV-4", student_id=1, category=PaymentCategory.LUNCH,
+                   term="term_2", amount=10000, amount_paid=0, status=InvoiceStatus.PENDING))
+    for n, status in ((5, InvoiceStatus.PAID), (6, InvoiceStatus.CANCELLED), (7, InvoiceStatus.OVERDUE)):
+        db.add(Invoice(id=n, invoice_number=f"INV-{n}", student_id=2, category=list(PaymentCategory)[n], term="term_1",
+                       amount=10000, amount_paid=10000 if status == InvoiceStatus.PAID else 0, status=status))
+    db.commit()
+    # Paid and cancelled invoices stay out of a print run
+    docs = documents.invoice_documents(db, class_id=1, term="term_1")
+    assert [doc["number"] for doc in docs] == ["INV-1", "INV-2", "INV-7", "INV-3"]
+    assert len(documents.invoice_documents(db, [5, 6])) == 2  # unless asked for by id
+    docs = [doc for doc in docs if doc["number"] != "INV-7"]
+
+    merged = asyncio.run(documents.render("invoice", docs))
+    with open(merged, "rb") as f:
+        assert f.read().count(b"/Type /Page\n") == 3
+    archive = asyncio.run(documents.render_zip("invoice", docs, [doc["number"] for doc in docs]))
+    assert zipfile.ZipFile(archive).namelist() == ["INV-1.pdf", "INV-2.pdf", "INV-3.pdf"]
+
+def test_prune_drops_unused_documents_then_the_least_recently_used(db):
+    _seed(db)
+    paths = [asyncio.run(documents.render("invoice", documents.invoice_documents(db, [n]))) for n in (1, 2, 3)]
+    now = os.path.getmtime(paths[0]) + 40 * 86400
+    os.utime(paths[0], (now - 31 * 86400, now - 31 * 86400))  # unused for a month
+    os.utime(paths[1], (now - 2 * 86400, now - 2 * 86400))
+    os.utime(paths[2], (now - 1 * 86400, now - 1 * 86400))
+    assert documents.prune(max_age_days=30, max_mb=500, now=now)[0] == 1
+    assert [os.path.exists(path) for path in paths] == [False, True, True]
+
+    assert documents.prune(max_age_days=30, max_mb=0, now=now)[0] == 2
+    assert not any(os.path.exists(path) for path in paths)
+
+    # a cache hit counts as a use
+    path = asyncio.run(documents.render("invoice", documents.invoice_documents(db, [1])))
+    os.utime(path, (0, 0))
+    assert asyncio.run(documents.render("invoice", documents.invoice_documents(db, [1]))) == path
+    assert documents.prune(max_age_days=30, max_mb=500)[0] == 0
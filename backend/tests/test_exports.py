@@ -0,0 +1,33 @@
+import csv
+import io
+from datetime import date
+from openpyxl import load_workbook
+from app.services import exports
+
+HEADER = ["Student", "Amount", "Due Date"]
+
+def consumed(rows, log):
+    for row in rows:
+        log.append(row[0])
+        yield row
+
+def test_csv_streams_the_header_first_then_batches():
+    rows = [[f"S{n}", 1000 * n, date(2024, 2, n)] for n in range(1, 6)]
+    log = []
+    chunks = exports.stream_csv(HEADER, consumed(rows, log), batch_size=2)
+
+    assert next(chunks) == "Student,Amount,Due Date\r\n" and log == []  # sent before any row is fetched
+    rest = list(chunks)
+    assert len(rest) == 3 and rest[0] == "S1,1000,2024-02-01\r\nS2,2000,2024-02-02\r\n"
+    assert list(csv.reader(io.StringIO("".join(rest)))) == [[f"S{n}", str(1000 * n), f"2024-02-0{n}"] for n in range(1, 6)]
+
+    assert list(exports.stream_csv(HEADER, iter([]))) == ["Student,Amount,Due Date\r\n"]
+
+def test_xlsx_writes_the_header_and_every_row():
+    rows = [[f"S{n}", 1000.5 * n, date(2024, 2, n)] for n in range(1, 4)]
+    workbook = load_workbook(io.BytesIO(b"".join(exports.stream_xlsx("Outstanding Fees", HEADER, iter(rows), chunk_size=512))))
+
+    sheet = workbook["Outstanding Fees"]
+    values = [list(row) for row in sheet.iter_rows(values_only=True)]
+    assert values[0] == HEADER
+    assert [(name, amount, due.date()) for name, amount, due in values[1:]] == [tuple(row) for row in rows]
@@ -0,0 +1,92 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import finance_summary
+
+def make_invoice(db, number, amount, student_id):
+    invoice = Invoice(
+        invoice_number=number, student_id=student_id, category=PaymentCategory.TUITION,
+        term="term_1", amount=amount, amount_paid=0, status=InvoiceStatus.PENDING
+    )
+    db.add(invoice)
+    finance_summary.record_invoice_change(db, None, invoice)
+    db.commit()
+    return invoice
+
+def pay(db, invoice, number, amount, method="cash", payment_date=date(2024, 3, 5)):
+    payment = Payment(receipt_number=number, invoice_id=invoice.id, amount=amount,
+                      payment_method=method, payment_date=payment_date)
+    db.add(payment)
+    before = finance_summary.invoice_snapshot(invoice)
+    invoice.amount_paid += amount
+    invoice.status = InvoiceStatus.PAID if invoice.amount_paid >= invoice.amount else InvoiceStatus.PARTIAL
+    finance_summary.record_invoice_change(db, before, invoice)
+    finance_summary.record_payment(db, payment)
+    db.commit()
+
+def summary_rows(db):
+    return {
+        row.scope: (row.total_invoiced, row.total_collected, row.total_outstanding, row.invoice_count,
+                    row.pending_count, row.partial_count, row.paid_count, row.payment_count)
+        for row in db.query(FinanceSummary).all()
+    }
+
+def test_incremental_updates_match_rebuild(db):
+    first = make_invoice(db, "INV-1", 1000, student_id=1)
+    second = make_invoice(db, "INV-2", 500, student_id=2)
+    pay(db, first, "RCP-1", 400)
+    pay(db, second, "RCP-2", 500, method="mtn_momo", payment_date=date(2024, 4, 1))
+    pay(db, first, "RCP-3", 100, method="mtn_momo")
+
+    before = finance_summary.invoice_snapshot(second)
+    db.delete(second)
+    finance_summary.record_invoice_change(db, before, None)
+    db.commit()
+
+    incremental = summary_rows(db)
+    assert incremental["all"] == (1000, 1000, 500, 1, 0, 1, 0, 3)
+    assert incremental["month:2024-03"][1] == 500
+    assert incremental["method:mtn_momo"][1] == 600
+
+    finance_summary.rebuild_finance_summary(db)
+    assert summary_rows(db) == incremental
+
+def test_load_computes_a_missing_rollup_without_writing_it(db):
+    db.add(Invoice(invoice_number="INV-1", student_id=1, category=PaymentCategory.LUNCH,
+                   amount=300, amount_paid=0, status=InvoiceStatus.PENDING))
+    db.add(Payment(receipt_number="RCP-1", invoice_id=1, amount=100, payment_method="cash", payment_date=date(2024, 3, 4)))
+    db.commit()
+
+    summary = finance_summary.load_finance_summary(db, date(2024, 3, 1))
+    assert summary["overall"].total_outstanding == 300
+    assert summary["overall"].pending_count == 1
+    assert summary["month"].total_collected == 100
+    assert [(row.scope, row.payment_count) for row in summary["methods"]] == [("method:cash", 1)]
+    assert db.query(FinanceSummary).count() == 0 and not db.new
+
+    finance_summary.ensure_summary(db)  # what startup does
+    db.commit()
+    assert finance_summary.load_finance_summary(db, date(2024, 3, 1))["overall"].pending_count == 1
+    assert db.query(FinanceSummary).count() == 3
+
+def test_new_scopes_start_at_zero_and_rebuild_upserts(db):
+    invoice = make_invoice(db, "INV-1", 1000, student_id=1)
+    pay(db, invoice, "RCP-1", 100)
+    db.query(FinanceSummary).filter(FinanceSummary.scope == "all").update({"invoice_count": 7})  # drift
+    db.commit()
+
+    # The first payment of a new month and method adds zero rows instead of rebuilding everything
+    pay(db, invoice, "RCP-2", 200, method="airtel_money", payment_date=date(2024, 5, 2))
+    rows = summary_rows(db)
+    assert rows["all"][3] == 7
+    assert rows["month:2024-05"][1] == 200 and rows["method:airtel_money"][1] == 200
+
+    ids = {row.scope: row.id for row in db.query(FinanceSummary)}
+    db.query(Payment).filter(Payment.receipt_number == "RCP-2").delete()
+    finance_summary.rebuild_finance_summary(db)
+    finance_summary.rebuild_finance_summary(db)
+    rows = summary_rows(db)
+    assert rows["all"][3] == 1
+    assert "month:2024-05" not in rows and "method:airtel_money" not in rows
+    assert {row.scope: row.id for row in db.query(FinanceSummary)}["all"] == ids["all"]
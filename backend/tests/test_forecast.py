@@ -0,0 +1,53 @@
+import pytest
+from datetime import date, datetime
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import forecast
+
+def test_open_balances_follow_each_class_delay_distribution(db):
+    today = date(2024, 6, 12)  # a Wednesday; week 0 starts Monday 10 June
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    for n in (1, 2):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=n,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+
+    def invoice(number, student_id, due, amount, paid=0.0, status=InvoiceStatus.PENDING):
+        db.add(Invoice(id=number, invoice_number=f"INV-{number}", student_id=student_id, category=PaymentCategory.OTHER,
+                       term=f"t{number}", amount=amount, amount_paid=paid, status=status, due_date=due))
+
+    # Class 1 has always paid two weeks after the due date
+    for n in range(1, 21):
+        invoice(n, 1, datetime(2024, 3, 4), 100, 100, InvoiceStatus.PAID)
+        db.add(Payment(receipt_number=f"RCP-{n}", invoice_id=n, amount=100, payment_method="cash", payment_date=date(2024, 3, 18)))
+    invoice(21, 1, datetime(2024, 6, 10), 1000)
+    invoice(22, 1, datetime(2024, 6, 3), 800, 300, InvoiceStatus.OVERDUE)
+    invoice(23, 2, datetime(2024, 6, 12, 8), 300)  # too little history of its own: school-wide delays
+    invoice(24, 1, datetime(2023, 5, 1), 50, 0, InvoiceStatus.OVERDUE)  # older than any observed delay
+    db.commit()
+
+    result = forecast.cached_projection(db, today, weeks=4)
+    assert [w["week_start"] for w in result["weeks"]] == ["2024-06-10", "2024-06-17", "2024-06-24", "2024-07-01", "2024-07-08"]
+    assert [w["expected"] for w in result["weeks"]] == [0, 500, 1300, 0, 0]
+    assert (result["open_balance"], result["expected_in_horizon"], result["not_expected"]) == (1850, 1800, 50)
+    classes = {c["class"]: c for c in result["classes"]}
+    assert (classes["P1 A"]["median_delay_days"], classes["P1 A"]["collection_rate"]) == (14, 1.0)
+    assert classes["P2 A"]["weeks"] == [0, 0, 300, 0, 0]
+
+    # Cached until the next payment is posted
+    assert forecast.cached_projection(db, today, weeks=4) is result
+    db.add(Payment(receipt_number="RCP-21", invoice_id=21, amount=400, payment_method="cash", payment_date=today))
+    db.query(Invoice).filter(Invoice.id == 21).update({"amount_paid": 400, "status": InvoiceStatus.PARTIAL})
+    db.commit()
+    assert forecast.cached_projection(db, today, weeks=4)["open_balance"] == 1450
+
+    # ... and until an invoice is raised, discounted or cancelled
+    invoice(25, 2, datetime(2024, 6, 20), 200)
+    db.commit()
+    assert forecast.cached_projection(db, today, weeks=4)["open_balance"] == 1650
+    db.query(Invoice).filter(Invoice.id == 25).update({"amount": 150})
+    db.commit()
+    assert forecast.cached_projection(db, today, weeks=4)["open_balance"] == 1600
+    db.query(Invoice).filter(Invoice.id == 25).update({"status": InvoiceStatus.CANCELLED})
+    db.commit()
+    assert forecast.cached_projection(db, today, weeks=4)["open_balance"] == 1450
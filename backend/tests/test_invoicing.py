@@ -0,0 +1,60 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.models.student import EnrollmentStatus
+from app.services import finance_summary, invoicing, ledger
+
+def test_term_invoices_follow_the_most_specific_fee_structure(db):
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    for n, class_id, status in ((1, 1, EnrollmentStatus.ACTIVE), (2, 1, EnrollmentStatus.ACTIVE),
+                                (3, 2, EnrollmentStatus.ACTIVE), (4, 2, EnrollmentStatus.WITHDRAWN)):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=class_id,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1), enrollment_status=status))
+    db.add_all([
+        FeeStructure(class_id=None, category=PaymentCategory.TUITION, term="term_1", amount=90000),
+        FeeStructure(class_id=2, category=PaymentCategory.TUITION, term="term_1", amount=110000),
+        FeeStructure(class_id=None, category=PaymentCategory.LUNCH, term=None, is_recurring=True, amount=30000),
+        FeeStructure(class_id=1, category=PaymentCategory.TRIP, term="term_2", amount=5000),
+        FeeStructure(class_id=1, category=PaymentCategory.UNIFORM, term="term_1", amount=15000, is_active=False),
+    ])
+    # Student 1 was already billed tuition by hand
+    db.add(Invoice(invoice_number="INV-HAND-1", student_id=1, category=PaymentCategory.TUITION, term="term_1",
+                   amount=85000, amount_paid=0, status=InvoiceStatus.PENDING))
+    db.commit()
+
+    preview = invoicing.generate_term(db, "term_1", dry_run=True)
+    assert (preview["invoices"], preview["total"], preview["already_invoiced"]) == (5, 90000 + 110000 + 3 * 30000, 1)
+    assert [(r["class_name"], r["category"], r["invoices"], r["total"]) for r in preview["by_class"]] == [
+        ("P1 A", "lunch", 2, 60000), ("P1 A", "tuition", 1, 90000),
+        ("P2 A", "lunch", 1, 30000), ("P2 A", "tuition", 1, 110000)]
+    assert db.query(Invoice).count() == 1
+
+    result = invoicing.generate_term(db, "term_1", due_date=date(2024, 2, 15))
+    assert result["created"] == 5
+    assert db.query(Invoice.amount).filter(Invoice.student_id == 3, Invoice.category == PaymentCategory.TUITION).scalar() == 110000
+    assert ledger.balance(db, 1) == 85000 + 30000
+    assert finance_summary.load_finance_summary(db)["overall"].total_invoiced == 85000 + preview["total"]
+
+    assert invoicing.generate_term(db, "term_1")["invoices"] == 0
+
+def test_structures_pinned_to_another_term_never_apply(db):
+    db.add(Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"))
+    db.add(Student(id=1, admission_number="FBS20240001", first_name="S1", last_name="L", class_id=1,
+                   date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.add_all([
+        FeeStructure(id=1, class_id=None, category=PaymentCategory.TUITION, term="term_1", amount=90000),
+        FeeStructure(id=2, class_id=None, category=PaymentCategory.TUITION, term="term_2", is_recurring=True, amount=110000),
+        FeeStructure(id=3, class_id=None, category=PaymentCategory.LUNCH, term="term_2", is_recurring=True, amount=30000),
+        FeeStructure(id=4, class_id=None, category=PaymentCategory.TRANSPORT, term="term_1", amount=20000),
+        FeeStructure(id=5, class_id=None, category=PaymentCategory.TRANSPORT, term=None, is_recurring=True, amount=25000),
+    ])
+    db.commit()
+
+    planned, _ = invoicing.plan_term(db, "term_1")
+    assert [(row["category"], row["amount"]) for row in planned] == [
+        (PaymentCategory.TRANSPORT, 20000), (PaymentCategory.TUITION, 90000)]
+    planned, _ = invoicing.plan_term(db, "term_2")
+    assert [(row["category"], row["amount"]) for row in planned] == [
+        (PaymentCategory.LUNCH, 30000), (PaymentCategory.TRANSPORT, 25000), (PaymentCategory.TUITION, 110000)]
@@ -0,0 +1,52 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, LedgerEntryType, PaymentCategory
+from app.services import ledger
+
+def make_invoice(db, number, amount, category=PaymentCategory.TUITION, student_id=1):
+    invoice = Invoice(invoice_number=number, student_id=student_id, category=category, term="term_1",
+                      amount=amount, amount_paid=0, status=InvoiceStatus.PENDING)
+    db.add(invoice)
+    ledger.record_invoice_change(db, invoice, 0.0, LedgerEntryType.INVOICE)
+    db.commit()
+    return invoice
+
+def test_running_balance_follows_invoice_changes(db):
+    tuition = make_invoice(db, "INV-1", 1000)
+    lunch = make_invoice(db, "INV-2", 300, category=PaymentCategory.LUNCH)
+
+    payment = Payment(receipt_number="RCP-1", invoice_id=tuition.id, amount=400,
+                      payment_method="cash", payment_date=date(2024, 3, 5))
+    db.add(payment)
+    tuition.amount_paid += 400
+    tuition.status = InvoiceStatus.PARTIAL
+    ledger.record_payment(db, payment, tuition.student_id)
+    db.commit()
+
+    before = ledger.invoice_balance(tuition)
+    tuition.amount -= 100
+    ledger.record_invoice_change(db, tuition, before, LedgerEntryType.DISCOUNT, "Sibling discount")
+    db.commit()
+
+    before = ledger.invoice_balance(lunch)
+    db.delete(lunch)
+    ledger.record_invoice_change(db, lunch, before, LedgerEntryType.REVERSAL, removed=True)
+    db.commit()
+
+    assert ledger.balance(db, 1) == 500
+    statement = ledger.statement(db, 1)
+    assert [e["balance"] for e in statement["entries"]] == [1000, 1300, 900, 800, 500]
+    assert [e["type"] for e in statement["entries"]] == ["invoice", "invoice", "payment", "discount", "reversal"]
+    assert all(entry.invoice_id for entry in db.query(LedgerEntry))
+    assert db.query(LedgerEntry).filter(LedgerEntry.payment_id == payment.id).count() == 1
+
+def test_accounts_predating_the_ledger_open_at_their_invoice_balance(db):
+    db.add(Invoice(invoice_number="INV-1", student_id=1, category=PaymentCategory.TUITION, term="term_1",
+                   amount=800, amount_paid=200, status=InvoiceStatus.PARTIAL))
+    db.commit()
+    assert ledger.balance(db, 1) == 600
+
+    make_invoice(db, "INV-2", 300, category=PaymentCategory.LUNCH)
+    entries = ledger.statement(db, 1)["entries"]
+    assert [(e["type"], e["balance"]) for e in entries] == [("opening", 600), ("invoice", 900)]
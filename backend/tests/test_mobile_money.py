@@ -0,0 +1,80 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.models.mobile_money import MobileMoneyStatus
+from app.services import ledger, mobile_money
+
+@pytest.fixture
+def invoice(db):
+    db.add(Student(id=1, admission_number="FBS20240001", first_name="S", last_name="L",
+                   date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    invoice = Invoice(id=1, invoice_number="INV-2024-00001", student_id=1, category=PaymentCategory.TUITION,
+                      term="term_1", amount=50000, amount_paid=0, status=InvoiceStatus.PENDING)
+    db.add(invoice)
+    db.commit()
+    return invoice
+
+def test_replayed_callbacks_post_one_payment(db, invoice):
+    mtn = mobile_money.create_transaction(db, invoice, "mtn_momo", "0788000001", 20000)
+    airtel = mobile_money.create_transaction(db, invoice, "airtel_money", "0730000001", 30000)
+    for _ in range(3):
+        mobile_money.enqueue_callback(db, "mtn_momo", mobile_money.stub_callback(mtn))
+    mobile_money.enqueue_callback(db, "airtel_money", mobile_money.stub_callback(airtel))
+    # Same provider transaction id reported against a second transaction
+    reused = mobile_money.create_transaction(db, invoice, "mtn_momo", "0788000001", 20000)
+    mobile_money.enqueue_callback(db, "mtn_momo", mobile_money.stub_callback(
+        reused, provider_transaction_id=mobile_money.stub_callback(mtn)["financialTransactionId"]))
+
+    assert mobile_money.process_callbacks(db, limit=2) == 2
+    assert mobile_money.process_callbacks(db) == 3
+    assert mobile_money.process_callbacks(db) == 0
+
+    results = [c.result for c in db.query(MobileMoneyCallback).order_by(MobileMoneyCallback.id)]
+    assert results == ["posted", "duplicate", "duplicate", "posted", "duplicate"]
+    assert db.query(Payment).count() == 2
+    assert {p.payment_method for p in db.query(Payment)} == {"mtn_momo", "airtel_money"}
+    db.refresh(invoice)
+    assert (invoice.amount_paid, invoice.status) == (50000, InvoiceStatus.PAID)
+    assert ledger.balance(db, 1) == 0
+    db.refresh(mtn)
+    assert mtn.status == MobileMoneyStatus.SUCCESSFUL and mtn.payment_id
+    db.refresh(reused)
+    assert reused.status == MobileMoneyStatus.PENDING
+
+def test_failed_and_unknown_callbacks_post_nothing(db, invoice):
+    transaction = mobile_money.create_transaction(db, invoice, "airtel_money", "0730000001", 50000)
+    mobile_money.enqueue_callback(db, "airtel_money", mobile_money.stub_callback(transaction, MobileMoneyStatus.FAILED))
+    mobile_money.enqueue_callback(db, "airtel_money", mobile_money.stub_callback(transaction))
+    mobile_money.enqueue_callback(db, "mtn_momo", {"externalId": "nope", "status": "SUCCESSFUL"})
+
+    mobile_money.process_callbacks(db)
+
+    assert [c.result for c in db.query(MobileMoneyCallback).order_by(MobileMoneyCallback.id)] == ["failed", "duplicate", "unknown"]
+    db.refresh(transaction)
+    assert (transaction.status, transaction.failure_reason) == (MobileMoneyStatus.FAILED, "Transaction failed")
+    assert db.query(Payment).count() == 0
+
+def test_callbacks_never_post_more_than_was_asked_or_is_owed(db, invoice):
+    inflated = mobile_money.create_transaction(db, invoice, "mtn_momo", "0788000001", 50000)
+    payload = mobile_money.stub_callback(inflated)
+    payload["amount"] = "900000"
+    mobile_money.enqueue_callback(db, "mtn_momo", payload)
+    # Two pending requests for the whole invoice, both paid
+    first = mobile_money.create_transaction(db, invoice, "airtel_money", "0730000001", 50000)
+    second = mobile_money.create_transaction(db, invoice, "airtel_money", "0730000001", 50000)
+    mobile_money.enqueue_callback(db, "airtel_money", mobile_money.stub_callback(first))
+    mobile_money.enqueue_callback(db, "airtel_money", mobile_money.stub_callback(second))
+
+    mobile_money.process_callbacks(db)
+
+    assert [c.result for c in db.query(MobileMoneyCallback).order_by(MobileMoneyCallback.id)] == \
+        ["amount_mismatch", "posted", "review"]
+    assert db.query(Payment).count() == 1
+    db.refresh(invoice)
+    assert (invoice.amount_paid, invoice.status) == (50000, InvoiceStatus.PAID)
+    assert ledger.balance(db, 1) == 0
+    db.refresh(inflated)
+    assert inflated.status == MobileMoneyStatus.PENDING
+    db.refresh(second)
+    assert second.status == MobileMoneyStatus.SUCCESSFUL and second.payment_id is None and second.failure_reason
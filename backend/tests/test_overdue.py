@@ -0,0 +1,39 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import finance_summary, ledger, overdue
+
+def test_sweep_marks_overdue_and_raises_late_fees_once(db):
+    db.add(SchoolSettings(late_fee_percentage=10.0, grace_period_days=7))
+    for n, (due, paid, status) in enumerate([
+        (date(2024, 3, 1), 0, InvoiceStatus.PENDING),     # past grace: overdue + late fee
+        (date(2024, 3, 8), 4000, InvoiceStatus.PARTIAL),  # inside grace: overdue only
+        (date(2024, 3, 20), 0, InvoiceStatus.PENDING),    # not due yet
+        (date(2024, 4, 1), 0, InvoiceStatus.OVERDUE),     # due date moved out
+        (date(2024, 2, 1), 10000, InvoiceStatus.PAID),
+    ], start=1):
+        db.add(Invoice(invoice_number=f"INV-{n}", student_id=n, category=PaymentCategory.TUITION, term="term_1",
+                       amount=10000, amount_paid=paid, status=status, due_date=due))
+    db.commit()
+
+    run = overdue.sweep(db, date(2024, 3, 10))
+    assert (run.marked_overdue, run.reopened, run.late_fee_count, run.late_fee_total) == (2, 1, 1, 1000)
+    statuses = dict(db.query(Invoice.invoice_number, Invoice.status))
+    assert statuses == {"INV-1": InvoiceStatus.OVERDUE, "INV-2": InvoiceStatus.OVERDUE, "INV-3": InvoiceStatus.PENDING,
+                        "INV-4": InvoiceStatus.PENDING, "INV-5": InvoiceStatus.PAID, "LF-INV-1": InvoiceStatus.PENDING}
+    fee = db.query(Invoice).filter(Invoice.late_fee_for_id.isnot(None)).one()
+    assert (fee.student_id, fee.amount, fee.category) == (1, 1000, PaymentCategory.OTHER)
+    assert ledger.balance(db, 1) == 11000
+
+    overdue.sweep(db, date(2024, 3, 10))
+    run = overdue.sweep(db, date(2024, 3, 20))
+    assert (run.marked_overdue, run.late_fee_count) == (1, 1)  # the first late fee falls due; INV-2 passes its grace period
+    assert db.query(Invoice).filter(Invoice.late_fee_for_id.isnot(None)).count() == 2
+    assert db.query(OverdueSweep).count() == 2
+
+    overall = finance_summary.load_finance_summary(db, date(2024, 3, 20))["overall"]
+    counts = (overall.pending_count, overall.partial_count, overall.overdue_count, overall.invoice_count)
+    finance_summary.rebuild_finance_summary(db)
+    rebuilt = finance_summary.load_finance_summary(db, date(2024, 3, 20))["overall"]
+    assert counts == (rebuilt.pending_count, rebuilt.partial_count, rebuilt.overdue_count, rebuilt.invoice_count) == (3, 0, 3, 7)
@@ -0,0 +1,87 @@
+import asyncio
+import pytest
+from datetime import date, datetime
+from fastapi import HTTPException
+from app.api import fees
+from app.models import *
+from app.models.fee import InvoiceStatus, LedgerEntryType, PaymentCategory
+from app.models.user import UserRole
+from app.services import finance_summary, payments
+
+def _family(db):
+    guardian = Guardian(id=1, first_name="G", last_name="L", phone="0780000000")
+    for n in (1, 2):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L",
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1), guardians=[guardian]))
+    # (student, category, due day, amount, paid, status)
+    invoices = [(1, PaymentCategory.TUITION, 20, 300, 0, InvoiceStatus.PENDING),
+                (1, PaymentCategory.LUNCH, 5, 100, 40, InvoiceStatus.OVERDUE),
+                (2, PaymentCategory.TRANSPORT, 10, 80, 0, InvoiceStatus.PENDING),
+                (2, PaymentCategory.UNIFORM, None, 50, 0, InvoiceStatus.PENDING),
+                (2, PaymentCategory.TRIP, 1, 60, 0, InvoiceStatus.CANCELLED)]
+    for n, (student_id, category, day, amount, paid, status) in enumerate(invoices, 1):
+        db.add(Invoice(id=n, invoice_number=f"INV-{n}", student_id=student_id, category=category, term="term_1",
+                       amount=amount, amount_paid=paid, status=status,
+                       due_date=datetime(2024, 3, day) if day else None))
+    db.commit()
+
+def test_allocate_spreads_a_guardian_payment_oldest_due_first(db):
+    _family(db)
+    finance_summary.ensure_summary(db)
+    db.commit()
+
+    result = payments.allocate(db, 200, "cash", student_ids=payments.guardian_student_ids(db, 1),
+                               payment_date=date(2024, 3, 25), user_id=None)
+
+    assert [(a["invoice_id"], a["amount"], a["status"]) for a in result["allocations"]] == [
+        (2, 60, "paid"), (3, 80, "paid"), (1, 60, "partial")
+    ]
+    assert [a["receipt_number"] for a in result["allocations"]] == [f"{result['receipt_number']}-{i}" for i in (1, 2, 3)]
+    assert result["remaining_open_balance"] == 290
+    assert db.get(Invoice, 1).amount_paid == 60 and db.get(Invoice, 4).amount_paid == 0
+    assert db.query(Payment).count() == 3
+    assert db.query(LedgerEntry).filter(LedgerEntry.entry_type == LedgerEntryType.PAYMENT).count() == 3
+    assert finance_summary.load_finance_summary(db, date(2024, 3, 25))["overall"].total_collected == 200
+
+def test_allocate_rejects_more_than_the_open_balance_and_writes_nothing(db):
+    _family(db)
+    with pytest.raises(ValueError, match="exceeds remaining balance"):
+        payments.allocate(db, 361, "cash", student_ids=[1])
+    assert db.query(Payment).count() == 0
+    assert db.get(Invoice, 2).amount_paid == 40
+
+    result = payments.allocate(db, 60, "cash", invoice_ids=[2])
+    assert result["allocations"][0]["receipt_number"] == result["receipt_number"]
+    assert db.get(Invoice, 2).status == InvoiceStatus.PAID
+
+def test_credit_adds_to_the_stored_amount_instead_of_overwriting_it(db):
+    _family(db)
+    stale = db.get(Invoice, 1)
+    db.query(Invoice).filter(Invoice.id == 1).update({"amount_paid": 100})  # another payment lands in between
+    db.commit()
+    db.execute(payments._credit(guarded=True), {"b_id": stale.id, "b_credit": 250})
+    assert db.get(Invoice, 1).amount_paid == 100  # the guard refuses to overpay
+
+    payments.post_payments(db, [(db.get(Invoice, 1), 50, date(2024, 3, 25))], "bank", None)
+    db.commit()
+    assert db.get(Invoice, 1).amount_paid == 150 and db.get(Invoice, 1).status == InvoiceStatus.PARTIAL
+
+def test_payment_endpoint_credits_in_the_database_and_refuses_overpayment(db):
+    _family(db)
+    clerk = User(id=1, email="accounts@fbs.test", hashed_password="x", full_name="Accounts", role=UserRole.ACCOUNTANT)
+    db.add(clerk)
+    db.commit()
+    stale = db.get(Invoice, 2)
+    db.query(Invoice).filter(Invoice.id == 2).update({"amount_paid": 70})  # another payment lands in between
+    db.commit()
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(fees.record_payment(fees.PaymentCreate(invoice_id=stale.id, amount=40, method="cash"), db=db, current_user=clerk))
+    assert exc.value.status_code == 400 and "exceeds remaining balance" in exc.value.detail
+    assert db.query(Payment).count() == 0
+
+    payment = asyncio.run(fees.record_payment(fees.PaymentCreate(invoice_id=2, amount=30, method="cash"), db=db, current_user=clerk))
+    assert (payment.amount, payment.invoice_id, payment.recorded_by) == (30, 2, 1)
+    invoice = db.get(Invoice, 2)
+    assert (invoice.amount_paid, invoice.status) == (100, InvoiceStatus.PAID)
+    assert db.query(LedgerEntry).filter(LedgerEntry.entry_type == LedgerEntryType.PAYMENT).count() == 1
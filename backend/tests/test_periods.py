@@ -0,0 +1,70 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import periods
+
+def test_closed_months_are_frozen_and_the_open_month_is_live(db):
+    db.add_all([Class(id=1, name="P1 A", grade_level="P1", academic_year="2024"),
+                Class(id=2, name="P2 A", grade_level="P2", academic_year="2024")])
+    for n, class_id in ((1, 1), (2, 2)):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L", class_id=class_id,
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+        db.add(Invoice(id=n, invoice_number=f"INV-{n}", student_id=n, category=PaymentCategory.TUITION if n == 1 else PaymentCategory.LUNCH,
+                       term="term_1", amount=100000, amount_paid=0, status=InvoiceStatus.PARTIAL))
+    payments = [(1, 10000, "cash", date(2024, 1, 15)), (2, 5000, "mtn_momo", date(2024, 1, 31)),
+                (1, 20000, "mtn_momo", date(2024, 3, 1)), (2, 7000, "cash", date(2024, 4, 2))]
+    for n, (invoice_id, amount, method, paid_on) in enumerate(payments, 1):
+        db.add(Payment(receipt_number=f"RCP-{n}", invoice_id=invoice_id, amount=amount, payment_method=method, payment_date=paid_on))
+    db.commit()
+
+    # Nothing closed yet: ended months are totalled live
+    history = periods.history(db, date(2024, 4, 10))
+    assert [(m["period"], m["total"], m["closed"]) for m in history["months"]] == [
+        ("2024-01", 15000, False), ("2024-02", 0, False), ("2024-03", 20000, False), ("2024-04", 7000, False)
+    ]
+    assert {m["key"]: m["total"] for m in history["method"]} == {"cash": 17000, "mtn_momo": 25000}
+    assert db.query(FinancialPeriod).count() == 0
+
+    periods.close_period(db, "2024-03", today=date(2024, 4, 10))
+    assert [m["closed"] for m in periods.history(db, date(2024, 4, 10))["months"]] == [False, False, True, False]
+    assert periods.ensure_closed(db, date(2024, 4, 10)) == 2
+    assert periods.ensure_closed(db, date(2024, 4, 10)) == 0
+    history = periods.history(db, date(2024, 4, 10))
+    assert [(m["period"], m["total"], m["closed"]) for m in history["months"]] == [
+        ("2024-01", 15000, True), ("2024-02", 0, True), ("2024-03", 20000, True), ("2024-04", 7000, False)
+    ]
+    assert {m["key"]: m["total"] for m in history["method"]} == {"cash": 17000, "mtn_momo": 25000}
+    assert {m["key"]: m["total"] for m in history["category"]} == {"tuition": 30000, "lunch": 12000}
+    assert {m["label"]: m["count"] for m in history["class"]} == {"P1 A": 2, "P2 A": 2}
+
+    # A payment backdated into a closed month shows up once the month is closed again
+    db.add(Payment(receipt_number="RCP-5", invoice_id=1, amount=1000, payment_method="cash", payment_date=date(2024, 2, 10)))
+    db.commit()
+    assert periods.history(db, date(2024, 4, 10))["months"][1]["total"] == 0
+    assert periods.close_period(db, "2024-02", today=date(2024, 4, 10)).total_collected == 1000
+    assert periods.history(db, date(2024, 4, 10))["months"][1]["total"] == 1000
+
+    with pytest.raises(ValueError):
+        periods.close_period(db, "2024-04", today=date(2024, 4, 10))
+
+def test_closing_again_replaces_the_totals_in_place(db):
+    db.add(Student(id=1, admission_number="FBS20240001", first_name="S", last_name="L",
+                   date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.add(Invoice(id=1, invoice_number="INV-1", student_id=1, category=PaymentCategory.TUITION,
+                   term="term_1", amount=100000, amount_paid=0, status=InvoiceStatus.PARTIAL))
+    db.add(Payment(receipt_number="RCP-1", invoice_id=1, amount=10000, payment_method="cash", payment_date=date(2024, 1, 15)))
+    db.commit()
+    period = periods.close_period(db, "2024-01", today=date(2024, 2, 1))
+    ids = {row.key: row.id for row in db.query(FinancialPeriodTotal).filter(FinancialPeriodTotal.dimension == "method")}
+
+    payment = db.query(Payment).one()
+    payment.payment_method = "mtn_momo"
+    db.add(Payment(receipt_number="RCP-2", invoice_id=1, amount=5000, payment_method="cash", payment_date=date(2024, 1, 20)))
+    db.commit()
+    periods.close_period(db, "2024-01", today=date(2024, 2, 1))
+
+    rows = {row.key: row for row in db.query(FinancialPeriodTotal).filter(
+        FinancialPeriodTotal.period_id == period.id, FinancialPeriodTotal.dimension == "method")}
+    assert {key: row.total for key, row in rows.items()} == {"cash": 5000, "mtn_momo": 10000}
+    assert rows["cash"].id == ids["cash"]
@@ -0,0 +1,79 @@
+import io
+import os
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.models.guardian import student_guardians
+from app.models.reconciliation import StatementLineStatus
+from app.services import ledger, reconciliation
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "momo_statement.csv")
+
+@pytest.fixture
+def school(db):
+    """Four students with a tuition invoice each; students 1 and 2 have guardians on file."""
+    for n in range(1, 5):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L",
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+        db.add(Invoice(id=n, invoice_number=f"INV-2024-0000{n}", student_id=n, category=PaymentCategory.TUITION,
+                       term="term_1", amount=50000, amount_paid=0, status=InvoiceStatus.PENDING))
+    for n, phone in ((1, "0788000001"), (2, "+250 788 000 002")):
+        guardian = Guardian(id=n, first_name="G", last_name=str(n), phone=phone)
+        db.add(guardian)
+        db.flush()
+        db.execute(student_guardians.insert().values(student_id=n, guardian_id=n))
+    db.add(Payment(receipt_number="RCP-HAND-1", invoice_id=4, amount=12000, payment_method="mtn_momo",
+                   payment_date=date(2024, 3, 7)))
+    db.get(Invoice, 4).amount_paid = 12000
+    db.get(Invoice, 4).status = InvoiceStatus.PARTIAL
+    db.commit()
+
+def test_import_matches_posts_and_queues(db, school):
+    with open(FIXTURE, "rb") as f:
+        statement = reconciliation.import_statement(db, f, "momo_statement.csv", "mtn_momo", batch_size=3)
+
+    lines = {line.transaction_id + (":dup" if line.status == StatementLineStatus.DUPLICATE else ""): line
+             for line in db.query(StatementLine).filter(StatementLine.transaction_id.isnot(None))}
+    assert (lines["TX1001"].status, lines["TX1001"].match_rule, lines["TX1001"].invoice_id) == (StatementLineStatus.MATCHED, "reference", 1)
+    assert (lines["TX1002"].match_rule, lines["TX1002"].invoice_id) == ("phone", 2)
+    assert (lines["TX1003"].match_rule, lines["TX1003"].invoice_id) == ("reference", 3)
+    assert lines["TX1004"].status == StatementLineStatus.REVIEW
+    assert lines["TX1005"].status == StatementLineStatus.IGNORED
+    assert "TX1001:dup" in lines
+    assert (lines["TX1006"].match_rule, lines["TX1006"].payment_id) == ("amount_date", 1)
+    assert (statement.matched_count, statement.review_count, statement.ignored_count, statement.duplicate_count) == (4, 2, 1, 1)
+    assert statement.matched_amount == 97000
+
+    assert db.query(Payment).count() == 4
+    assert db.get(Invoice, 1).status == InvoiceStatus.PAID
+    assert db.get(Invoice, 3).amount_paid == 15000
+    assert ledger.balance(db, 2) == 30000
+
+    with open(FIXTURE, "rb") as f:
+        again = reconciliation.import_statement(db, f, "momo_statement.csv", "mtn_momo")
+    assert again.matched_count == 0 and again.duplicate_count == 8
+    assert db.query(Payment).count() == 4
+
+def test_review_line_is_posted_against_the_chosen_invoice(db, school):
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    workbook.active.append(["Date", "Amount", "Narrative"])
+    workbook.active.append([date(2024, 3, 8), 60000, "unknown payer"])
+    workbook.active.append([date(2024, 3, 8), 5000, "unknown payer"])
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+
+    statement = reconciliation.import_statement(db, buffer, "bank.xlsx", "bank")
+    assert statement.review_count == 2
+    too_big, small = db.query(StatementLine).order_by(StatementLine.line_number).all()
+
+    with pytest.raises(ValueError):
+        reconciliation.resolve_line(db, too_big, db.get(Invoice, 4))
+    payment = reconciliation.resolve_line(db, small, db.get(Invoice, 4))
+    assert (payment.amount, payment.payment_method, payment.payment_date) == (5000, "bank", date(2024, 3, 8))
+    assert small.status == StatementLineStatus.RESOLVED
+    assert db.get(StatementImport, statement.id).review_count == 1
+    assert db.get(Invoice, 4).amount_paid == 17000
@@ -0,0 +1,24 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import InvoiceStatus, PaymentCategory
+from app.services import sequences
+
+def test_numbers_are_sequential_per_type_and_year(db):
+    assert sequences.next_number(db, "invoice", 2025) == "INV-2025-00001"
+    assert sequences.reserve_block(db, "invoice", 3, 2025) == ["INV-2025-00002", "INV-2025-00003", "INV-2025-00004"]
+    assert sequences.next_number(db, "receipt", 2025) == "RCP-2025-00001"
+    assert sequences.next_number(db, "invoice", 2026) == "INV-2026-00001"
+    assert sequences.next_number(db, "admission", 2026) == "FBS20260001"
+    assert sequences.reserve_block(db, "invoice", 0, 2025) == []
+
+def test_new_counter_continues_after_legacy_numbers(db):
+    for number in ("INV-2024-00007", "INV-2024-00012", "INV-2023-00090"):
+        db.add(Invoice(invoice_number=number, student_id=int(number[-2:]), category=PaymentCategory.TUITION,
+                       term="term_1", amount=100, status=InvoiceStatus.PENDING))
+    db.add(Student(admission_number="FBS20240041", first_name="A", last_name="B",
+                   date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.commit()
+
+    assert sequences.next_number(db, "invoice", 2024) == "INV-2024-00013"
+    assert sequences.next_number(db, "admission", 2024) == "FBS20240042"
@@ -0,0 +1,65 @@
+import pytest
+from datetime import date
+from app.models import *
+from app.models.fee import PaymentCategory, WalletTransactionType
+from app.services import wallets
+
+def test_batch_debits_never_overdraw_and_replays_are_ignored(db):
+    for n in (1, 2, 3):
+        db.add(Student(id=n, admission_number=f"FBS2024000{n}", first_name=f"S{n}", last_name="L",
+                       date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.add(ServiceItem(id=1, name="Lunch", category=PaymentCategory.LUNCH, unit_price=700))
+    db.commit()
+    wallets.top_up(db, 1, 2500, "cash", reference="TOP-1")
+    wallets.top_up(db, 1, 2500, "cash", reference="TOP-1")  # replayed top-up
+    wallets.top_up(db, 2, 500, "mtn_momo")
+
+    batch = [
+        {"reference": "POS1-1", "student_id": 1, "service_item_id": 1},
+        {"reference": "POS1-2", "student_id": 1, "service_item_id": 1, "quantity": 2},
+        {"reference": "POS1-3", "student_id": 1, "service_item_id": 1},  # only 400 left
+        {"reference": "POS1-4", "student_id": 2, "amount": 300, "description": "Snack"},
+        {"reference": "POS1-5", "student_id": 3, "service_item_id": 1},
+        {"reference": "POS1-6", "student_id": 2, "service_item_id": 99},
+        {"reference": "POS1-1", "student_id": 1, "service_item_id": 1},
+    ]
+    results = wallets.debit_batch(db, batch)
+    assert [r["status"] for r in results] == ["debited", "debited", "insufficient_funds", "debited", "no_wallet", "invalid", "duplicate"]
+    assert [r.get("balance") for r in results[:4]] == [1800, 400, 400, 200]
+    assert db.query(Wallet.balance).filter(Wallet.student_id == 1).scalar() == 400
+    assert db.query(Wallet.balance).filter(Wallet.student_id == 2).scalar() == 200
+
+    again = wallets.debit_batch(db, batch)
+    assert [r["status"] for r in again].count("duplicate") == 4
+    assert db.query(Wallet.balance).filter(Wallet.student_id == 1).scalar() == 400
+
+    statement = wallets.statement(db, 1)
+    assert [(t["type"], t["amount"], t["balance_after"]) for t in statement["transactions"]] == [
+        ("debit", 1400, 400), ("debit", 700, 1800), ("top_up", 2500, 2500)]
+
+def test_references_are_claimed_before_the_balance_moves(db):
+    db.add(Student(id=1, admission_number="FBS20240001", first_name="S", last_name="L",
+                   date_of_birth=date(2015, 1, 1), enrollment_date=date(2024, 1, 1)))
+    db.commit()
+    wallets.top_up(db, 1, 500, "cash")
+    # Another serving point already posted POS2-1 (e.g. a replay that won the race)
+    wallet_id = db.query(Wallet.id).scalar()
+    db.add(WalletTransaction(wallet_id=wallet_id, student_id=1, transaction_type=WalletTransactionType.DEBIT,
+                             amount=100, balance_after=400, reference="POS2-1"))
+    db.commit()
+
+    results = wallets.debit_batch(db, [
+        {"reference": "POS2-1", "student_id": 1, "amount": 100},
+        {"reference": "POS2-2", "student_id": 1, "amount": 800},
+        {"reference": "POS2-3", "student_id": 1, "amount": 200},
+    ])
+    assert [r["status"] for r in results] == ["duplicate", "insufficient_funds", "debited"]
+    assert db.query(Wallet.balance).scalar() == 300
+    assert db.query(WalletTransaction).filter(WalletTransaction.reference == "POS2-2").count() == 0
+
+    # The declined purchase goes through once the wallet is topped up
+    wallets.top_up(db, 1, 1000, "cash", reference="TOP-2")
+    assert wallets.top_up(db, 1, 1000, "cash", reference="TOP-2").balance_after == 1300
+    assert [r["status"] for r in wallets.debit_batch(db, [{"reference": "POS2-2", "student_id": 1, "amount": 800}])] == ["debited"]
+    assert db.query(WalletTransaction).filter(WalletTransaction.reference == "POS2-2").one().balance_after == 500
+    assert db.query(Wallet.balance).scalar() == 500